@@ -4,45 +4,67 @@ This module contains the command line interface for snipergw.
 
 import argparse
 import logging
+import sys
 
-from astropy.time import Time
-
-from snipergw.model import DEFAULT_STARTTIME, DEFAULT_TELESCOPE, EventConfig, PlanConfig
-from snipergw.run import run_snipergw
+from snipergw.cli import add_plan_arguments, parse_starttime
+from snipergw.model import EventConfig, get_plan_configs
+from snipergw.run import run_snipergw_multi
 
 logging.getLogger("snipergw").setLevel(logging.DEBUG)
 
+if (len(sys.argv) > 1) and (sys.argv[1] == "watch"):
+    from snipergw.watch import watch_cli
+
+    watch_cli(sys.argv[2:])
+    sys.exit(0)
+
+if (len(sys.argv) > 1) and (sys.argv[1] == "benchmark"):
+    from snipergw.benchmark import benchmark_cli
+
+    benchmark_cli(sys.argv[2:])
+    sys.exit(0)
+
+if (len(sys.argv) > 1) and (sys.argv[1] == "sweep"):
+    from snipergw.sweep import sweep_cli
+
+    sweep_cli(sys.argv[2:])
+    sys.exit(0)
+
+if (len(sys.argv) > 1) and (sys.argv[1] == "load"):
+    from snipergw.load import load_cli
+
+    load_cli(sys.argv[2:])
+    sys.exit(0)
+
+if (len(sys.argv) > 1) and (sys.argv[1] == "batch"):
+    from snipergw.batch import batch_cli
+
+    batch_cli(sys.argv[2:])
+    sys.exit(0)
+
 parser = argparse.ArgumentParser(
     prog="snipergw",
     description="Simple Nodal Interface for Planning "
     "Electromagnetic Reconnaissance of Gravitational Waves",
 )
 parser.add_argument("-e", "--event")
-parser.add_argument("-r", "--rev")
-parser.add_argument("-o", "--outputdir")
-parser.add_argument("-t", "--telescope", default=DEFAULT_TELESCOPE)
-parser.add_argument("-f", "--filters")
-parser.add_argument("--exposuretime")
-parser.add_argument("--subprogram", default="EMGW")
-parser.add_argument("-c", "--cache", default=False, action="store_true")
+parser.add_argument("-r", "--rev", type=int)
 parser.add_argument("-s", "--submit", default=False, action="store_true")
 parser.add_argument("-d", "--delete", default=False, action="store_true")
-parser.add_argument("-sg", "--use_both_grids", default=False, action="store_true")
-parser.add_argument("-st", "--starttime", default=None)
+parser.add_argument("--max_workers", type=int, default=None)
+add_plan_arguments(parser)
 args, gwemopt_args = parser.parse_known_args()
 
-if args.starttime is not None:
-    args.starttime = Time(args.starttime, format="isot", scale="utc")
-else:
-    args.starttime = DEFAULT_STARTTIME
+parse_starttime(args)
 
 event = EventConfig(**args.__dict__)
-plan_config = PlanConfig(**args.__dict__)
+plan_configs = get_plan_configs(**args.__dict__)
 
-run_snipergw(
+run_snipergw_multi(
     event=event,
-    plan_config=plan_config,
+    plan_configs=plan_configs,
     gwemopt_args=gwemopt_args,
     submit=args.submit,
     delete=args.delete,
+    max_workers=args.max_workers,
 )
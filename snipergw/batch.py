@@ -0,0 +1,518 @@
+"""
+This module contains the batch mode, which replays a list of events (e.g all
+superevents of an observing run, or a list of GRBs) through skymap download
+and planning, with the events spread across a process pool. All events share
+the skymap store and the plan cache, failed events are recorded rather than
+stopping the batch, and the results are aggregated in one table, with one row
+per event and telescope.
+"""
+
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+from astropy import units as u
+from astropy.time import Time
+from pydantic import BaseModel
+
+from snipergw.cli import add_plan_arguments
+from snipergw.coverage import read_coverage
+from snipergw.gracedb_index import DEFAULT_QUERY
+from snipergw.model import EventConfig, PlanConfig, get_plan_configs
+from snipergw.plan import run_gwemopt
+from snipergw.schedule import ScheduleSummary
+from snipergw.session import get_gracedb_client, retry_transient
+from snipergw.skymap import Skymap
+from snipergw.tracing import Span, trace_run, tracer
+
+logger = logging.getLogger(__name__)
+
+BATCH_NAME = "batch.csv"
+
+# Label of the plans of a batch, so replays never overwrite the schedules of live runs
+BATCH_LABEL = "batch"
+
+# Without a start time, each event is planned from its detection time plus this delay
+DEFAULT_DELAY_HOURS = 0.25
+
+# Stages whose runtime is reported in the results table
+BATCH_STAGES = ["skymap", "plan", "gwemopt"]
+
+# Columns of the results table
+RESULT_COLUMNS = [
+    "event",
+    "rev",
+    "event_name",
+    "revision",
+    "telescope",
+    "starttime",
+    "total_prob",
+    "area_deg2",
+    "n_fields",
+    "n_pointings",
+    "duration_hours",
+    "cached",
+    *[f"{x}_runtime" for x in BATCH_STAGES],
+    "runtime",
+    "error",
+]
+
+
+class BatchEvent(BaseModel):
+    """
+    An event of a batch, with an optional revision
+    """
+
+    event: str
+    rev: int | None = None
+
+
+class BatchResult(BaseModel):
+    """
+    Summary of the schedule planned for an event and telescope,
+    or the error raised
+    """
+
+    event: str
+    rev: int | None = None
+    event_name: str | None = None
+    revision: int | None = None
+    telescope: str
+    starttime: str | None = None
+    summary: ScheduleSummary | None = None
+    cached: bool | None = None
+    stage_runtimes: dict[str, float] = {}
+    runtime: float = 0.0
+    error: str | None = None
+
+    def to_row(self) -> dict[str, Any]:
+        """
+        Convert the result to a row of the results table
+
+        :return: Dictionary of column to value
+        """
+        row = self.model_dump(exclude={"summary", "stage_runtimes"})
+        if self.summary is not None:
+            row.update(self.summary.model_dump(exclude={"filters"}))
+        for stage in BATCH_STAGES:
+            row[f"{stage}_runtime"] = self.stage_runtimes.get(stage)
+        return row
+
+
+def read_event_list(path: Path) -> list[BatchEvent]:
+    """
+    Read a list of events, with one event per line and optionally its
+    revision after a space or comma, e.g 'S230529ay 2'. Empty lines
+    and lines starting with '#' are skipped.
+
+    :param path: Path of event list
+    :return: List of events
+    """
+    events = []
+    with open(path, encoding="utf8") as f:
+        for line in f:
+            line = line.split("#")[0].replace(",", " ").strip()
+            if line == "":
+                continue
+            fields = line.split()
+            if len(fields) > 2:
+                raise ValueError(f"Could not parse line '{line}' of {path}")
+            events.append(
+                BatchEvent(
+                    event=fields[0], rev=int(fields[1]) if len(fields) > 1 else None
+                )
+            )
+    return events
+
+
+def query_events(
+    query: str = DEFAULT_QUERY, max_events: int | None = None
+) -> list[BatchEvent]:
+    """
+    Get the superevents matching a GraceDB query, oldest first
+
+    :param query: GraceDB query, e.g 'category: Production created: 2023-05-24 ..'
+    :param max_events: Maximum number of superevents
+    :return: List of events
+    """
+
+    def list_superevents() -> list[str]:
+        return [
+            x["superevent_id"]
+            for x in get_gracedb_client().superevents(
+                query, orderby=["created"], max_results=max_events
+            )
+        ]
+
+    superevents = retry_transient(list_superevents)
+    logger.info(f"Found {len(superevents)} superevents in GraceDB for '{query}'")
+    return [BatchEvent(event=x) for x in superevents]
+
+
+def get_stage_runtimes(spans: list[Span], telescope: str) -> dict[str, float]:
+    """
+    Get the total runtime of each batch stage for one telescope.
+    Stages of other telescopes are ignored.
+
+    :param spans: Spans of the run of an event
+    :param telescope: Telescope
+    :return: Dictionary of stage to runtime in seconds
+    """
+    runtimes = {}
+    for x in spans:
+        if x.name not in BATCH_STAGES:
+            continue
+        if x.attributes.get("telescope", telescope) != telescope:
+            continue
+        runtimes[x.name] = runtimes.get(x.name, 0.0) + x.duration
+    return runtimes
+
+
+def run_batch_event(
+    batch_event: BatchEvent,
+    plan_configs: list[PlanConfig],
+    gwemopt_args: list[str],
+    output_dir: Path,
+    offline: bool = False,
+    starttime: Time | None = None,
+    delay_hours: float = DEFAULT_DELAY_HOURS,
+) -> list[BatchResult]:
+    """
+    Plan an event for each telescope, recording any error rather than raising it
+
+    :param batch_event: Event
+    :param plan_configs: Plan configs, one per telescope
+    :param gwemopt_args: gwemopt arguments
+    :param output_dir: Output directory, shared by all events
+    :param offline: Only use skymaps which are already in the store
+    :param starttime: Start time of the plans
+        (defaults to the detection time of the event plus a delay)
+    :param delay_hours: Delay of the default start time after the detection
+    :return: List of results, one per telescope
+    """
+    results = [
+        BatchResult(event=batch_event.event, rev=batch_event.rev, telescope=x.telescope)
+        for x in plan_configs
+    ]
+
+    t_start = time.perf_counter()
+    with tracer.collect() as spans:
+        try:
+            with trace_run(output_dir, event=batch_event.event) as run_span:
+                skymap = Skymap(
+                    EventConfig(
+                        event=batch_event.event,
+                        rev=batch_event.rev,
+                        output_dir=output_dir,
+                        offline=offline,
+                    )
+                )
+                run_span.set(event=skymap.event_name, revision=skymap.revision)
+
+                if starttime is None:
+                    starttime = skymap.t_obs + delay_hours * u.hour
+
+                for result, plan_config in zip(results, plan_configs):
+                    plan_config = plan_config.model_copy(
+                        update={"starttime": starttime}
+                    )
+                    result.event_name = skymap.event_name
+                    result.revision = skymap.revision
+                    result.starttime = starttime.isot
+
+                    t_plan = time.perf_counter()
+                    try:
+                        schedule = run_gwemopt(skymap, plan_config, list(gwemopt_args))
+                        result.summary = schedule.summarise(
+                            coverage=read_coverage(
+                                plan_config.get_output_dir(skymap.event_name)
+                            )
+                        )
+                    except Exception as exc:
+                        logger.exception(
+                            f"Planning failed for {batch_event.event} "
+                            f"with {plan_config.telescope}"
+                        )
+                        result.error = f"{type(exc).__name__}: {exc}"
+                    result.runtime = time.perf_counter() - t_plan
+
+                skymap.close()
+
+        except Exception as exc:
+            logger.exception(f"Batch failed for event {batch_event.event}")
+            for result in results:
+                result.error = f"{type(exc).__name__}: {exc}"
+                result.runtime = time.perf_counter() - t_start
+
+    for result in results:
+        result.stage_runtimes = get_stage_runtimes(spans, result.telescope)
+        plan_spans = [
+            x
+            for x in spans
+            if (x.name == "plan") & (x.attributes.get("telescope") == result.telescope)
+        ]
+        if len(plan_spans) > 0:
+            result.cached = plan_spans[-1].attributes.get("cached")
+        # The skymap is shared by all telescopes, so it counts towards each one
+        result.runtime += result.stage_runtimes.get("skymap", 0.0)
+
+    return results
+
+
+def get_batch_table(results: list[BatchResult]) -> pd.DataFrame:
+    """
+    Get the results table of a batch
+
+    :param results: List of results
+    :return: Table, with one row per event and telescope
+    """
+    return pd.DataFrame([x.to_row() for x in results]).reindex(columns=RESULT_COLUMNS)
+
+
+def read_completed(table_path: Path) -> set[tuple[str, str]]:
+    """
+    Get the (event, telescope) pairs of a previous batch which did not fail
+
+    :param table_path: Path of previous results table
+    :return: Set of (event, telescope)
+    """
+    if not table_path.exists():
+        return set()
+
+    table = pd.read_csv(table_path)
+    table = table[table["error"].isna()]
+    return set(zip(table["event"].astype(str), table["telescope"].astype(str)))
+
+
+def summarise_batch(table: pd.DataFrame) -> pd.DataFrame:
+    """
+    Summarise a results table per telescope
+
+    :param table: Results table
+    :return: Summary table, with one row per telescope
+    """
+    grouped = table.groupby("telescope")
+    return pd.DataFrame(
+        {
+            "n_events": grouped.size(),
+            "n_failed": grouped["error"].count(),
+            "median_prob": grouped["total_prob"].median(),
+            "mean_prob": grouped["total_prob"].mean(),
+            "median_hours": grouped["duration_hours"].median(),
+            "median_runtime": grouped["runtime"].median(),
+            "total_runtime": grouped["runtime"].sum(),
+        }
+    )
+
+
+def run_batch(
+    events: list[BatchEvent],
+    plan_configs: list[PlanConfig],
+    gwemopt_args: list[str] | None = None,
+    output_dir: Path | None = None,
+    table_path: Path | None = None,
+    offline: bool = False,
+    starttime: Time | None = None,
+    delay_hours: float = DEFAULT_DELAY_HOURS,
+    max_workers: int | None = None,
+    resume: bool = False,
+) -> pd.DataFrame:
+    """
+    Plan a list of events in parallel, with one event at a time per worker
+    process. The workers are reused between events, so they keep the telescope
+    setup warm (see snipergw.planner.WarmCache), and all events share the
+    skymap store and the plan cache of the output directory. The results table
+    is rewritten as each event finishes, so an interrupted batch can be resumed.
+
+    :param events: List of events
+    :param plan_configs: Plan configs, one per telescope
+    :param gwemopt_args: gwemopt arguments
+    :param output_dir: Output directory (defaults to that of the plan configs)
+    :param table_path: Path of results table (defaults to batch.csv in output_dir)
+    :param offline: Only use skymaps which are already in the store
+    :param starttime: Start time of all plans
+        (defaults to the detection time of each event plus a delay)
+    :param delay_hours: Delay of the default start time after the detection
+    :param max_workers: Maximum number of worker processes
+        (defaults to one per event, up to the number of CPUs)
+    :param resume: Skip the events and telescopes which succeeded in a previous
+        batch with the same results table, and keep their rows
+    :return: Results table, with one row per event and telescope
+    """
+    if gwemopt_args is None:
+        gwemopt_args = []
+
+    if output_dir is None:
+        output_dir = Path(plan_configs[0].output_dir)
+
+    if table_path is None:
+        table_path = output_dir.joinpath(BATCH_NAME)
+
+    # Replays are planned without plots, and never continue a previous plan
+    plan_configs = [
+        x.model_copy(
+            update={
+                "output_dir": output_dir,
+                "label": BATCH_LABEL if x.label is None else x.label,
+                "plots": False,
+                "background_plots": False,
+                "incremental": False,
+            }
+        )
+        for x in plan_configs
+    ]
+
+    previous = pd.DataFrame(columns=RESULT_COLUMNS)
+    if resume:
+        completed = read_completed(table_path)
+        if len(completed) > 0:
+            previous = pd.read_csv(table_path)
+            previous = previous[previous["error"].isna()]
+        todo = []
+        for batch_event in events:
+            remaining = [
+                x
+                for x in plan_configs
+                if (batch_event.event, x.telescope) not in completed
+            ]
+            if len(remaining) > 0:
+                todo.append((batch_event, remaining))
+        logger.info(
+            f"Resuming batch, with {len(events) - len(todo)} of "
+            f"{len(events)} events already completed"
+        )
+    else:
+        todo = [(x, plan_configs) for x in events]
+
+    if max_workers is None:
+        max_workers = min(max(len(todo), 1), os.cpu_count() or 1)
+
+    logger.info(
+        f"Planning {len(todo)} events for "
+        f"{', '.join(x.telescope for x in plan_configs)} "
+        f"with {max_workers} worker processes"
+    )
+
+    table_path.parent.mkdir(parents=True, exist_ok=True)
+
+    order = {x.event: i for i, x in enumerate(events)}
+    results = []
+    t_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                run_batch_event,
+                batch_event,
+                configs,
+                gwemopt_args,
+                output_dir,
+                offline,
+                starttime,
+                delay_hours,
+            ): (batch_event, configs)
+            for batch_event, configs in todo
+        }
+        for i, future in enumerate(as_completed(futures)):
+            batch_event, configs = futures[future]
+            try:
+                results += future.result()
+            except Exception as exc:
+                # e.g a worker process which died
+                logger.exception(f"Worker failed for event {batch_event.event}")
+                results += [
+                    BatchResult(
+                        event=batch_event.event,
+                        rev=batch_event.rev,
+                        telescope=x.telescope,
+                        error=f"{type(exc).__name__}: {exc}",
+                    )
+                    for x in configs
+                ]
+
+            table = pd.concat(
+                [x for x in [previous, get_batch_table(results)] if len(x) > 0],
+                ignore_index=True,
+            ).reindex(columns=RESULT_COLUMNS)
+            table = table.sort_values(
+                "event", key=lambda x: x.map(order), kind="stable"
+            ).reset_index(drop=True)
+            table.to_csv(table_path, index=False)
+
+            logger.info(
+                f"Finished {i + 1}/{len(todo)} events "
+                f"in {time.perf_counter() - t_start:.1f}s"
+            )
+
+    if len(todo) == 0:
+        table = previous.reindex(columns=RESULT_COLUMNS)
+
+    n_failed = table["error"].notna().sum()
+    logger.info(
+        f"Planned {len(todo)} events in {time.perf_counter() - t_start:.1f}s, "
+        f"with {n_failed} failures. See results at {table_path}"
+    )
+
+    return table
+
+
+def batch_cli(argv: list[str]):
+    """
+    Command line interface for the batch mode
+
+    :param argv: Command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        prog="snipergw batch",
+        description="Plan a list of events in parallel, e.g to replay past events "
+        "with a new strategy, and aggregate the results in one table",
+    )
+    parser.add_argument("events", nargs="*", help="Event names or skymap files")
+    parser.add_argument("--event_list", help="File with one event per line")
+    parser.add_argument("--query", help="GraceDB query selecting superevents")
+    parser.add_argument("--max_events", type=int, default=None)
+    parser.add_argument("--max_workers", type=int, default=None)
+    parser.add_argument("--table", default=None)
+    parser.add_argument("--delay", type=float, default=DEFAULT_DELAY_HOURS)
+    parser.add_argument("--resume", default=False, action="store_true")
+    add_plan_arguments(parser)
+    args, gwemopt_args = parser.parse_known_args(argv)
+
+    events = [BatchEvent(event=x) for x in args.events]
+    if args.event_list is not None:
+        events += read_event_list(Path(args.event_list))
+    if args.query is not None:
+        events += query_events(args.query, max_events=args.max_events)
+
+    if len(events) == 0:
+        parser.error("Give events, an --event_list or a --query")
+
+    names = [x.event for x in events]
+    if len(set(names)) != len(names):
+        parser.error("Each event can only be given once")
+
+    # Without a start time, each event is planned from its own detection time
+    starttime = args.starttime
+    if starttime is not None:
+        starttime = Time(starttime, format="isot", scale="utc")
+
+    table = run_batch(
+        events,
+        plan_configs=get_plan_configs(
+            **{k: v for k, v in args.__dict__.items() if k != "starttime"}
+        ),
+        gwemopt_args=gwemopt_args,
+        output_dir=Path(args.output_dir),
+        table_path=None if args.table is None else Path(args.table),
+        offline=args.offline,
+        starttime=starttime,
+        delay_hours=args.delay,
+        max_workers=args.max_workers,
+        resume=args.resume,
+    )
+
+    print(summarise_batch(table).to_string())
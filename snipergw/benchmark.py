@@ -0,0 +1,489 @@
+"""
+This module contains an offline benchmark suite. Synthetic flat and
+multi-order skymaps of a given resolution and credible area are generated
+locally, and each stage from reading the skymap to submitting the schedule is
+timed separately. ZTF and WINTER submissions go to local stand-ins for the
+Kowalski queue and the WINTER API (see snipergw.simulator), so no network
+access is needed.
+Results are written to a JSON report, which can be compared between versions.
+"""
+
+import argparse
+import logging
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from importlib.metadata import version
+from pathlib import Path
+from typing import Callable
+from unittest.mock import patch
+
+import healpy as hp
+import numpy as np
+import pandas as pd
+from astropy.io import fits
+from astropy.time import Time
+from pydantic import BaseModel
+
+from snipergw.model import EventConfig, PlanConfig
+from snipergw.plan import run_gwemopt
+from snipergw.schedule import Schedule
+from snipergw.skymap import Skymap
+
+logger = logging.getLogger(__name__)
+
+# Synthetic skymaps are centred on a position observable from Palomar
+# shortly after the detection time
+SYNTHETIC_RA = 245.0
+SYNTHETIC_DEC = 20.0
+SYNTHETIC_DATE_OBS = "2019-04-25T08:18:05"
+SYNTHETIC_STARTTIME = "2019-04-25T09:00:00"
+
+# Radius of the 90% credible region of a 2D gaussian, in units of sigma
+SIGMA_90 = np.sqrt(2.0 * np.log(10.0))
+
+# Multi-order skymaps keep the full resolution inside this credible region
+MOC_CREDIBLE_LEVEL = 0.99
+MOC_COARSENING = 2
+
+# Delay before the start of the synthetic schedules which are submitted
+SCHEDULE_DELAY_DAYS = 0.1
+
+DEFAULT_REGRESSION_TOLERANCE = 0.25
+
+ALL_STAGES = ["read_skymap", "plan", "submit_ztf", "submit_winter"]
+
+
+class BenchmarkCase(BaseModel):
+    """
+    Synthetic skymap used for a benchmark
+    """
+
+    nside: int = 256
+    area: float = 100.0
+    moc: bool = False
+    ra: float = SYNTHETIC_RA
+    dec: float = SYNTHETIC_DEC
+
+    @property
+    def name(self) -> str:
+        """
+        Name of the case
+        """
+        kind = "moc" if self.moc else "flat"
+        return f"{kind}_nside{self.nside}_{self.area:.0f}deg2"
+
+
+class BenchmarkResult(BaseModel):
+    """
+    Timings of one stage for one case, in seconds
+    """
+
+    stage: str
+    case: str
+    times: list[float]
+
+    @property
+    def key(self) -> str:
+        """
+        Key used to match results between reports
+        """
+        return f"{self.stage}/{self.case}"
+
+    @property
+    def median(self) -> float:
+        """
+        Median time
+        """
+        return statistics.median(self.times)
+
+
+class BenchmarkReport(BaseModel):
+    """
+    Benchmark results, with the versions they were measured with
+    """
+
+    created: str
+    python: str
+    platform: str
+    versions: dict[str, str]
+    results: list[BenchmarkResult] = []
+
+    @classmethod
+    def new(cls) -> "BenchmarkReport":
+        """
+        Create an empty report for the current environment
+
+        :return: BenchmarkReport
+        """
+        return cls(
+            created=Time.now().isot,
+            python=sys.version.split()[0],
+            platform=platform.platform(),
+            versions={x: version(x) for x in ["snipergw", "gwemopt", "numpy"]},
+        )
+
+    @classmethod
+    def read(cls, path: Path) -> "BenchmarkReport":
+        """
+        Read a report
+
+        :param path: Path of report
+        :return: BenchmarkReport
+        """
+        with open(path, "r", encoding="utf8") as f:
+            return cls.model_validate_json(f.read())
+
+    def write(self, path: Path):
+        """
+        Write the report
+
+        :param path: Path of report
+        """
+        with open(path, "w", encoding="utf8") as f:
+            f.write(self.model_dump_json(indent=2))
+
+
+def write_benchmark_skymap(path: Path, case: BenchmarkCase) -> np.ndarray:
+    """
+    Write a synthetic 3D skymap with a gaussian blob, whose 90% credible region
+    covers the area of the case. Multi-order skymaps are written at a coarser
+    resolution outside the 99% credible region, like real multi-order skymaps.
+
+    :param path: Output path
+    :param case: Benchmark case
+    :return: Probability per pixel, at the full resolution in NESTED ordering
+    """
+    npix = hp.nside2npix(case.nside)
+    vecs = np.array(hp.pix2vec(case.nside, np.arange(npix), nest=True)).T
+    centre = hp.ang2vec(case.ra, case.dec, lonlat=True)
+    ang = np.rad2deg(np.arccos(np.clip(vecs @ centre, -1.0, 1.0)))
+    sigma = np.sqrt(case.area / np.pi) / SIGMA_90
+    prob = np.exp(-0.5 * (ang / sigma) ** 2)
+    prob /= np.sum(prob)
+
+    probdensity = prob / hp.nside2pixarea(case.nside)
+    order = hp.nside2order(case.nside)
+
+    if case.moc:
+        rank = np.argsort(prob)[::-1]
+        n_region = np.searchsorted(np.cumsum(prob[rank]), MOC_CREDIBLE_LEVEL) + 1
+        in_region = np.zeros(npix, dtype=bool)
+        in_region[rank[:n_region]] = True
+
+        # Pixels are grouped with their siblings at a coarser order,
+        # unless any of them is in the credible region
+        n_children = 4**MOC_COARSENING
+        fine = np.repeat(in_region.reshape(-1, n_children).any(axis=1), n_children)
+        coarse_ipix = np.flatnonzero(~fine[::n_children])
+        coarse_order = order - MOC_COARSENING
+
+        uniq = np.concatenate(
+            [
+                4 * 4**order + np.flatnonzero(fine),
+                4 * 4**coarse_order + coarse_ipix,
+            ]
+        )
+        values = np.concatenate(
+            [
+                probdensity[fine],
+                probdensity.reshape(-1, n_children).mean(axis=1)[coarse_ipix],
+            ]
+        )
+        columns = [
+            fits.Column(name="UNIQ", format="K", array=uniq),
+            fits.Column(name="PROBDENSITY", format="D", array=values),
+        ]
+        n_rows = len(uniq)
+    else:
+        columns = [fits.Column(name="PROB", format="D", array=prob)]
+        n_rows = npix
+
+    columns += [
+        fits.Column(name=name, format="D", array=np.full(n_rows, value))
+        for name, value in [("DISTMU", 100.0), ("DISTSIGMA", 20.0), ("DISTNORM", 1e-4)]
+    ]
+
+    hdu = fits.BinTableHDU.from_columns(columns)
+    hdu.header["ORDERING"] = "NUNIQ" if case.moc else "NESTED"
+    hdu.header["DATE-OBS"] = SYNTHETIC_DATE_OBS
+    hdu.header["DISTMEAN"] = 100.0
+    hdu.header["DISTSTD"] = 20.0
+    fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(path, overwrite=True)
+
+    return prob
+
+
+def make_benchmark_schedule(n_pointings: int, filters: list[str]) -> Schedule:
+    """
+    Make a synthetic schedule starting now, cycling through fields and filters.
+    Submissions are validated against the current time, so unlike the skymaps,
+    the schedule cannot use a fixed date.
+
+    :param n_pointings: Number of pointings
+    :param filters: Filters to cycle through
+    :return: Schedule
+    """
+    t_start = Time.now().mjd + SCHEDULE_DELAY_DAYS
+    texp = 300.0
+    return Schedule.from_dataframe(
+        pd.DataFrame(
+            {
+                "field": 200 + np.arange(n_pointings) // len(filters),
+                "filter": [filters[i % len(filters)] for i in range(n_pointings)],
+                "tobs": t_start + np.arange(n_pointings) * texp / 86400.0,
+                "texp": np.full(n_pointings, texp),
+                "prob": np.full(n_pointings, 1.0 / n_pointings),
+            }
+        )
+    )
+
+
+def time_repeats(func: Callable, repeat: int) -> list[float]:
+    """
+    Time repeated calls of a function
+
+    :param func: Function without arguments
+    :param repeat: Number of calls
+    :return: Time of each call in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        t_start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t_start)
+    return times
+
+
+def run_benchmarks(
+    cases: list[BenchmarkCase],
+    stages: list[str] | None = None,
+    repeat: int = 3,
+    n_pointings: int = 500,
+) -> BenchmarkReport:
+    """
+    Run the benchmarks in a temporary directory. The first plan of each case
+    includes setting up gwemopt, so its time is usually an outlier.
+
+    :param cases: Benchmark cases
+    :param stages: Stages to time (defaults to all)
+    :param repeat: Number of times each stage is run
+    :param n_pointings: Number of pointings in the schedules submitted
+    :return: BenchmarkReport
+    """
+    if stages is None:
+        stages = ALL_STAGES
+
+    report = BenchmarkReport.new()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_dir = Path(tmp_dir)
+        skymap_dir = output_dir.joinpath("skymaps")
+        skymap_dir.mkdir()
+
+        starttime = Time(SYNTHETIC_STARTTIME, format="isot", scale="utc")
+
+        for case in cases:
+            name = f"{case.name}.{'multiorder.' if case.moc else ''}fits"
+            write_benchmark_skymap(skymap_dir.joinpath(name), case)
+            event_config = EventConfig(event=name, output_dir=output_dir)
+            plan_config = PlanConfig(
+                output_dir=output_dir, starttime=starttime, cache=False, plots=False
+            )
+
+            timings = {}
+
+            if "read_skymap" in stages:
+
+                def read_skymap():
+                    skymap = Skymap(event_config=event_config)
+                    skymap.preprocess(nside=plan_config.nside)
+                    skymap.close()
+
+                timings["read_skymap"] = time_repeats(read_skymap, repeat)
+
+            if "plan" in stages:
+                skymap = Skymap(event_config=event_config)
+                timings["plan"] = time_repeats(
+                    lambda: run_gwemopt(skymap, plan_config, []), repeat
+                )
+                skymap.close()
+
+            for stage, result in timings.items():
+                report.results.append(
+                    BenchmarkResult(stage=stage, case=case.name, times=result)
+                )
+                logger.info(
+                    f"{stage} of {case.name} took {statistics.median(result):.3f}s "
+                    f"(median of {repeat})"
+                )
+
+        report.results += benchmark_submission(output_dir, stages, repeat, n_pointings)
+
+    return report
+
+
+def benchmark_submission(
+    output_dir: Path, stages: list[str], repeat: int, n_pointings: int
+) -> list[BenchmarkResult]:
+    """
+    Time the construction and submission of targets to the local stand-ins
+    for ZTF and WINTER
+
+    :param output_dir: Output directory
+    :param stages: Stages to time
+    :param repeat: Number of times each stage is run
+    :param n_pointings: Number of pointings in the schedules submitted
+    :return: List of results
+    """
+    from snipergw.simulator import LocalQueue, LocalWinterAPI
+    from snipergw.submit.winter import build_winter_targets, submit_too_winter
+    from snipergw.submit.ztf import build_ztf_targets, submit_too_ztf
+
+    results = []
+    case = f"{n_pointings}_pointings"
+
+    if "submit_ztf" in stages:
+        plan_config = PlanConfig(output_dir=output_dir)
+        schedule = make_benchmark_schedule(n_pointings, ["g", "r"])
+
+        def submit_ztf():
+            LocalQueue.triggers = {}
+            submit_too_ztf(schedule, "benchmark", plan_config, submit=True)
+
+        with patch("snipergw.submit.ztf.Queue", LocalQueue):
+            results += [
+                BenchmarkResult(
+                    stage="build_ztf_targets",
+                    case=case,
+                    times=time_repeats(
+                        lambda: build_ztf_targets(schedule, plan_config.subprogram),
+                        repeat,
+                    ),
+                ),
+                BenchmarkResult(
+                    stage="submit_ztf",
+                    case=case,
+                    times=time_repeats(submit_ztf, repeat),
+                ),
+            ]
+
+    if "submit_winter" in stages:
+        plan_config = PlanConfig(output_dir=output_dir, telescope="WINTER")
+        schedule = make_benchmark_schedule(n_pointings, ["J"])
+        t_start, t_end = schedule["tobs"].min(), schedule["tobs"].max()
+
+        with patch("snipergw.submit.winter.get_winter_api", LocalWinterAPI):
+            results += [
+                BenchmarkResult(
+                    stage="build_winter_targets",
+                    case=case,
+                    times=time_repeats(
+                        lambda: build_winter_targets(
+                            schedule, "benchmark", plan_config, t_start, t_end
+                        ),
+                        repeat,
+                    ),
+                ),
+                BenchmarkResult(
+                    stage="submit_winter",
+                    case=case,
+                    times=time_repeats(
+                        lambda: submit_too_winter(
+                            schedule, "benchmark", plan_config, submit=True
+                        ),
+                        repeat,
+                    ),
+                ),
+            ]
+
+    for result in results:
+        logger.info(
+            f"{result.stage} of {result.case} took {result.median:.3f}s "
+            f"(median of {repeat})"
+        )
+
+    return results
+
+
+def compare_reports(
+    baseline: BenchmarkReport,
+    current: BenchmarkReport,
+    tolerance: float = DEFAULT_REGRESSION_TOLERANCE,
+) -> pd.DataFrame:
+    """
+    Compare the median times of two reports
+
+    :param baseline: Baseline report
+    :param current: Current report
+    :param tolerance: Fractional slowdown above which a stage counts as a regression
+    :return: Table with one row per stage and case in both reports
+    """
+    baseline_medians = {x.key: x.median for x in baseline.results}
+    rows = [
+        {
+            "key": x.key,
+            "baseline": baseline_medians[x.key],
+            "current": x.median,
+            "ratio": x.median / baseline_medians[x.key],
+        }
+        for x in current.results
+        if x.key in baseline_medians
+    ]
+    table = pd.DataFrame(rows, columns=["key", "baseline", "current", "ratio"])
+    table["regression"] = table["ratio"] > 1.0 + tolerance
+    return table
+
+
+def benchmark_cli(argv: list[str]):
+    """
+    Command line interface for the benchmark suite
+
+    :param argv: Command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        prog="snipergw benchmark",
+        description="Time each stage of snipergw offline, with synthetic skymaps "
+        "and local stand-ins for the telescope APIs",
+    )
+    parser.add_argument("-o", "--output", default="benchmark.json")
+    parser.add_argument("--nside", type=int, nargs="+", default=[256])
+    parser.add_argument("--area", type=float, nargs="+", default=[100.0, 1000.0])
+    parser.add_argument(
+        "--format", choices=["flat", "moc"], nargs="+", default=["flat", "moc"]
+    )
+    parser.add_argument("--stages", choices=ALL_STAGES, nargs="+", default=ALL_STAGES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--n_pointings", type=int, default=500)
+    parser.add_argument("--compare", default=None)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_REGRESSION_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    cases = [
+        BenchmarkCase(nside=nside, area=area, moc=x == "moc")
+        for x in args.format
+        for nside in args.nside
+        for area in args.area
+    ]
+
+    report = run_benchmarks(
+        cases, stages=args.stages, repeat=args.repeat, n_pointings=args.n_pointings
+    )
+    report.write(Path(args.output))
+    logger.info(f"Saved benchmark results to {args.output}")
+
+    for result in report.results:
+        print(
+            f"{result.key:50s} median {result.median:8.3f}s  "
+            f"min {min(result.times):8.3f}s"
+        )
+
+    if args.compare is not None:
+        comparison = compare_reports(
+            BenchmarkReport.read(Path(args.compare)), report, tolerance=args.tolerance
+        )
+        print(comparison.to_string(index=False))
+        if comparison["regression"].any():
+            sys.exit(1)
@@ -0,0 +1,47 @@
+"""
+This module contains the command line arguments shared by the snipergw commands
+"""
+
+import argparse
+
+from astropy.time import Time
+
+from snipergw.model import DEFAULT_TELESCOPE, get_default_starttime
+from snipergw.paths import base_output_dir
+
+
+def add_plan_arguments(parser: argparse.ArgumentParser):
+    """
+    Add the arguments used to configure planning to a parser
+
+    :param parser: Argument parser
+    """
+    parser.add_argument("-o", "--outputdir", dest="output_dir", default=base_output_dir)
+    parser.add_argument("-t", "--telescope", default=DEFAULT_TELESCOPE)
+    parser.add_argument("-f", "--filters")
+    parser.add_argument("--exposuretime")
+    parser.add_argument("--subprogram", default="EMGW")
+    parser.add_argument(
+        "-c", "--cache", default=True, action=argparse.BooleanOptionalAction
+    )
+    parser.add_argument("-sg", "--use_both_grids", default=False, action="store_true")
+    parser.add_argument("-st", "--starttime", default=None)
+    parser.add_argument("--offline", default=False, action="store_true")
+    parser.add_argument("--nside", type=int, default=None)
+    parser.add_argument("--credible_level", type=float, default=None)
+    parser.add_argument("--background_plots", default=False, action="store_true")
+    parser.add_argument("--incremental", default=False, action="store_true")
+
+
+def parse_starttime(args: argparse.Namespace):
+    """
+    Convert the starttime argument to a Time, using the default if not given.
+    The default is rounded, so reruns shortly after each other plan from the
+    same start time.
+
+    :param args: Parsed arguments
+    """
+    if args.starttime is not None:
+        args.starttime = Time(args.starttime, format="isot", scale="utc")
+    else:
+        args.starttime = get_default_starttime()
@@ -0,0 +1,359 @@
+"""
+This module contains the pixel-exact coverage of a schedule. The Footprints
+class stores the HEALPix pixels covered by each scheduled field, with the
+probability of each pixel, and is saved with every plan. The coverage curve
+then gives the probability and area first covered by each pointing, in time
+order, overall, per filter and per night. Overlapping fields (e.g from both
+ZTF grids) only count each pixel once.
+
+Each union is computed in one pass over the (pointing, pixel) pairs of the
+schedule: pointings are sorted by time, so the first occurrence of a pixel
+is the pointing which first covers it.
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from astropy.time import Time
+from pydantic import BaseModel
+
+from snipergw.schedule import PALOMAR_TIMEZONE, Schedule
+
+logger = logging.getLogger(__name__)
+
+COVERAGE_CURVE_NAME = "coverage.csv"
+COVERAGE_SUMMARY_NAME = "coverage.json"
+
+# Timezone of each telescope, used to assign pointings to nights
+TELESCOPE_TIMEZONES = {
+    "ZTF": PALOMAR_TIMEZONE,
+    "WINTER": PALOMAR_TIMEZONE,
+    "DECam": "America/Santiago",
+}
+
+SQ_DEG_PER_SR = np.degrees(1.0) ** 2
+
+
+class CoverageSummary(BaseModel):
+    """
+    Pixel-exact coverage of a schedule
+    """
+
+    n_pointings: int
+    total_prob: float
+    area_deg2: float
+    filters: dict[str, float] = {}
+    nights: dict[str, float] = {}
+
+
+class Footprints:
+    """
+    Pixels (RING ordering) covered by each field of a schedule, stored
+    as a sparse field x pixel matrix over the union of all footprints,
+    with the skymap probability of each of these pixels
+    """
+
+    def __init__(
+        self,
+        telescope: str,
+        nside: int,
+        field_ids: np.ndarray,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        pixels: np.ndarray,
+        prob: np.ndarray | None = None,
+    ):
+        """
+        :param telescope: Telescope name
+        :param nside: HEALPix nside
+        :param field_ids: Sorted field IDs, one per row
+        :param indptr: CSR row pointers, of length n_fields + 1
+        :param indices: CSR column indices, into pixels
+        :param pixels: Sorted HEALPix pixels of the union of all footprints
+        :param prob: Probability per pixel (defaults to zero)
+        """
+        self.telescope = telescope
+        self.nside = int(nside)
+        self.field_ids = np.asarray(field_ids, dtype=np.int64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.pixels = np.asarray(pixels, dtype=np.int64)
+        if prob is None:
+            prob = np.zeros(len(self.pixels))
+        self.prob = np.asarray(prob, dtype=float)
+
+    def __len__(self) -> int:
+        return len(self.field_ids)
+
+    @property
+    def pixel_area(self) -> float:
+        """
+        Area of one pixel in square degrees
+        """
+        return 4.0 * np.pi * SQ_DEG_PER_SR / (12 * self.nside**2)
+
+    @classmethod
+    def from_tiles(
+        cls,
+        telescope: str,
+        nside: int,
+        tile_struct: dict,
+        field_ids: list[int] | np.ndarray | None = None,
+    ) -> "Footprints":
+        """
+        Build the footprints from gwemopt tiles
+
+        :param telescope: Telescope name
+        :param nside: HEALPix nside of the tile pixels
+        :param tile_struct: Dictionary of field ID to tile, each with an "ipix" list
+        :param field_ids: Fields to keep (defaults to all tiles)
+        :return: Footprints, with zero probability
+        """
+        tiles = {int(k): v for k, v in tile_struct.items()}
+        if field_ids is None:
+            field_ids = list(tiles)
+        field_ids = np.unique(np.asarray(field_ids, dtype=np.int64))
+
+        missing = [x for x in field_ids.tolist() if x not in tiles]
+        if len(missing) > 0:
+            raise KeyError(f"No {telescope} tiles for fields {missing}")
+
+        ipixs = [
+            np.unique(np.asarray(tiles[x]["ipix"], dtype=np.int64)) for x in field_ids
+        ]
+        indptr = np.zeros(len(ipixs) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(x) for x in ipixs])
+        all_ipix = np.concatenate(ipixs) if ipixs else np.zeros(0, dtype=np.int64)
+        pixels, indices = np.unique(all_ipix, return_inverse=True)
+
+        return cls(
+            telescope=telescope,
+            nside=nside,
+            field_ids=field_ids,
+            indptr=indptr,
+            indices=indices,
+            pixels=pixels,
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "Footprints":
+        """
+        Load footprints written with save
+
+        :param path: Path of .npz file
+        :return: Footprints
+        """
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                telescope=str(data["telescope"]),
+                nside=int(data["nside"]),
+                field_ids=data["field_ids"],
+                indptr=data["indptr"],
+                indices=data["indices"],
+                pixels=data["pixels"],
+                prob=data["prob"],
+            )
+
+    def save(self, path: Path):
+        """
+        Save the footprints. The file is renamed into place once complete.
+
+        :param path: Path of .npz file
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.stem}.{os.getpid()}.tmp.npz")
+        np.savez(
+            tmp_path,
+            telescope=np.array(self.telescope),
+            nside=np.array(self.nside),
+            field_ids=self.field_ids,
+            indptr=self.indptr,
+            indices=self.indices,
+            pixels=self.pixels,
+            prob=self.prob,
+        )
+        os.replace(tmp_path, path)
+
+    def get_rows(self, field_ids: np.ndarray) -> np.ndarray:
+        """
+        Get the row of each field
+
+        :param field_ids: Field IDs
+        :return: Row indices
+        """
+        field_ids = np.asarray(field_ids, dtype=np.int64)
+        rows = np.searchsorted(self.field_ids, field_ids)
+        found = rows < len(self.field_ids)
+        found[found] = self.field_ids[rows[found]] == field_ids[found]
+        if not np.all(found):
+            missing = np.unique(field_ids[~found]).tolist()
+            raise ValueError(f"No {self.telescope} footprints for fields {missing}")
+        return rows
+
+    def get_new_coverage(
+        self, rows: np.ndarray, groups: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Get the probability and number of pixels first covered by each pointing,
+        within the union of the pointings of its group
+
+        :param rows: Row of the field of each pointing, in time order
+        :param groups: Group of each pointing, as integers (defaults to one group)
+        :return: Probability and number of pixels first covered by each pointing
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+
+        # Gather the (pointing, pixel) pairs of all pointings, in pointing order
+        pointing = np.repeat(np.arange(len(rows)), lengths)
+        offsets = np.arange(len(pointing)) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths
+        )
+        pixels = self.indices[np.repeat(starts, lengths) + offsets]
+
+        keys = pixels
+        if groups is not None:
+            keys = pixels + np.asarray(groups, dtype=np.int64)[pointing] * len(
+                self.pixels
+            )
+
+        # Pointings are in time order, so the first occurrence of each key
+        # is the pointing which first covers the pixel in its group
+        _, first = np.unique(keys, return_index=True)
+        new_prob = np.bincount(
+            pointing[first], weights=self.prob[pixels[first]], minlength=len(rows)
+        )
+        new_pixels = np.bincount(pointing[first], minlength=len(rows))
+        return new_prob, new_pixels
+
+
+def get_nights(tobs: np.ndarray, timezone: str = PALOMAR_TIMEZONE) -> np.ndarray:
+    """
+    Get the night of each observation time, as the local date of the evening
+
+    :param tobs: Observation times (MJD)
+    :param timezone: Timezone of the telescope
+    :return: Night of each time, e.g '2019-04-24'
+    """
+    if len(tobs) == 0:
+        return np.zeros(0, dtype=str)
+    local = (
+        pd.Series(Time(np.asarray(tobs), format="mjd").datetime64)
+        .dt.tz_localize("UTC")
+        .dt.tz_convert(timezone)
+    )
+    return (local - pd.Timedelta(hours=12)).dt.strftime("%Y-%m-%d").to_numpy()
+
+
+def get_coverage_curve(
+    schedule: Schedule,
+    footprints: Footprints,
+    timezone: str | None = None,
+) -> pd.DataFrame:
+    """
+    Get the cumulative probability and area covered by a schedule, pointing by
+    pointing in time order: overall, within each filter and within each night
+
+    :param schedule: Schedule
+    :param footprints: Footprints of the scheduled fields
+    :param timezone: Timezone used to assign nights
+        (defaults to that of the footprint telescope)
+    :return: Table with one row per pointing, in time order
+    """
+    if timezone is None:
+        timezone = TELESCOPE_TIMEZONES.get(footprints.telescope, PALOMAR_TIMEZONE)
+
+    tobs = schedule["tobs"].to_numpy(dtype=float)
+    order = np.argsort(tobs, kind="stable")
+    tobs = tobs[order]
+    fields = schedule["field"].to_numpy(dtype=np.int64)[order]
+    filters = schedule["filter"].astype(str).to_numpy()[order]
+    nights = get_nights(tobs, timezone=timezone)
+
+    rows = footprints.get_rows(fields)
+
+    columns = {"tobs": tobs, "field": fields, "filter": filters, "night": nights}
+
+    new_prob, new_pixels = footprints.get_new_coverage(rows)
+    columns["prob_new"] = new_prob
+    columns["prob_cumulative"] = np.cumsum(new_prob)
+    columns["area_cumulative"] = np.cumsum(new_pixels) * footprints.pixel_area
+
+    for name, values in [("filter", filters), ("night", nights)]:
+        _, groups = np.unique(values, return_inverse=True)
+        new_prob, _ = footprints.get_new_coverage(rows, groups=groups)
+        columns[f"prob_{name}_cumulative"] = (
+            pd.Series(new_prob).groupby(groups).cumsum().to_numpy()
+        )
+
+    return pd.DataFrame(columns)
+
+
+def summarise_coverage(curve: pd.DataFrame) -> CoverageSummary:
+    """
+    Summarise a coverage curve
+
+    :param curve: Coverage curve, from get_coverage_curve
+    :return: CoverageSummary
+    """
+    if len(curve) == 0:
+        return CoverageSummary(n_pointings=0, total_prob=0.0, area_deg2=0.0)
+
+    return CoverageSummary(
+        n_pointings=len(curve),
+        total_prob=float(curve["prob_cumulative"].iloc[-1]),
+        area_deg2=float(curve["area_cumulative"].iloc[-1]),
+        filters={
+            str(k): float(v)
+            for k, v in curve.groupby("filter")["prob_filter_cumulative"].last().items()
+        },
+        nights={
+            str(k): float(v)
+            for k, v in curve.groupby("night")["prob_night_cumulative"].last().items()
+        },
+    )
+
+
+def write_coverage(curve: pd.DataFrame, output_dir: Path) -> CoverageSummary:
+    """
+    Write a coverage curve and its summary to an output directory
+
+    :param curve: Coverage curve
+    :param output_dir: Output directory
+    :return: CoverageSummary
+    """
+    summary = summarise_coverage(curve)
+    curve.to_csv(output_dir.joinpath(COVERAGE_CURVE_NAME), index=False)
+    with open(output_dir.joinpath(COVERAGE_SUMMARY_NAME), "w", encoding="utf8") as f:
+        f.write(summary.model_dump_json(indent=2))
+    return summary
+
+
+def read_coverage(output_dir: Path) -> CoverageSummary | None:
+    """
+    Read the coverage summary of the plan in an output directory
+
+    :param output_dir: Output directory of a plan
+    :return: CoverageSummary, or None if there is none
+    """
+    path = Path(output_dir).joinpath(COVERAGE_SUMMARY_NAME)
+    if not path.exists():
+        return None
+    with open(path, encoding="utf8") as f:
+        return CoverageSummary(**json.load(f))
+
+
+def remove_coverage(output_dir: Path):
+    """
+    Remove the coverage of a previous plan from an output directory
+
+    :param output_dir: Output directory of a plan
+    """
+    for name in [COVERAGE_CURVE_NAME, COVERAGE_SUMMARY_NAME]:
+        Path(output_dir).joinpath(name).unlink(missing_ok=True)
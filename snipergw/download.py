@@ -0,0 +1,300 @@
+"""
+This module contains the download engine used for skymaps: files are streamed
+to disk in chunks, resumed with HTTP Range requests, and only renamed
+to their final path once complete. The ETag (or Last-Modified time) of a
+partial file is kept next to it, and sent with If-Range when resuming,
+so a file which has changed since is downloaded again from the start. Processes downloading the same file take
+turns, so they never append to the same partial file at once.
+"""
+
+import fcntl
+import logging
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import requests
+from pydantic import BaseModel
+
+from snipergw.session import (
+    get_backoff_delay,
+    get_session,
+    http_config,
+    is_permanent_error,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 2**20
+DEFAULT_MAX_ATTEMPTS = 5
+
+
+class DownloadError(Exception):
+    """
+    Error raised when a download cannot be completed
+    """
+
+
+class IncompleteDownloadError(DownloadError):
+    """
+    Error raised when the connection ends before the full file is received
+    """
+
+
+class DownloadResult(BaseModel):
+    """
+    Summary of a completed download
+    """
+
+    url: str
+    path: Path
+    size: int
+    n_bytes_downloaded: int
+    duration_s: float
+    resumed: bool = False
+
+    @property
+    def throughput(self) -> float:
+        """
+        Throughput in MB/s of the bytes actually transferred
+        """
+        return self.n_bytes_downloaded / max(self.duration_s, 1e-6) / 1.0e6
+
+
+def get_part_path(output_path: Path) -> Path:
+    """
+    Get the path of the partial file used while downloading
+
+    :param output_path: Final path
+    :return: Partial path
+    """
+    return output_path.with_name(output_path.name + ".part")
+
+
+def get_validator_path(part_path: Path) -> Path:
+    """
+    Get the path of the file recording the version of a partial file
+
+    :param part_path: Partial file path
+    :return: Validator path
+    """
+    return part_path.with_name(part_path.name + ".validator")
+
+
+def get_validator(response: requests.Response) -> str | None:
+    """
+    Get the validator of a response which can be sent with If-Range:
+    a strong ETag, or otherwise the Last-Modified time
+
+    :param response: Response
+    :return: Validator, or None if the response has neither
+    """
+    etag = response.headers.get("ETag")
+    if (etag is not None) and (not etag.startswith("W/")):
+        return etag
+    return response.headers.get("Last-Modified")
+
+
+@contextmanager
+def lock_download(part_path: Path):
+    """
+    Context manager holding an exclusive lock on a partial file,
+    so only one process (or thread) at a time writes to it
+
+    :param part_path: Partial file path
+    """
+    lock_path = part_path.with_name(part_path.name + ".lock")
+    with open(lock_path, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def get_total_size(response: requests.Response, offset: int) -> int | None:
+    """
+    Get the total size of a file from the headers of a (partial) response
+
+    :param response: Response
+    :param offset: Number of bytes requested to be skipped
+    :return: Total size in bytes, or None if unknown
+    """
+    if response.status_code == 206:
+        content_range = response.headers.get("Content-Range", "")
+        total = content_range.split("/")[-1]
+        if total.isdigit():
+            return int(total)
+
+    content_length = response.headers.get("Content-Length")
+    if content_length is not None:
+        return int(content_length) + offset
+
+    return None
+
+
+def download_chunks(
+    url: str,
+    part_path: Path,
+    chunk_size: int,
+    timeout: float,
+    session: requests.Session,
+) -> tuple[int, bool]:
+    """
+    Stream a URL to a partial file, appending to any existing partial content
+
+    :param url: URL to download
+    :param part_path: Partial file path
+    :param chunk_size: Chunk size in bytes
+    :param timeout: Timeout in seconds for connecting and for each chunk
+    :param session: Session to use
+    :return: Number of bytes downloaded, whether the download was resumed
+    """
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    validator_path = get_validator_path(part_path)
+
+    headers = {"Accept-Encoding": "identity"}
+    if offset > 0:
+        headers["Range"] = f"bytes={offset}-"
+        # The server only sends the rest of the file if it has not changed
+        if validator_path.exists():
+            headers["If-Range"] = validator_path.read_text()
+
+    with session.get(
+        url, headers=headers, stream=True, timeout=(timeout, timeout)
+    ) as response:
+        if (response.status_code == 416) & (offset > 0):
+            # Range not satisfiable, so the partial file is stale
+            part_path.unlink()
+            validator_path.unlink(missing_ok=True)
+            raise IncompleteDownloadError(f"Stale partial download of {url}")
+
+        response.raise_for_status()
+
+        resumed = response.status_code == 206
+        if not resumed:
+            if offset > 0:
+                logger.info(
+                    f"Could not resume {url}, as it has changed (or the server "
+                    f"ignores ranges), so it is downloaded from the start"
+                )
+            offset = 0
+            validator = get_validator(response)
+            if validator is None:
+                validator_path.unlink(missing_ok=True)
+            else:
+                validator_path.write_text(validator)
+
+        total_size = get_total_size(response, offset)
+
+        n_bytes = 0
+        with open(part_path, "ab" if resumed else "wb") as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                n_bytes += len(chunk)
+
+    size = part_path.stat().st_size
+    if (total_size is not None) & (size != total_size):
+        raise IncompleteDownloadError(
+            f"Downloaded {size} of {total_size} bytes from {url}"
+        )
+
+    return n_bytes, resumed
+
+
+def download_file(
+    url: str,
+    output_path: Path,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    timeout: float | None = None,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    session: requests.Session | None = None,
+    part_path: Path | None = None,
+) -> DownloadResult:
+    """
+    Download a URL to a path. The file is streamed in chunks to a partial file,
+    and renamed atomically once complete. Interrupted downloads are resumed
+    with HTTP Range requests, including partial files left by a previous run,
+    unless the file has changed since.
+    The partial file is locked while downloading, so concurrent downloads of
+    the same file wait for each other rather than interleaving their bytes.
+
+    :param url: URL to download
+    :param output_path: Final path of file
+    :param chunk_size: Chunk size in bytes
+    :param timeout: Timeout in seconds for connecting and for each chunk
+        (defaults to the read timeout of the shared HTTP configuration)
+    :param max_attempts: Maximum number of attempts
+    :param session: Session to use (defaults to the shared session)
+    :param part_path: Partial file path (defaults to the output path with
+        a .part suffix). Processes downloading the same URL to different
+        output paths can share it, to resume each other's downloads.
+    :return: DownloadResult
+    """
+    if session is None:
+        session = get_session()
+
+    if timeout is None:
+        timeout = http_config.read_timeout
+
+    output_path = Path(output_path)
+    if part_path is None:
+        part_path = get_part_path(output_path)
+
+    with lock_download(part_path):
+        n_bytes = 0
+        resumed = False
+        t_start = time.perf_counter()
+
+        for attempt in range(max_attempts):
+            try:
+                n_bytes_attempt, resumed_attempt = download_chunks(
+                    url,
+                    part_path=part_path,
+                    chunk_size=chunk_size,
+                    timeout=timeout,
+                    session=session,
+                )
+                n_bytes += n_bytes_attempt
+                resumed = resumed | resumed_attempt
+                break
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.HTTPError,
+                IncompleteDownloadError,
+            ) as exc:
+                if is_permanent_error(exc):
+                    raise
+
+                logger.warning(
+                    f"Download of {url} failed (attempt {attempt + 1}/{max_attempts}): "
+                    f"{exc}"
+                )
+                if attempt + 1 == max_attempts:
+                    raise DownloadError(
+                        f"Failed to download {url} after {max_attempts} attempts"
+                    ) from exc
+                time.sleep(get_backoff_delay(attempt))
+
+        os.replace(part_path, output_path)
+        get_validator_path(part_path).unlink(missing_ok=True)
+
+        result = DownloadResult(
+            url=url,
+            path=output_path,
+            size=output_path.stat().st_size,
+            n_bytes_downloaded=n_bytes,
+            duration_s=time.perf_counter() - t_start,
+            resumed=resumed,
+        )
+
+    logger.info(
+        f"Downloaded {result.size / 1.0e6:.1f} MB from {url} "
+        f"in {result.duration_s:.2f}s ({result.throughput:.2f} MB/s"
+        f"{', resumed' if resumed else ''})"
+    )
+
+    return result
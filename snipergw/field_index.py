@@ -0,0 +1,275 @@
+"""
+This module contains the FieldIndex class, a sparse field x pixel matrix
+mapping each field of a telescope grid to the HEALPix pixels it covers.
+
+The grids are static, so the index is built once per telescope, grid and nside,
+and stored on disk. Field probabilities for a new skymap are then a single
+sparse matrix-vector product, which is used to pre-filter fields before
+scheduling and for quick coverage estimates.
+
+This module also contains tile_values, an equivalent of gwemopt's
+compute_tiles_map which uses the same sparse layout rather than
+repeated set operations.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from importlib import metadata
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+FIELD_INDEX_VERSION = 1
+
+
+class FieldIndex:
+    """
+    Sparse index of the HEALPix pixels (RING ordering) covered by each field
+    """
+
+    def __init__(
+        self,
+        telescope: str,
+        nside: int,
+        field_ids: np.ndarray,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+    ):
+        """
+        :param telescope: Telescope name
+        :param nside: HEALPix nside
+        :param field_ids: Field IDs, one per row
+        :param indptr: CSR row pointers, of length n_fields + 1
+        :param indices: CSR pixel indices
+        """
+        self.telescope = telescope
+        self.nside = int(nside)
+        self.field_ids = np.asarray(field_ids, dtype=np.int64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(self.indices)), self.indices, self.indptr),
+            shape=(len(self.field_ids), 12 * self.nside**2),
+        )
+
+    def __len__(self) -> int:
+        return len(self.field_ids)
+
+    @classmethod
+    def from_tiles(cls, telescope: str, nside: int, tile_struct: dict) -> "FieldIndex":
+        """
+        Build the index from gwemopt tiles (e.g a MOC struct)
+
+        :param telescope: Telescope name
+        :param nside: HEALPix nside of the tile pixels
+        :param tile_struct: Dictionary of field ID to tile, each with an "ipix" list
+        :return: FieldIndex
+        """
+        ipixs = [
+            np.asarray(tile["ipix"], dtype=np.int64).ravel()
+            for tile in tile_struct.values()
+        ]
+        indptr = np.zeros(len(ipixs) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(x) for x in ipixs])
+        indices = np.concatenate(ipixs) if ipixs else np.zeros(0, dtype=np.int64)
+        return cls(
+            telescope=telescope,
+            nside=nside,
+            field_ids=np.array(list(tile_struct.keys()), dtype=np.int64),
+            indptr=indptr,
+            indices=indices,
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "FieldIndex":
+        """
+        Load an index written with save
+
+        :param path: Path of .npz file
+        :return: FieldIndex
+        """
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                telescope=str(data["telescope"]),
+                nside=int(data["nside"]),
+                field_ids=data["field_ids"],
+                indptr=data["indptr"],
+                indices=data["indices"],
+            )
+
+    def save(self, path: Path):
+        """
+        Save the index. The file is renamed into place once complete.
+
+        :param path: Path of .npz file
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.stem}.{os.getpid()}.tmp.npz")
+        np.savez(
+            tmp_path,
+            telescope=np.array(self.telescope),
+            nside=np.array(self.nside),
+            field_ids=self.field_ids,
+            indptr=self.indptr,
+            indices=self.indices,
+        )
+        os.replace(tmp_path, path)
+
+    def field_probs(self, prob: np.ndarray) -> np.ndarray:
+        """
+        Sum a skymap over each field, counting overlapping pixels in every field
+
+        :param prob: Probability per pixel, in RING ordering at the index nside
+        :return: Probability per field, in the order of field_ids
+        """
+        return self.matrix @ np.asarray(prob, dtype=float)
+
+    def select_fields(self, prob: np.ndarray, min_prob: float = 0.0) -> np.ndarray:
+        """
+        Select the fields containing more than a minimum probability
+
+        :param prob: Probability per pixel, in RING ordering at the index nside
+        :param min_prob: Minimum probability per field
+        :return: Field IDs, ordered by decreasing probability
+        """
+        field_probs = self.field_probs(prob)
+        mask = field_probs > min_prob
+        order = np.argsort(-field_probs[mask], kind="stable")
+        return self.field_ids[mask][order]
+
+    def coverage(self, prob: np.ndarray, field_ids: list[int]) -> float:
+        """
+        Estimate the probability covered by a set of fields,
+        counting each pixel only once
+
+        :param prob: Probability per pixel, in RING ordering at the index nside
+        :param field_ids: Field IDs
+        :return: Covered probability
+        """
+        rows = np.flatnonzero(np.isin(self.field_ids, field_ids))
+        covered = np.zeros(self.matrix.shape[1], dtype=bool)
+        covered[self.matrix[rows].indices] = True
+        return float(np.sum(np.asarray(prob)[covered]))
+
+
+def get_field_index_key(telescope: str, nside: int, **kwargs) -> str:
+    """
+    Get the key of a field index
+
+    :param telescope: Telescope name
+    :param nside: HEALPix nside
+    :param kwargs: Any other parameters which change the field footprints
+    :return: Key
+    """
+    inputs = {
+        "version": FIELD_INDEX_VERSION,
+        "gwemopt": metadata.version("gwemopt"),
+        "telescope": telescope,
+        "nside": nside,
+        **kwargs,
+    }
+    digest = hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+    return f"{telescope}_nside{nside}_{digest[:16]}"
+
+
+def load_field_index(
+    index_dir: Path, key: str, telescope: str, nside: int, tile_struct: dict
+) -> FieldIndex:
+    """
+    Load a field index from disk, or build and save it from gwemopt tiles
+
+    :param index_dir: Directory of field indexes
+    :param key: Key of index, from get_field_index_key
+    :param telescope: Telescope name
+    :param nside: HEALPix nside
+    :param tile_struct: gwemopt tiles to build the index from
+    :return: FieldIndex
+    """
+    path = Path(index_dir).joinpath(f"{key}.npz")
+    if path.exists():
+        try:
+            return FieldIndex.load(path)
+        except (OSError, ValueError, KeyError) as exc:
+            logger.warning(f"Rebuilding unreadable field index {path}: {exc}")
+
+    index = FieldIndex.from_tiles(telescope, nside, tile_struct)
+    index.save(path)
+    logger.info(f"Saved field index with {len(index)} {telescope} fields to {path}")
+    return index
+
+
+def tile_values(
+    params: dict,
+    tile_struct: dict,
+    skymap: np.ndarray,
+    func: str = "np.sum(x)",
+    ipix_keep: np.ndarray | list = (),
+) -> np.ndarray:
+    """
+    Compute a value per tile from a skymap, giving the same result as gwemopt's
+    compute_tiles_map for the "np.sum(x)" and "np.nanmedian(x)" functions.
+
+    Tiles are processed in order, and pixels covered by an earlier tile
+    count as zero (or NaN, for the median) in later tiles.
+    Tiles where the fraction of such pixels exceeds params["maximumOverlap"]
+    are given a value of zero.
+
+    :param params: gwemopt params
+    :param tile_struct: gwemopt tiles, each with an "ipix" list
+    :param skymap: Value per pixel
+    :param func: Either "np.sum(x)" or "np.nanmedian(x)"
+    :param ipix_keep: Pixels exempt from the overlap fraction, as in gwemopt
+    :return: Value per tile
+    """
+    if func == "np.sum(x)":
+        fill, reduce = 0.0, np.sum
+    elif func == "np.nanmedian(x)":
+        fill, reduce = np.nan, np.nanmedian
+    else:
+        raise ValueError(f"Unsupported tile function {func}")
+
+    skymap = np.asarray(skymap)
+    values = np.where(skymap < 0, fill, skymap)
+    # gwemopt marks covered pixels with -1, so pixels equal to -1 already count
+    claimed = skymap == -1
+    keep = np.zeros(len(skymap), dtype=bool)
+    keep[np.asarray(ipix_keep, dtype=np.int64)] = True
+
+    maximum_overlap = params["maximumOverlap"]
+    vals = np.full(len(tile_struct), np.nan)
+
+    for ii, tile in enumerate(tile_struct.values()):
+        ipix = np.asarray(tile["ipix"], dtype=np.int64)
+
+        if len(ipix) == 0:
+            vals[ii] = 0.0
+            continue
+
+        overlap = claimed[ipix]
+        if maximum_overlap < 1.0:
+            # gwemopt compares the positions of overlapping pixels within
+            # the tile to ipix_keep, rather than the pixels themselves
+            positions = np.flatnonzero(overlap)
+            positions = positions[positions < len(keep)]
+            n_overlap = len(positions) - np.sum(keep[positions])
+            rat = float(n_overlap) / float(len(ipix))
+        else:
+            rat = 0.0
+
+        if rat > maximum_overlap:
+            vals[ii] = 0.0
+        else:
+            x = values[ipix]
+            x[overlap] = fill
+            vals[ii] = reduce(x)
+
+        keep[ipix] = False
+        claimed[ipix] = True
+
+    return vals
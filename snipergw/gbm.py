@@ -0,0 +1,300 @@
+"""
+This module contains the discovery of Fermi-GBM skymaps on HEASARC.
+Directory listings (the yearly trigger index and each trigger's 'current/'
+directory) are cached locally, and refreshed with conditional requests
+(ETag/If-Modified-Since) once they are older than a maximum age.
+The candidate triggers of a date are fetched concurrently, and several
+GRBs can be resolved in one call, sharing the listings they have in common.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from lxml import html
+from pydantic import BaseModel
+
+from snipergw.session import get
+
+logger = logging.getLogger(__name__)
+
+GBM_TRIGGER_URL = os.getenv(
+    "SNIPERGW_GBM_URL", "https://heasarc.gsfc.nasa.gov/FTP/fermi/data/gbm/triggers"
+)
+
+# Age in seconds after which a cached listing is revalidated
+DEFAULT_MAX_AGE = float(os.getenv("SNIPERGW_GBM_MAX_AGE", 600.0))
+
+DEFAULT_MAX_WORKERS = 8
+
+GRB_NAME_REGEX = re.compile(r"^GRB(\d{2})(\d{2})(\d{2})([A-Z])$")
+
+
+class GRBName(BaseModel):
+    """
+    Parsed name of a GRB, e.g GRB210729A
+    """
+
+    name: str
+    year: str
+    date: str
+    letter: str
+
+    @property
+    def index(self) -> int:
+        """
+        Index of the GRB among those of the same date
+        """
+        return ord(self.letter) - ord("A")
+
+
+def parse_grb_name(event_name: str) -> GRBName:
+    """
+    Parse a GRB name
+
+    :param event_name: Name of GRB, e.g 'GRB210729A' or 'grb 210729a'
+    :return: GRBName
+    """
+    name = event_name.upper().replace(" ", "")
+    match = GRB_NAME_REGEX.match(name)
+    if match is None:
+        raise ValueError(
+            f"GRB name {event_name} not recognised. "
+            f"They must have the form 'GRB210729A'"
+        )
+    year, month, day, letter = match.groups()
+    return GRBName(name=name, year=f"20{year}", date=year + month + day, letter=letter)
+
+
+class CachedListing(BaseModel):
+    """
+    Links of a directory listing, with the validators of the response
+    """
+
+    url: str
+    links: list[str]
+    etag: str | None = None
+    last_modified: str | None = None
+    fetched: float
+
+
+class ListingCache:
+    """
+    On-disk cache of HTTP directory listings, revalidated with
+    conditional requests
+    """
+
+    def __init__(self, cache_dir: Path, max_age: float = DEFAULT_MAX_AGE):
+        """
+        :param cache_dir: Directory of cached listings
+        :param max_age: Age in seconds after which a listing is revalidated
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_age = max_age
+        self.n_requests = 0
+        self.n_not_modified = 0
+
+    def get_path(self, url: str) -> Path:
+        """
+        Get the path of the cached listing of a URL
+
+        :param url: URL of listing
+        :return: Path
+        """
+        key = hashlib.sha256(url.encode()).hexdigest()[:24]
+        return self.cache_dir.joinpath(f"{key}.json")
+
+    def read(self, url: str) -> CachedListing | None:
+        """
+        Read the cached listing of a URL
+
+        :param url: URL of listing
+        :return: CachedListing, or None if not cached (or unreadable)
+        """
+        path = self.get_path(url)
+        if not path.exists():
+            return None
+        try:
+            with open(path, encoding="utf8") as f:
+                return CachedListing(**json.load(f))
+        except (OSError, ValueError) as exc:
+            logger.warning(f"Ignoring unreadable cached listing {path}: {exc}")
+            return None
+
+    def write(self, listing: CachedListing):
+        """
+        Write a listing to the cache. The file is replaced atomically.
+
+        :param listing: Listing
+        """
+        path = self.get_path(listing.url)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{time.time_ns()}.tmp")
+        with open(tmp_path, "w", encoding="utf8") as f:
+            f.write(listing.model_dump_json())
+        os.replace(tmp_path, path)
+
+    def get_links(self, url: str, max_age: float | None = None) -> list[str]:
+        """
+        Get the links of a directory listing, using the cache if it is
+        fresh enough, and otherwise revalidating it
+
+        :param url: URL of listing
+        :param max_age: Age in seconds after which the listing is revalidated
+            (defaults to the max age of the cache)
+        :return: List of links
+        """
+        if max_age is None:
+            max_age = self.max_age
+
+        cached = self.read(url)
+        if (cached is not None) and (time.time() - cached.fetched < max_age):
+            return cached.links
+
+        headers = {}
+        if cached is not None:
+            if cached.etag is not None:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified is not None:
+                headers["If-Modified-Since"] = cached.last_modified
+
+        self.n_requests += 1
+        response = get(url, headers=headers)
+
+        if (response.status_code == 304) & (cached is not None):
+            self.n_not_modified += 1
+            logger.debug(f"Listing {url} not modified")
+            cached.fetched = time.time()
+            self.write(cached)
+            return cached.links
+
+        listing = CachedListing(
+            url=url,
+            links=html.fromstring(response.content).xpath("//a/@href"),
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+            fetched=time.time(),
+        )
+        self.write(listing)
+        return listing.links
+
+
+def get_candidate_triggers(
+    cache: ListingCache, year: str, dates: set[str]
+) -> dict[str, list[str]]:
+    """
+    Get the trigger directories of each date from the yearly trigger index.
+    If a date has no trigger in the cached index, it is revalidated once,
+    since new triggers are added as they happen.
+
+    :param cache: Listing cache
+    :param year: Year, e.g '2021'
+    :param dates: Dates of the form YYMMDD
+    :return: Dictionary of date to sorted list of trigger names, e.g 'bn210729123'
+    """
+    url = f"{GBM_TRIGGER_URL}/{year}/"
+
+    def select(links: list[str]) -> dict[str, list[str]]:
+        triggers = {date: set() for date in dates}
+        for link in links:
+            name = link.strip("/")
+            if name.startswith("bn") & (name[2:8] in triggers):
+                triggers[name[2:8]].add(name)
+        return {date: sorted(names) for date, names in triggers.items()}
+
+    triggers = select(cache.get_links(url))
+    if any(len(x) == 0 for x in triggers.values()):
+        triggers = select(cache.get_links(url, max_age=0.0))
+
+    return triggers
+
+
+def get_healpix_link(cache: ListingCache, year: str, trigger: str) -> str | None:
+    """
+    Get the URL of the latest HEALPix skymap of a trigger
+
+    :param cache: Listing cache
+    :param year: Year of trigger
+    :param trigger: Trigger name, e.g 'bn210729123'
+    :return: URL, or None if the trigger has no HEALPix skymap (e.g TGFs)
+    """
+    url = f"{GBM_TRIGGER_URL}/{year}/{trigger}/current/"
+    links = [x for x in cache.get_links(url) if "glg_healpix" in x]
+    if len(links) == 0:
+        return None
+    return url + max(links)
+
+
+def get_grb_skymap_urls(
+    event_names: list[str],
+    cache_dir: Path,
+    max_age: float = DEFAULT_MAX_AGE,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+) -> dict[str, str]:
+    """
+    Find the Fermi-GBM HEALPix skymap of several GRBs.
+    The yearly trigger index is fetched once per year, and the
+    candidate triggers of all GRBs are fetched concurrently.
+    Triggers without a skymap (e.g TGFs, SGR flares) are skipped, and the
+    GRB letter selects among the remaining triggers of its date.
+
+    :param event_names: Names of GRBs, e.g ['GRB210729A']
+    :param cache_dir: Directory of cached listings
+    :param max_age: Age in seconds after which a cached listing is revalidated
+    :param max_workers: Maximum number of concurrent requests
+    :return: Dictionary of GRB name to skymap URL
+    """
+    cache = ListingCache(cache_dir, max_age=max_age)
+    grbs = [parse_grb_name(x) for x in event_names]
+
+    candidates = {}
+    for year in sorted({x.year for x in grbs}):
+        candidates[year] = get_candidate_triggers(
+            cache, year, {x.date for x in grbs if x.year == year}
+        )
+
+    triggers = sorted(
+        {(x.year, trigger) for x in grbs for trigger in candidates[x.year][x.date]}
+    )
+
+    with ThreadPoolExecutor(max_workers=max(min(max_workers, len(triggers)), 1)) as ex:
+        skymap_links = dict(
+            zip(
+                triggers,
+                ex.map(lambda x: get_healpix_link(cache, *x), triggers),
+            )
+        )
+
+    logger.debug(
+        f"Resolved {len(triggers)} GBM triggers with {cache.n_requests} requests "
+        f"({cache.n_not_modified} not modified)"
+    )
+
+    urls = {}
+    for grb in grbs:
+        links = [
+            skymap_links[(grb.year, trigger)]
+            for trigger in candidates[grb.year][grb.date]
+            if skymap_links[(grb.year, trigger)] is not None
+        ]
+
+        if len(links) > 1:
+            logger.info(
+                f"Found {len(links)} GBM triggers with skymaps on {grb.date}. "
+                f"Will choose the one corresponding the GRB letter {grb.letter}"
+            )
+
+        if grb.index >= len(links):
+            raise ValueError(
+                f"No Fermi-GBM skymap found for {grb.name}: "
+                f"{len(links)} triggers with skymaps on {grb.date}"
+            )
+
+        urls[grb.name] = links[grb.index]
+
+    return urls
@@ -0,0 +1,363 @@
+"""
+This module contains the SupereventIndex class, a local index of GraceDB
+superevents and their VOEvents. It is synced incrementally: only superevents
+newer than the newest indexed one are listed, the VOEvent list of a superevent
+is only fetched for revisions which are not yet indexed, and the skymap URL of
+each VOEvent is only parsed from its XML once.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+import lxml.etree
+from ligo.gracedb.rest import GraceDb
+from pydantic import BaseModel
+
+from snipergw.session import get, retry_transient
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUERY = "category: Production"
+
+# Page size when listing superevents, newest first
+DEFAULT_PAGE_SIZE = 10
+
+# Maximum number of new superevents listed in one sync
+DEFAULT_MAX_NEW = 50
+
+
+class IndexedVOEvent(BaseModel):
+    """
+    Index entry for a VOEvent of a superevent
+    """
+
+    revision: int
+    filename: str
+    file_url: str
+    created: str | None = None
+    skymap_url: str | None = None
+    voevent_type: str | None = None
+
+    @property
+    def is_retraction(self) -> bool:
+        """
+        Whether the VOEvent retracts the superevent
+        """
+        return (self.voevent_type == "RE") | ("Retraction" in self.filename)
+
+
+class IndexedSuperevent(BaseModel):
+    """
+    Index entry for a superevent
+    """
+
+    superevent_id: str
+    created: str | None = None
+    listed: bool = False
+    voevents: list[IndexedVOEvent] = []
+
+    def get_voevent(self, revision: int) -> IndexedVOEvent | None:
+        """
+        Get an indexed VOEvent
+
+        :param revision: Revision number
+        :return: VOEvent, or None if it is not indexed
+        """
+        for voevent in self.voevents:
+            if voevent.revision == revision:
+                return voevent
+        return None
+
+
+def parse_skymap_url(xml: bytes) -> str:
+    """
+    Get the skymap URL from the XML of a VOEvent
+
+    :param xml: VOEvent XML
+    :return: URL of skymap
+    """
+    root = lxml.etree.fromstring(xml)
+    params = {
+        elem.attrib["name"]: elem.attrib["value"] for elem in root.iterfind(".//Param")
+    }
+    return params["skymap_fits"]
+
+
+class SupereventIndex:
+    """
+    Local index of GraceDB superevents, newest first, with their VOEvents
+    """
+
+    def __init__(self, base_dir: Path, query: str = DEFAULT_QUERY):
+        """
+        :param base_dir: Directory of the index
+        :param query: GraceDB query selecting the superevents to index
+        """
+        self.base_dir = Path(base_dir)
+        self.query = query
+        self.index_path = self.base_dir.joinpath("superevents.json")
+        self.lock_path = self.base_dir.joinpath("superevents.lock")
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        """
+        Context manager holding an exclusive lock on the index
+        """
+        with open(self.lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_index(self) -> list[IndexedSuperevent]:
+        """
+        Read the index
+
+        :return: List of superevents, newest first
+        """
+        if not self.index_path.exists():
+            return []
+
+        with open(self.index_path, "r") as f:
+            index = json.load(f)
+
+        if index.get("query") != self.query:
+            return []
+
+        return [IndexedSuperevent(**x) for x in index["superevents"]]
+
+    def _write_index(self, superevents: list[IndexedSuperevent]):
+        """
+        Atomically write the index
+
+        :param superevents: List of superevents, newest first
+        """
+        tmp_path = self.base_dir.joinpath(f".superevents_{uuid.uuid4().hex}.json")
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "query": self.query,
+                    "superevents": [x.model_dump() for x in superevents],
+                },
+                f,
+                indent=2,
+            )
+        os.replace(tmp_path, self.index_path)
+
+    def _update(self, superevent: IndexedSuperevent):
+        """
+        Merge the VOEvents of a superevent into the index. Superevents which
+        were not listed by sync_superevents are added at the end, and are not
+        used to answer queries.
+
+        :param superevent: Superevent
+        """
+        with self._locked():
+            superevents = self._read_index()
+            for indexed in superevents:
+                if indexed.superevent_id == superevent.superevent_id:
+                    voevents = {x.revision: x for x in indexed.voevents}
+                    for voevent in superevent.voevents:
+                        if (voevent.revision not in voevents) or (
+                            voevent.skymap_url is not None
+                        ):
+                            voevents[voevent.revision] = voevent
+                    indexed.voevents = sorted(
+                        voevents.values(), key=lambda x: x.revision
+                    )
+                    break
+            else:
+                superevents.append(superevent.model_copy(update={"listed": False}))
+            self._write_index(superevents)
+
+    def query_superevents(self, limit: int | None = None) -> list[IndexedSuperevent]:
+        """
+        Get the superevents listed from GraceDB, newest first
+
+        :param limit: Maximum number of superevents
+        :return: List of superevents
+        """
+        return [x for x in self._read_index() if x.listed][:limit]
+
+    def get(self, superevent_id: str) -> IndexedSuperevent | None:
+        """
+        Get an indexed superevent
+
+        :param superevent_id: Superevent ID
+        :return: Superevent, or None if it is not indexed
+        """
+        for superevent in self._read_index():
+            if superevent.superevent_id == superevent_id:
+                return superevent
+        return None
+
+    def sync_superevents(
+        self,
+        client: GraceDb,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        max_new: int = DEFAULT_MAX_NEW,
+    ) -> list[str]:
+        """
+        Add the superevents created since the newest indexed one.
+        Superevents are listed newest first, one page at a time,
+        and listing stops at the first superevent which is already indexed.
+        An empty index is only filled with the first page.
+
+        :param client: GraceDB client
+        :param page_size: Number of superevents per page
+        :param max_new: Maximum number of superevents to list
+        :return: IDs of the new superevents, newest first
+        """
+        known = {x.superevent_id for x in self.query_superevents()}
+
+        # A new index only needs the latest superevents, not the full history
+        if len(known) == 0:
+            max_new = min(max_new, page_size)
+
+        def list_new() -> list[dict]:
+            new = []
+            # Stop as soon as possible, so no further pages are requested
+            for superevent in client.superevents(
+                self.query, orderby=["-created"], count=page_size
+            ):
+                if superevent["superevent_id"] in known:
+                    break
+                new.append(superevent)
+                if len(new) >= max_new:
+                    break
+            return new
+
+        new = retry_transient(list_new)
+
+        with self._locked():
+            # Superevents listed by another process in the meantime keep their place
+            superevents = {x.superevent_id: x for x in self._read_index()}
+            listed = []
+            for x in new:
+                indexed = superevents.get(x["superevent_id"])
+                if (indexed is not None) and indexed.listed:
+                    continue
+                indexed = superevents.pop(
+                    x["superevent_id"],
+                    IndexedSuperevent(superevent_id=x["superevent_id"]),
+                )
+                indexed.created = x.get("created")
+                indexed.listed = True
+                listed.append(indexed)
+            self._write_index(listed + list(superevents.values()))
+
+        if len(new) > 0:
+            logger.info(f"Indexed {len(new)} new superevents")
+
+        return [x["superevent_id"] for x in new]
+
+    def latest(self, client: GraceDb) -> str:
+        """
+        Get the ID of the latest superevent, after syncing the index
+
+        :param client: GraceDB client
+        :return: Superevent ID
+        """
+        self.sync_superevents(client)
+        superevents = self.query_superevents(limit=1)
+        if len(superevents) == 0:
+            raise ValueError(f"No superevents found in GraceDB for '{self.query}'")
+        return superevents[0].superevent_id
+
+    def sync_voevents(self, client: GraceDb, superevent_id: str) -> IndexedSuperevent:
+        """
+        Add the new VOEvents of a superevent. The skymap URLs
+        of VOEvents which are already indexed are kept.
+
+        :param client: GraceDB client
+        :param superevent_id: Superevent ID
+        :return: Updated superevent
+        """
+        voevents = retry_transient(client.voevents, superevent_id).json()["voevents"]
+
+        superevent = self.get(superevent_id)
+        if superevent is None:
+            superevent = IndexedSuperevent(superevent_id=superevent_id)
+
+        n_known = len(superevent.voevents)
+        for voevent in voevents:
+            if superevent.get_voevent(int(voevent["N"])) is None:
+                superevent.voevents.append(
+                    IndexedVOEvent(
+                        revision=int(voevent["N"]),
+                        filename=voevent["filename"],
+                        file_url=voevent["links"]["file"],
+                        created=voevent.get("created"),
+                        voevent_type=voevent.get("voevent_type"),
+                    )
+                )
+        superevent.voevents.sort(key=lambda x: x.revision)
+
+        if len(superevent.voevents) > n_known:
+            logger.debug(
+                f"Indexed {len(superevent.voevents) - n_known} new VOEvents "
+                f"for {superevent_id}"
+            )
+
+        self._update(superevent)
+        return superevent
+
+    def get_voevent(
+        self, client: GraceDb, superevent_id: str, rev: int | None = None
+    ) -> IndexedVOEvent:
+        """
+        Get a VOEvent of a superevent. A revision which is already indexed
+        is answered without contacting GraceDB, while the latest revision
+        always requires syncing the VOEvents of the superevent.
+
+        :param client: GraceDB client
+        :param superevent_id: Superevent ID
+        :param rev: Revision number (defaults to the latest)
+        :return: VOEvent
+        """
+        superevent = self.get(superevent_id)
+
+        if (
+            (rev is None)
+            or (superevent is None)
+            or (superevent.get_voevent(rev) is None)
+        ):
+            superevent = self.sync_voevents(client, superevent_id)
+
+        if rev is None:
+            if len(superevent.voevents) == 0:
+                raise ValueError(f"No VOEvents found for {superevent_id}")
+            return superevent.voevents[-1]
+
+        voevent = superevent.get_voevent(rev)
+        if voevent is None:
+            raise Exception("Revision {0} not found".format(rev))
+        return voevent
+
+    def get_skymap_url(
+        self, client: GraceDb, superevent_id: str, voevent: IndexedVOEvent
+    ) -> str:
+        """
+        Get the skymap URL of a VOEvent, parsing its XML only the first time
+
+        :param client: GraceDB client
+        :param superevent_id: Superevent ID
+        :param voevent: VOEvent
+        :return: URL of skymap
+        """
+        if voevent.skymap_url is not None:
+            return voevent.skymap_url
+
+        response = get(voevent.file_url, session=client)
+        voevent.skymap_url = parse_skymap_url(response.content)
+
+        self._update(IndexedSuperevent(superevent_id=superevent_id, voevents=[voevent]))
+
+        return voevent.skymap_url
@@ -0,0 +1,158 @@
+"""
+This module contains the state used to replan incrementally when a new
+skymap revision arrives. The observing window is fixed by the first plan of
+an event, and each new revision is only planned for the remaining part of
+that window, skipping the fields which have already been observed.
+"""
+
+import logging
+import os
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from snipergw.schedule import Schedule
+
+logger = logging.getLogger(__name__)
+
+PLAN_STATE_NAME = "plan_state.json"
+
+# gwemopt plans for one day after the start time by default (--Tobs 0.0,1.0)
+DEFAULT_WINDOW_DAYS = 1.0
+
+SECONDS_PER_DAY = 86400.0
+
+
+def get_window_days(gwemopt_args: list[str]) -> float:
+    """
+    Get the length of the observing window from the gwemopt arguments
+
+    :param gwemopt_args: gwemopt arguments
+    :return: Window length in days
+    """
+    window = DEFAULT_WINDOW_DAYS
+    for i, arg in enumerate(gwemopt_args[:-1]):
+        if arg == "--Tobs":
+            window = float(gwemopt_args[i + 1].split(",")[-1])
+    return window
+
+
+class PlanState(BaseModel):
+    """
+    Observing window of an event, and the fields observed so far
+    """
+
+    window_start_mjd: float
+    window_end_mjd: float
+    observed_fields: list[int] = []
+    n_plans: int = 1
+
+    @classmethod
+    def read(cls, path: Path) -> "PlanState | None":
+        """
+        Read the plan state, if it exists
+
+        :param path: Path of plan state
+        :return: PlanState or None
+        """
+        if not path.exists():
+            return None
+        with open(path, "r", encoding="utf8") as f:
+            return cls.model_validate_json(f.read())
+
+    def write(self, path: Path):
+        """
+        Write the plan state, replacing any previous state
+
+        :param path: Path of plan state
+        """
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf8") as f:
+            f.write(self.model_dump_json(indent=2))
+        os.replace(tmp_path, path)
+
+    def contains(self, mjd: float) -> bool:
+        """
+        Whether a time is within the observing window
+
+        :param mjd: Time in MJD
+        :return: Boolean
+        """
+        return self.window_start_mjd <= mjd < self.window_end_mjd
+
+    def advance(self, previous: Schedule | None, cut_mjd: float) -> "PlanState":
+        """
+        Get the state for a new plan starting at cut_mjd. Fields are counted as
+        observed once all their pointings in the previous schedule end before
+        the cut, i.e the previous schedule is assumed to have been followed.
+
+        :param previous: Previous schedule, or None
+        :param cut_mjd: Start of the new plan in MJD
+        :return: New PlanState
+        """
+        observed = set(self.observed_fields)
+        if previous is not None and len(previous) > 0:
+            t_end = previous["tobs"] + previous["texp"] / SECONDS_PER_DAY
+            done = (t_end <= cut_mjd).groupby(previous["field"]).all()
+            observed |= set(done.index[done.to_numpy()].astype(int).tolist())
+
+        return self.model_copy(
+            update={
+                "observed_fields": sorted(observed),
+                "n_plans": self.n_plans + 1,
+            }
+        )
+
+    def get_gwemopt_args(self, cut_mjd: float) -> list[str]:
+        """
+        Get the gwemopt arguments restricting a plan starting at cut_mjd
+        to the rest of the window, and excluding the observed fields
+
+        :param cut_mjd: Start of the new plan in MJD
+        :return: gwemopt arguments
+        """
+        args = ["--Tobs", f"0.0,{self.window_end_mjd - cut_mjd:.6f}"]
+        if len(self.observed_fields) > 0:
+            args += ["--observedTiles", ",".join(str(x) for x in self.observed_fields)]
+        return args
+
+
+def get_incremental_args(
+    output_dir: Path,
+    previous: Schedule | None,
+    cut_mjd: float,
+    gwemopt_args: list[str],
+    incremental: bool,
+) -> tuple[list[str], PlanState]:
+    """
+    Get the extra gwemopt arguments for a plan starting at cut_mjd, and the
+    plan state to save once it is made. Incremental plans continue the window
+    of the previous plan, if there is one and it has not ended yet.
+    Otherwise, a new window is started.
+
+    :param output_dir: Output directory of the telescope for this event
+    :param previous: Previous schedule, or None
+    :param cut_mjd: Start of the new plan in MJD
+    :param gwemopt_args: Other gwemopt arguments
+    :param incremental: Whether to plan incrementally
+    :return: Extra gwemopt arguments, PlanState
+    """
+    state = PlanState.read(output_dir.joinpath(PLAN_STATE_NAME))
+
+    if incremental and (state is not None) and state.contains(cut_mjd):
+        state = state.advance(previous, cut_mjd)
+        logger.info(
+            f"Replanning incrementally for the remaining "
+            f"{24. * (state.window_end_mjd - cut_mjd):.1f} hours of the window, "
+            f"skipping {len(state.observed_fields)} observed fields"
+        )
+        return state.get_gwemopt_args(cut_mjd), state
+
+    if incremental:
+        logger.info("No current plan to continue, so starting a new window")
+
+    state = PlanState(
+        window_start_mjd=cut_mjd,
+        window_end_mjd=cut_mjd + get_window_days(gwemopt_args),
+    )
+    return [], state
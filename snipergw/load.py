@@ -0,0 +1,437 @@
+"""
+This module contains the load driver, which pushes synthetic alerts through
+the full pipeline (skymap download, planning and submission) concurrently,
+against the local simulated services of snipergw.simulator. It measures the
+sustained throughput, the latency of each alert from its arrival to its
+submission, and the latency of each stage from the traces of the runs.
+"""
+
+import argparse
+import json
+import logging
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from astropy.time import Time
+from pydantic import BaseModel
+
+from snipergw.benchmark import (
+    SYNTHETIC_DATE_OBS,
+    SYNTHETIC_DEC,
+    SYNTHETIC_RA,
+    SYNTHETIC_STARTTIME,
+    BenchmarkCase,
+)
+from snipergw.cli import add_plan_arguments, parse_starttime
+from snipergw.model import EventConfig, PlanConfig
+from snipergw.run import run_snipergw
+from snipergw.simulator import (
+    SERVICES,
+    ServiceConfig,
+    SimulatorConfig,
+    SimulatorServer,
+    simulated_services,
+)
+from snipergw.tracing import TRACE_FILE_NAME, Span, get_stage_name
+
+logger = logging.getLogger(__name__)
+
+# Synthetic skymaps are scattered around the benchmark position,
+# so that each alert has a different skymap
+POSITION_SCATTER_DEG = 5.0
+
+PERCENTILES = [50, 90, 99]
+
+# Simulated services of each worker process, kept for the process lifetime
+_worker_services = ExitStack()
+
+
+class LoadAlert(BaseModel):
+    """
+    A synthetic alert
+    """
+
+    event: str
+    kind: str
+    case: BenchmarkCase
+
+
+class AlertResult(BaseModel):
+    """
+    Outcome of one alert, with its timings in seconds.
+    The latency runs from the arrival of the alert to the end of its run,
+    so it includes the time spent waiting for a free worker.
+    """
+
+    event: str
+    kind: str
+    arrival: float
+    queued: float = 0.0
+    runtime: float = 0.0
+    latency: float = 0.0
+    n_pointings: int = 0
+    error: str | None = None
+
+
+class LoadReport(BaseModel):
+    """
+    Results of a load test
+    """
+
+    created: str
+    n_alerts: int
+    concurrency: int
+    rate: float | None = None
+    telescope: str
+    submit: bool
+    config: SimulatorConfig
+    duration: float = 0.0
+    requests: dict[str, int] = {}
+    results: list[AlertResult] = []
+    stages: list[dict] = []
+
+    def summarise(self) -> dict:
+        """
+        Summarise the throughput and latency of the alerts
+
+        :return: Dictionary of summary statistics
+        """
+        latencies = [x.latency for x in self.results if x.error is None]
+        summary = {
+            "n_alerts": len(self.results),
+            "n_failed": len(self.results) - len(latencies),
+            "duration": self.duration,
+            "throughput_per_hour": 3600.0 * len(latencies) / max(self.duration, 1e-6),
+        }
+        for name, value in get_percentiles(latencies).items():
+            summary[f"latency_{name}"] = value
+        return summary
+
+    def write(self, path: Path):
+        """
+        Write the report
+
+        :param path: Path of report
+        """
+        with open(path, "w", encoding="utf8") as f:
+            f.write(self.model_dump_json(indent=2))
+
+
+def get_percentiles(values: list[float]) -> dict[str, float]:
+    """
+    Get the percentiles and maximum of a list of values
+
+    :param values: Values
+    :return: Dictionary of e.g p50, p90, p99 and max (NaN if there are no values)
+    """
+    if len(values) == 0:
+        return {**{f"p{x}": np.nan for x in PERCENTILES}, "max": np.nan}
+    percentiles = np.percentile(values, PERCENTILES)
+    return {
+        **{f"p{x}": float(y) for x, y in zip(PERCENTILES, percentiles)},
+        "max": float(np.max(values)),
+    }
+
+
+def get_gw_name(date: str, i: int) -> str:
+    """
+    Get the name of the i-th superevent of a date, e.g S190425a, ..., S190425aa
+
+    :param date: Date of the form YYMMDD
+    :param i: Index of superevent
+    :return: Superevent ID
+    """
+    suffix = ""
+    i += 1
+    while i > 0:
+        i, remainder = divmod(i - 1, 26)
+        suffix = chr(ord("a") + remainder) + suffix
+    return f"S{date}{suffix}"
+
+
+def make_alerts(
+    n_alerts: int,
+    case: BenchmarkCase,
+    grb_fraction: float = 0.0,
+    seed: int | None = None,
+) -> list[LoadAlert]:
+    """
+    Make synthetic alerts, each with a skymap at a random position
+    near the benchmark position. GRBs are spread over consecutive days,
+    with up to 26 per day.
+
+    :param n_alerts: Number of alerts
+    :param case: Skymap of the alerts (resolution, area and format)
+    :param grb_fraction: Fraction of alerts which are GRBs rather than GW events
+    :param seed: Random seed
+    :return: List of alerts
+    """
+    rng = random.Random(seed)
+    start = datetime.fromisoformat(SYNTHETIC_DATE_OBS)
+    n_grb = int(round(n_alerts * grb_fraction))
+
+    alerts = []
+    for i in range(n_alerts):
+        position = {
+            "ra": SYNTHETIC_RA + rng.uniform(-1.0, 1.0) * POSITION_SCATTER_DEG,
+            "dec": SYNTHETIC_DEC + rng.uniform(-1.0, 1.0) * POSITION_SCATTER_DEG,
+        }
+        if i < n_grb:
+            date = (start + timedelta(days=i // 26)).strftime("%y%m%d")
+            alerts.append(
+                LoadAlert(
+                    event=f"GRB{date}{chr(ord('A') + i % 26)}",
+                    kind="grb",
+                    case=case.model_copy(update={**position, "moc": False}),
+                )
+            )
+        else:
+            alerts.append(
+                LoadAlert(
+                    event=get_gw_name(start.strftime("%y%m%d"), i - n_grb),
+                    kind="gw",
+                    case=case.model_copy(update=position),
+                )
+            )
+
+    rng.shuffle(alerts)
+    return alerts
+
+
+def init_load_worker(gracedb_url: str, heasarc_url: str, config: SimulatorConfig):
+    """
+    Point a worker process at the simulated services
+
+    :param gracedb_url: Service URL of the simulated GraceDB
+    :param heasarc_url: URL of the simulated GBM trigger archive
+    :param config: Simulator configuration
+    """
+    _worker_services.enter_context(simulated_services(gracedb_url, heasarc_url, config))
+
+
+def run_alert(
+    alert: LoadAlert,
+    arrival: float,
+    output_dir: Path,
+    plan_config: PlanConfig,
+    submit: bool = False,
+) -> AlertResult:
+    """
+    Run the full pipeline for an alert, recording any error rather than raising it
+
+    :param alert: Alert
+    :param arrival: Arrival time of the alert (unix time)
+    :param output_dir: Output directory
+    :param plan_config: Plan configuration
+    :param submit: Submit the schedule
+    :return: AlertResult
+    """
+    t_start = time.time()
+    result = AlertResult(
+        event=alert.event, kind=alert.kind, arrival=arrival, queued=t_start - arrival
+    )
+    try:
+        schedule = run_snipergw(
+            EventConfig(event=alert.event, output_dir=output_dir),
+            plan_config,
+            submit=submit,
+        )
+        result.n_pointings = len(schedule)
+    except Exception as exc:
+        logger.exception(f"Run failed for alert {alert.event}")
+        result.error = f"{type(exc).__name__}: {exc}"
+    result.runtime = time.time() - t_start
+    result.latency = time.time() - arrival
+    return result
+
+
+def get_stage_latencies(trace_path: Path) -> list[dict]:
+    """
+    Get the latency percentiles of each stage from a trace file
+
+    :param trace_path: Path of JSON-lines trace file
+    :return: List of dictionaries with stage, n and percentiles
+    """
+    if not trace_path.exists():
+        return []
+
+    durations = {}
+    with open(trace_path, encoding="utf8") as f:
+        for line in f:
+            span = Span(**json.loads(line))
+            durations.setdefault(get_stage_name(span), []).append(span.duration)
+
+    return [
+        {"stage": stage, "n": len(values), **get_percentiles(values)}
+        for stage, values in sorted(durations.items())
+    ]
+
+
+def run_load(
+    alerts: list[LoadAlert],
+    output_dir: Path,
+    plan_config: PlanConfig,
+    config: SimulatorConfig | None = None,
+    concurrency: int = 2,
+    rate: float | None = None,
+    submit: bool = False,
+) -> LoadReport:
+    """
+    Push alerts through the pipeline concurrently, against simulated services.
+    Each alert runs in a worker process, as it would in watch mode.
+    With a rate, alerts arrive at regular intervals, and otherwise all at once.
+
+    :param alerts: Alerts
+    :param output_dir: Output directory, shared by all runs
+    :param plan_config: Plan configuration
+    :param config: Simulator configuration
+    :param concurrency: Number of worker processes
+    :param rate: Arrival rate of alerts per second
+    :param submit: Submit the schedules
+    :return: LoadReport
+    """
+    if config is None:
+        config = SimulatorConfig()
+
+    report = LoadReport(
+        created=Time.now().isot,
+        n_alerts=len(alerts),
+        concurrency=concurrency,
+        rate=rate,
+        telescope=plan_config.telescope,
+        submit=submit,
+        config=config,
+    )
+
+    with SimulatorServer(config) as simulator:
+        for alert in alerts:
+            if alert.kind == "grb":
+                simulator.add_grb(alert.event, alert.case)
+            else:
+                simulator.add_superevent(alert.event, alert.case)
+
+        logger.info(
+            f"Pushing {len(alerts)} alerts through the pipeline "
+            f"with {concurrency} workers"
+        )
+
+        with ProcessPoolExecutor(
+            max_workers=concurrency,
+            initializer=init_load_worker,
+            initargs=(simulator.gracedb_url, simulator.heasarc_url, config),
+        ) as executor:
+            t_start = time.time()
+            futures = []
+            for i, alert in enumerate(alerts):
+                arrival = t_start + (0.0 if rate is None else i / rate)
+                time.sleep(max(arrival - time.time(), 0.0))
+                futures.append(
+                    executor.submit(
+                        run_alert, alert, arrival, output_dir, plan_config, submit
+                    )
+                )
+            report.results = [future.result() for future in futures]
+            report.duration = time.time() - t_start
+
+        report.requests = dict(simulator.requests)
+
+    report.stages = get_stage_latencies(output_dir.joinpath(TRACE_FILE_NAME))
+
+    summary = report.summarise()
+    logger.info(
+        f"Processed {summary['n_alerts']} alerts ({summary['n_failed']} failed) "
+        f"in {report.duration:.1f}s: {summary['throughput_per_hour']:.1f} alerts/hour, "
+        f"p50 latency {summary['latency_p50']:.1f}s, "
+        f"p99 latency {summary['latency_p99']:.1f}s"
+    )
+
+    return report
+
+
+def load_cli(argv: list[str]):
+    """
+    Command line interface for the load driver
+
+    :param argv: Command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        prog="snipergw load",
+        description="Push synthetic alerts through snipergw concurrently, "
+        "against local simulated services, and measure throughput and latency",
+    )
+    parser.add_argument("-n", "--n_alerts", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--rate", type=float, default=None)
+    parser.add_argument("--grb_fraction", type=float, default=0.0)
+    parser.add_argument("-s", "--submit", default=False, action="store_true")
+    parser.add_argument("--report", default="load.json")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--sky_nside", type=int, default=256)
+    parser.add_argument("--area", type=float, default=100.0)
+    parser.add_argument("--moc", default=False, action="store_true")
+    parser.add_argument("--revisions", type=int, default=1)
+    parser.add_argument("--listing_padding", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--services", nargs="+", choices=SERVICES, default=SERVICES)
+    add_plan_arguments(parser)
+    parser.set_defaults(output_dir=None)
+    args, gwemopt_args = parser.parse_known_args(argv)
+
+    if len(gwemopt_args) > 0:
+        parser.error(f"Unrecognised arguments: {' '.join(gwemopt_args)}")
+
+    # The synthetic skymaps are only observable at the synthetic start time
+    if args.starttime is None:
+        args.starttime = SYNTHETIC_STARTTIME
+    parse_starttime(args)
+
+    faulty = ServiceConfig(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate
+    )
+    config = SimulatorConfig(
+        **{x: faulty for x in args.services},
+        n_revisions=args.revisions,
+        listing_padding=args.listing_padding,
+        seed=args.seed,
+    )
+
+    alerts = make_alerts(
+        args.n_alerts,
+        BenchmarkCase(nside=args.sky_nside, area=args.area, moc=args.moc),
+        grb_fraction=args.grb_fraction,
+        seed=args.seed,
+    )
+
+    with ExitStack() as stack:
+        if args.output_dir is None:
+            args.output_dir = stack.enter_context(tempfile.TemporaryDirectory())
+
+        report = run_load(
+            alerts,
+            output_dir=Path(args.output_dir),
+            plan_config=PlanConfig(**args.__dict__),
+            config=config,
+            concurrency=args.concurrency,
+            rate=args.rate,
+            submit=args.submit,
+        )
+
+    report.write(Path(args.report))
+    logger.info(f"Saved load test report to {args.report}")
+
+    print(pd.Series(report.summarise()).to_string())
+    print(pd.DataFrame(report.stages).to_string(index=False))
+    print(f"Requests: {report.requests}")
+
+    errors = [x.error for x in report.results if x.error is not None]
+    if len(errors) > 0:
+        print(pd.Series(errors).value_counts().to_string())
@@ -5,11 +5,13 @@ This module contains the pydantic models used to validate the input
 from pathlib import Path
 from typing import Any
 
+import numpy as np
 from astropy import units as u
 from astropy.time import Time
 from pydantic import (
     BaseModel,
     ConfigDict,
+    Field,
     ValidationInfo,
     field_validator,
     model_validator,
@@ -24,10 +26,34 @@ class EventConfig(BaseModel):
     event: str | None = None
     rev: int | None = None
     output_dir: Path = base_output_dir
+    offline: bool = False
 
 
 DEFAULT_TELESCOPE = "ZTF"
-DEFAULT_STARTTIME = Time.now() + 0.25 * u.hour
+# Delay between the time a plan is made and the start of observations
+DEFAULT_START_DELAY = 0.25 * u.hour
+
+# The default start time is rounded up to a whole number of these, so a rerun
+# soon after (e.g. to submit a schedule checked with a dry run) has the same
+# inputs, and reuses the cached plan
+STARTTIME_RESOLUTION = 0.25 * u.hour
+
+
+def get_default_starttime(now: Time | None = None) -> Time:
+    """
+    Get the default start time of a plan, at least DEFAULT_START_DELAY
+    from now and rounded up to STARTTIME_RESOLUTION
+
+    :param now: Current time (defaults to Time.now())
+    :return: Start time
+    """
+    if now is None:
+        now = Time.now()
+    steps_per_day = int(round((1 * u.day / STARTTIME_RESOLUTION).decompose().value))
+    step = int(np.ceil((now + DEFAULT_START_DELAY).utc.mjd * steps_per_day))
+    day, remainder = divmod(step, steps_per_day)
+    return Time(day, remainder / steps_per_day, format="mjd", scale="utc")
+
 
 all_telescopes = [DEFAULT_TELESCOPE, "WINTER", "DECam"]
 
@@ -36,25 +62,36 @@ class TelescopeDefault(BaseModel):
     filters: str
     exposuretime: float
     all_filters: list[str]
+    nside: int
 
 
+# Planning nside is matched to the field of view:
+# ZTF fields are ~47 sq. deg., while WINTER fields are ~1 sq. deg.
 ztf_default = TelescopeDefault(
-    filters="g,r,g", exposuretime=300.0, all_filters=["g", "r", "i"]
+    filters="g,r,g", exposuretime=300.0, all_filters=["g", "r", "i"], nside=256
 )
 winter_default = TelescopeDefault(
-    filters="J", exposuretime=450.0, all_filters=["y", "J", "Hs"]
+    filters="J", exposuretime=450.0, all_filters=["y", "J", "Hs"], nside=512
 )
 
+DEFAULT_NSIDE = 256
+
 
 class PlanConfig(BaseModel):
     output_dir: Path = base_output_dir
     telescope: str = DEFAULT_TELESCOPE
     filters: str | None = None
     exposuretime: float | None = None
-    cache: bool = False
-    starttime: Time = DEFAULT_STARTTIME
+    cache: bool = True
+    starttime: Time = Field(default_factory=get_default_starttime)
     subprogram: str = "EMGW"
     use_both_grids: bool = False
+    nside: int | None = None
+    credible_level: float | None = None
+    background_plots: bool = False
+    incremental: bool = False
+    plots: bool = True
+    label: str | None = None
 
     @field_validator("telescope")
     @classmethod
@@ -89,6 +126,25 @@ class PlanConfig(BaseModel):
 
         return self
 
+    @field_validator("credible_level")
+    @classmethod
+    def credible_level_must_be_fraction(cls, v):
+        if (v is not None) and not (0.0 < v <= 1.0):
+            raise ValueError("credible_level must be in (0, 1]")
+        return v
+
+    @model_validator(mode="after")
+    def set_default_nside(self) -> Self:
+        if self.nside is None:
+            if self.telescope == "ZTF":
+                self.nside = ztf_default.nside
+            elif self.telescope == "WINTER":
+                self.nside = winter_default.nside
+            else:
+                self.nside = DEFAULT_NSIDE
+
+        return self
+
     @model_validator(mode="after")
     def set_default_exposure(self) -> Self:
         if self.exposuretime is None:
@@ -101,4 +157,68 @@ class PlanConfig(BaseModel):
 
         return self
 
+    def get_output_dir(self, event_name: str) -> Path:
+        """
+        Get the output directory of this telescope for an event,
+        in a subdirectory for the label if there is one
+
+        :param event_name: Event name
+        :return: Output directory
+        """
+        output_dir = Path(self.output_dir).joinpath(f"{event_name}/{self.telescope}")
+        if self.label is not None:
+            output_dir = output_dir.joinpath(self.label)
+        return output_dir
+
     model_config = ConfigDict(arbitrary_types_allowed=True)
+
+
+def get_telescope_filters(filters: str | None, telescope: str) -> str | None:
+    """
+    Get the filters of one telescope, from filters which are either shared by
+    all telescopes (e.g "g,r") or given per telescope (e.g "ZTF:g,r;WINTER:J").
+    Telescopes which are not listed use their default filters.
+
+    :param filters: Filters
+    :param telescope: Telescope name
+    :return: Filters of telescope, or None for the default
+    """
+    if (filters is None) or (":" not in filters):
+        return filters
+
+    for entry in filters.split(";"):
+        if entry.strip() == "":
+            continue
+        if ":" not in entry:
+            raise ValueError(
+                f"Filters given per telescope must look like 'ZTF:g,r;WINTER:J', "
+                f"got '{filters}'"
+            )
+        name, value = entry.split(":", 1)
+        if name.strip() == telescope:
+            return value.strip()
+    return None
+
+
+def get_plan_configs(
+    telescope: str = DEFAULT_TELESCOPE, filters: str | None = None, **kwargs
+) -> list[PlanConfig]:
+    """
+    Create one plan config per telescope, from a comma-separated list
+    of telescopes such as "ZTF,WINTER"
+
+    :param telescope: Comma-separated telescope names
+    :param filters: Filters, shared by all telescopes or given per telescope
+        (see get_telescope_filters)
+    :param kwargs: Other fields of PlanConfig, shared by all telescopes
+    :return: List of plan configs
+    """
+    return [
+        PlanConfig(
+            telescope=x.strip(),
+            filters=get_telescope_filters(filters, x.strip()),
+            **kwargs,
+        )
+        for x in telescope.split(",")
+        if x.strip() != ""
+    ]
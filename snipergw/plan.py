@@ -3,45 +3,75 @@ Module to plan observations with gwemopt
 """
 
 import logging
+import os
 import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-import numpy as np
-import pandas as pd
-import pytz
-from astropy.time import Time
-from gwemopt.run import run
-
+from snipergw.coverage import (
+    COVERAGE_CURVE_NAME,
+    Footprints,
+    get_coverage_curve,
+    remove_coverage,
+    write_coverage,
+)
+from snipergw.incremental import PLAN_STATE_NAME, get_incremental_args
 from snipergw.model import PlanConfig
-from snipergw.paths import base_output_dir, gwemopt_dir
+from snipergw.paths import gwemopt_dir
+from snipergw.plan_cache import PlanCache, get_plan_inputs, get_plan_key
+from snipergw.plots import PLOT_INPUTS_NAME, start_background_plots, update_symlink
+from snipergw.schedule import Schedule
 from snipergw.skymap import Skymap
+from snipergw.tracing import call_traced, current_span, span, traced, tracer
 
 logger = logging.getLogger(__name__)
 
-timezone_format = "%Y-%m-%dT%H:%M:%S"
+# Latest schedule of each telescope, which is submitted (or deleted)
+SCHEDULE_ARRAY_NAME = "schedule.npy"
+
+
+def read_saved_schedule(event_name: str, plan_config: PlanConfig) -> Schedule | None:
+    """
+    Read the latest schedule planned for an event, if there is one
 
+    :param event_name: Event name
+    :param plan_config: Plan config
+    :return: Schedule, or None if the event has not been planned
+    """
+    path = plan_config.get_output_dir(event_name).joinpath(SCHEDULE_ARRAY_NAME)
+    if not path.exists():
+        return None
+    return Schedule.read_npy(path, mmap=False)
 
+
+@traced("plan")
 def run_gwemopt(
     skymap: Skymap, plan_config: PlanConfig, gwemopt_args: list[str]
-) -> pd.DataFrame:
+) -> Schedule:
     """
     I (RS) sincerely apologise for all the terrible coding sins that are committed here
 
     :param skymap: Skymap of event
     :param plan_config: Plan config
     :param gwemopt_args: List of arguments to pass to gwemopt
-    :return: Schedule dataframe
+    :return: Schedule
     """
 
-    output_dir = base_output_dir.joinpath(
-        f"{skymap.event_name}/{plan_config.telescope}"
+    current_span().set(
+        event=skymap.event_name,
+        revision=skymap.revision,
+        telescope=plan_config.telescope,
     )
+
+    output_dir = plan_config.get_output_dir(skymap.event_name)
     gwemopt_output_dir = output_dir.joinpath("gwemopt")
 
     exposures = ",".join(
         [str(plan_config.exposuretime) for _ in plan_config.filters.split(",")]
     )
 
-    gwemopt_args += [
+    # Build a new argument list, so the caller's list is never modified
+    gwemopt_args = list(gwemopt_args) + [
         "--telescopes",
         plan_config.telescope,
         "--doTiles",
@@ -74,72 +104,192 @@ def run_gwemopt(
     if "--powerlaw_cl" not in gwemopt_args:
         gwemopt_args += ["--powerlaw_cl", "0.9"]
 
+    if "--nside" not in gwemopt_args:
+        gwemopt_args += ["--nside", f"{plan_config.nside}"]
+
     if not plan_config.telescope == "DECam":
         gwemopt_args += ["--doAlternatingFilters"]
 
-    if not plan_config.cache:
-        logger.info(f"Running gwemopt with arguments: {gwemopt_args}")
+    if not plan_config.plots:
+        gwemopt_args = [x for x in gwemopt_args if x != "--doPlots"]
 
-        run(gwemopt_args)
-    else:
-        logger.info("Using cached schedule")
+    schedule_array_path = output_dir.joinpath(SCHEDULE_ARRAY_NAME)
+    previous = None
+    if schedule_array_path.exists():
+        previous = Schedule.read_npy(schedule_array_path, mmap=False)
+
+    cut_mjd = plan_config.starttime.mjd
+    incremental_args, plan_state = get_incremental_args(
+        output_dir,
+        previous,
+        cut_mjd=cut_mjd,
+        gwemopt_args=gwemopt_args,
+        incremental=plan_config.incremental,
+    )
+    gwemopt_args += incremental_args
+
+    schedule_path = gwemopt_output_dir.joinpath(f"schedule_{plan_config.telescope}.dat")
+    array_path = gwemopt_output_dir.joinpath(f"schedule_{plan_config.telescope}.npy")
+    coverage_path = gwemopt_output_dir.joinpath("tiles_coverage.pdf")
+    footprints_path = gwemopt_output_dir.joinpath(
+        f"footprints_{plan_config.telescope}.npz"
+    )
 
     coverage = output_dir.joinpath("tiles_coverage.pdf")
+    plot_inputs_path = None
+    if plan_config.background_plots & plan_config.plots:
+        plot_inputs_path = gwemopt_output_dir.joinpath(PLOT_INPUTS_NAME)
+
+    # Remove the coverage of any previous plan, so it is never shown for this one
     coverage.unlink(missing_ok=True)
-    coverage.symlink_to(gwemopt_output_dir.joinpath("tiles_coverage.pdf"))
+    coverage_path.unlink(missing_ok=True)
+    footprints_path.unlink(missing_ok=True)
+    remove_coverage(output_dir)
 
-    logger.info(f"See coverage at {coverage}")
+    plan_cache = PlanCache(plan_config.output_dir.joinpath("plan_cache"))
+    plan_inputs = get_plan_inputs(skymap, plan_config, gwemopt_args)
+    plan_key = get_plan_key(plan_inputs)
 
-    schedule_path = gwemopt_output_dir.joinpath(f"schedule_{plan_config.telescope}.dat")
+    planned = False
+    if not (plan_config.cache and plan_cache.get(plan_key, gwemopt_output_dir)):
+        logger.info(f"Running gwemopt with arguments: {gwemopt_args}")
 
-    schedule = pd.read_csv(
-        schedule_path,
-        sep=" ",
-        names=[
-            "field",
-            "ra",
-            "dec",
-            "tobs",
-            "limmag",
-            "texp",
-            "prob",
-            "airmass",
-            "filter",
-            "pid",
-        ],
-    )
+        # gwemopt is slow to import, so only load it when actually planning
+        from snipergw.planner import run_gwemopt_planner
 
-    mjds = Time(schedule["tobs"].to_numpy(), format="mjd")
+        with span("gwemopt", telescope=plan_config.telescope):
+            run_gwemopt_planner(
+                skymap,
+                gwemopt_args,
+                credible_level=plan_config.credible_level,
+                plot_inputs_path=plot_inputs_path,
+                field_index_dir=plan_config.output_dir.joinpath("field_index"),
+            )
+        planned = True
 
-    utcs = [x.tt.datetime.replace(tzinfo=pytz.utc) for x in mjds]
+        with span("postprocess", telescope=plan_config.telescope):
+            Schedule.from_gwemopt(schedule_path).add_times().write_npy(array_path)
 
-    schedule["utctime"] = [x.strftime(timezone_format) for x in utcs]
+        if plan_config.cache:
+            plan_cache.put(
+                plan_key,
+                plan_inputs,
+                artifacts=[array_path, coverage_path, footprints_path],
+            )
 
-    # convert to time in Pacific time
-    schedule["palomartime"] = [
-        x.astimezone(pytz.timezone("America/Los_Angeles")).strftime(timezone_format)
-        for x in utcs
-    ]
+    schedule = Schedule.read_npy(array_path)
 
     schedule_csv_path = output_dir.joinpath("schedule.csv")
     schedule.to_csv(schedule_csv_path)
+    schedule.write_npy(schedule_array_path)
+    plan_state.write(output_dir.joinpath(PLAN_STATE_NAME))
     logger.info(f"See schedule at {schedule_csv_path}")
 
-    tot_prob = 0.0
+    if previous is not None:
+        diff = schedule.diff(previous[previous["tobs"] >= cut_mjd])
+        logger.info(
+            f"Compared to the rest of the previous plan, {len(diff.kept)} pointings "
+            f"are kept, {len(diff.added)} added and {len(diff.removed)} removed"
+        )
 
-    all_fields = list(set(schedule["field"]))
+    if coverage_path.exists():
+        update_symlink(coverage, coverage_path)
+        logger.info(f"See coverage at {coverage}")
+    elif planned & (plot_inputs_path is not None):
+        start_background_plots(plot_inputs_path, coverage_path, coverage)
+    else:
+        logger.info("No coverage plot is available for this schedule")
 
-    for field in all_fields:
-        df = schedule[schedule["field"] == field]
-        tot_prob += df["prob"].iloc[0]
+    coverage_summary = None
+    if footprints_path.exists():
+        with span("coverage", telescope=plan_config.telescope):
+            curve = get_coverage_curve(schedule, Footprints.load(footprints_path))
+            coverage_summary = write_coverage(curve, output_dir)
+        nights = ", ".join(
+            f"{k}: {100.*v:.1f}%" for k, v in coverage_summary.nights.items()
+        )
+        logger.info(
+            f"Probability covered per night: {nights}. See the coverage curve "
+            f"at {output_dir.joinpath(COVERAGE_CURVE_NAME)}"
+        )
+    else:
+        logger.warning("No footprints are available to compute the exact coverage")
 
-    schedule_time = np.sum(schedule["texp"]) / 60.0 / 60.0
+    summary = schedule.summarise(coverage=coverage_summary)
+    current_span().set(
+        cached=not planned,
+        n_pointings=summary.n_pointings,
+        n_fields=summary.n_fields,
+        total_prob=summary.total_prob,
+        area_deg2=summary.area_deg2,
+    )
     logger.info(
-        f"Schedule covers {100.*tot_prob:.1f}% of probability "
-        f"with {len(all_fields)} fields, "
-        f"takes {schedule_time:.2g} hours using {len(schedule)} pointings "
-        f"of {plan_config.exposuretime}s each, "
+        f"Schedule covers {100.*summary.total_prob:.1f}% of probability "
+        f"with {summary.n_fields} fields, "
+        f"takes {summary.duration_hours:.2g} hours using {summary.n_pointings} "
+        f"pointings of {plan_config.exposuretime}s each, "
         f"and uses filters {plan_config.filters} ."
     )
 
     return schedule
+
+
+def run_gwemopt_parallel(
+    skymap: Skymap,
+    plan_configs: list[PlanConfig],
+    gwemopt_args: list[str],
+    max_workers: int | None = None,
+) -> list[Schedule]:
+    """
+    Run gwemopt for several plan configurations, e.g one per telescope,
+    with one worker process per configuration.
+    The skymap is only resolved once, and shared with the workers.
+
+    :param skymap: Skymap of event
+    :param plan_configs: List of plan configs
+    :param gwemopt_args: List of arguments to pass to gwemopt
+    :param max_workers: Maximum number of worker processes
+        (defaults to one per plan config, up to the number of CPUs)
+    :return: List of schedules, in the order of plan_configs
+    """
+    telescopes = [x.telescope for x in plan_configs]
+    if len(set(telescopes)) != len(telescopes):
+        raise ValueError(
+            f"Each telescope can only be planned once per run, got {telescopes}"
+        )
+
+    if len(plan_configs) == 1:
+        return [run_gwemopt(skymap, plan_configs[0], list(gwemopt_args))]
+
+    if max_workers is None:
+        max_workers = min(len(plan_configs), os.cpu_count() or 1)
+
+    logger.info(
+        f"Planning for {', '.join(telescopes)} with {max_workers} worker processes"
+    )
+
+    t_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                call_traced,
+                tracer.current_context(),
+                run_gwemopt,
+                skymap,
+                plan_config,
+                list(gwemopt_args),
+            )
+            for plan_config in plan_configs
+        ]
+        schedules = []
+        for future in futures:
+            schedule, spans = future.result()
+            tracer.record(spans)
+            schedules.append(schedule)
+
+    logger.info(
+        f"Planned for {len(plan_configs)} telescopes "
+        f"in {time.perf_counter() - t_start:.1f}s"
+    )
+
+    return schedules
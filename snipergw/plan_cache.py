@@ -0,0 +1,258 @@
+"""
+This module contains the PlanCache class, a cache of gwemopt schedules keyed
+on a hash of everything which determines the plan: the skymap content,
+the plan configuration and the full gwemopt argument list
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+from importlib.metadata import version
+from pathlib import Path
+
+from astropy.time import Time
+
+from snipergw.model import PlanConfig
+from snipergw.skymap import Skymap
+from snipergw.store import hash_file
+
+logger = logging.getLogger(__name__)
+
+# Increment to invalidate all existing cache entries
+CACHE_VERSION = 3
+
+DEFAULT_MAX_SIZE_MB = float(os.getenv("SNIPERGW_PLAN_CACHE_MB", 500.0))
+
+# PlanConfig fields which do not change the schedule
+IGNORED_PLAN_FIELDS = ["output_dir", "cache", "subprogram", "incremental", "label"]
+
+# gwemopt arguments whose value does not change the schedule
+IGNORED_GWEMOPT_ARGS = ["-o", "--outputDir"]
+
+META_FILE_NAME = "meta.json"
+
+
+def get_skymap_hash(skymap: Skymap) -> str:
+    """
+    Get the hash of the content of a skymap, using the store record if available
+
+    :param skymap: Skymap
+    :return: Hex digest
+    """
+    if skymap.record is not None:
+        return skymap.record.sha256
+    return hash_file(Path(skymap.skymap_path))
+
+
+def get_plan_inputs(
+    skymap: Skymap, plan_config: PlanConfig, gwemopt_args: list[str]
+) -> dict:
+    """
+    Get a description of all inputs which determine a plan
+
+    :param skymap: Skymap
+    :param plan_config: Plan configuration
+    :param gwemopt_args: Full list of gwemopt arguments
+    :return: Dictionary of inputs
+    """
+    plan_fields = {}
+    for key, value in plan_config.model_dump(exclude=set(IGNORED_PLAN_FIELDS)).items():
+        if isinstance(value, Time):
+            value = value.isot
+        plan_fields[key] = value
+
+    args = []
+    skip_next = False
+    for arg in gwemopt_args:
+        if skip_next:
+            skip_next = False
+            continue
+        if arg in IGNORED_GWEMOPT_ARGS:
+            skip_next = True
+            continue
+        if arg == "--event":
+            # The path of the skymap is covered by its hash
+            args.append("--event")
+            skip_next = True
+            continue
+        args.append(arg)
+
+    return {
+        "cache_version": CACHE_VERSION,
+        "gwemopt_version": version("gwemopt"),
+        "skymap_sha256": get_skymap_hash(skymap),
+        "plan_config": plan_fields,
+        "gwemopt_args": args,
+    }
+
+
+def get_plan_key(inputs: dict) -> str:
+    """
+    Hash a description of plan inputs
+
+    :param inputs: Dictionary of inputs
+    :return: Hex digest
+    """
+    return hashlib.sha256(
+        json.dumps(inputs, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class PlanCache:
+    """
+    Size-bounded cache of schedule artifacts, with least-recently-used eviction.
+    Each entry is a directory named after the key, which is written to a
+    temporary directory and renamed into place once complete. Entries are
+    only read, written or evicted under a lock on their key, as the cache
+    is shared by the worker processes of sweeps and batches.
+    """
+
+    def __init__(self, base_dir: Path, max_size_mb: float = DEFAULT_MAX_SIZE_MB):
+        """
+        :param base_dir: Directory of the cache
+        :param max_size_mb: Maximum total size of the cache in MB
+        """
+        self.base_dir = Path(base_dir)
+        self.tmp_dir = self.base_dir.joinpath("tmp")
+        self.lock_dir = self.base_dir.joinpath("locks")
+        self.max_size = max_size_mb * 1.0e6
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def _locked(self, key: str):
+        """
+        Context manager holding an exclusive lock on a cache entry
+
+        :param key: Key
+        """
+        with open(self.lock_dir.joinpath(f"{key}.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def get_entry_dir(self, key: str) -> Path:
+        """
+        Get the directory of a cache entry
+
+        :param key: Key
+        :return: Path
+        """
+        return self.base_dir.joinpath(key)
+
+    def get(self, key: str, output_dir: Path) -> bool:
+        """
+        Copy the artifacts of a cache entry to an output directory,
+        if the entry exists
+
+        :param key: Key
+        :param output_dir: Directory to copy artifacts to
+        :return: Whether the entry was found
+        """
+        entry_dir = self.get_entry_dir(key)
+        meta_path = entry_dir.joinpath(META_FILE_NAME)
+
+        with self._locked(key):
+            if not meta_path.exists():
+                logger.info(f"Plan cache miss for {key[:12]}")
+                return False
+
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+
+            output_dir.mkdir(parents=True, exist_ok=True)
+            for name in meta["artifacts"]:
+                shutil.copyfile(entry_dir.joinpath(name), output_dir.joinpath(name))
+
+            # The modification time of the metadata file records the last use
+            os.utime(meta_path)
+
+        logger.info(f"Plan cache hit for {key[:12]}")
+        return True
+
+    def put(self, key: str, inputs: dict, artifacts: list[Path]):
+        """
+        Add artifacts to the cache, then evict old entries if needed.
+        An entry which was already added (e.g. by another process planning
+        the same inputs) is kept, as the same inputs give the same plan.
+
+        :param key: Key
+        :param inputs: Description of the inputs, for reference
+        :param artifacts: Paths of artifacts to store
+        """
+        tmp_entry_dir = self.tmp_dir.joinpath(f"{key}_{uuid.uuid4().hex}")
+        tmp_entry_dir.mkdir()
+
+        names = []
+        for path in artifacts:
+            if not path.exists():
+                logger.debug(f"Not caching missing artifact {path}")
+                continue
+            shutil.copyfile(path, tmp_entry_dir.joinpath(path.name))
+            names.append(path.name)
+
+        with open(tmp_entry_dir.joinpath(META_FILE_NAME), "w") as f:
+            json.dump(
+                {
+                    "key": key,
+                    "created": Time.now().isot,
+                    "artifacts": names,
+                    "inputs": inputs,
+                },
+                f,
+                indent=2,
+                default=str,
+            )
+
+        entry_dir = self.get_entry_dir(key)
+        with self._locked(key):
+            if entry_dir.joinpath(META_FILE_NAME).exists():
+                shutil.rmtree(tmp_entry_dir)
+                logger.debug(f"Plan {key[:12]} is already in cache")
+            else:
+                # Remove any incomplete entry, e.g. from an interrupted eviction
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                os.replace(tmp_entry_dir, entry_dir)
+                logger.debug(f"Added plan {key[:12]} to cache")
+
+        self.evict()
+
+    def get_entries(self) -> list[tuple[Path, float, int]]:
+        """
+        Get all complete cache entries
+
+        :return: List of (directory, last use time, size in bytes)
+        """
+        entries = []
+        for entry_dir in self.base_dir.iterdir():
+            meta_path = entry_dir.joinpath(META_FILE_NAME)
+            if (entry_dir in [self.tmp_dir, self.lock_dir]) or (not meta_path.exists()):
+                continue
+            try:
+                size = sum(x.stat().st_size for x in entry_dir.iterdir())
+                entries.append((entry_dir, meta_path.stat().st_mtime, size))
+            except FileNotFoundError:
+                # Evicted by another process in the meantime
+                continue
+        return entries
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits its size limit
+        """
+        entries = sorted(self.get_entries(), key=lambda x: x[1])
+        total_size = sum(x[2] for x in entries)
+
+        while (total_size > self.max_size) & (len(entries) > 0):
+            entry_dir, _, size = entries.pop(0)
+            with self._locked(entry_dir.name):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= size
+            logger.info(f"Evicted plan {entry_dir.name[:12]} from cache")
@@ -0,0 +1,703 @@
+"""
+Module to drive the gwemopt planning steps directly from a Skymap object,
+rather than via gwemopt's argv-style run() which re-reads the skymap from disk
+"""
+
+import copy
+import logging
+import os
+import pickle
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable
+
+import gwemopt.coverage
+import gwemopt.efficiency
+import gwemopt.lightcurve
+import gwemopt.mapsplit
+import gwemopt.moc
+import gwemopt.segments
+import gwemopt.tiles
+import gwemopt.utils
+import numpy as np
+from astroplan import Observer
+from astropy import table
+from astropy import units as u
+from astropy.coordinates import EarthLocation
+from astropy.time import Time, TimeDelta
+from gwemopt.args import parse_args
+from gwemopt.catalogs import get_catalog
+from gwemopt.io import read_skymap, summary
+from gwemopt.paths import CONFIG_DIR, REFS_DIR, TESSELATION_DIR
+from gwemopt.plotting import (
+    make_coverage_plots,
+    make_efficiency_plots,
+    make_tile_plots,
+    plot_inclination,
+    plot_observability,
+    plot_skymap,
+)
+from gwemopt.tiles import TILE_TYPES
+from gwemopt.utils import calculate_observability
+
+from snipergw.coverage import Footprints
+from snipergw.field_index import (
+    FieldIndex,
+    get_field_index_key,
+    load_field_index,
+    tile_values,
+)
+from snipergw.skymap import Skymap
+
+logger = logging.getLogger(__name__)
+
+WARM_CACHE_SIZE = 16
+
+# Number of fields used for the quick coverage estimate
+N_BEST_FIELDS = 10
+
+
+class WarmCache:
+    """
+    Small in-memory LRU cache of planning state which does not depend on the
+    skymap, such as telescope configurations, tile MOCs and tile segments.
+    It lives for as long as the process, so a long-lived planning worker
+    (see snipergw.worker) only pays the setup cost once.
+    """
+
+    def __init__(self, max_size: int = WARM_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple, factory: Callable[[], Any]) -> Any:
+        """
+        Get an entry, creating it with factory if it is not cached
+
+        :param key: Hashable key
+        :param factory: Function creating the entry
+        :return: Cached entry, which must not be modified
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+        self.misses += 1
+        value = factory()
+        self._entries[key] = value
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        """
+        Remove all entries
+        """
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+warm_cache = WarmCache()
+
+
+def load_telescope_config(
+    telescope: str, exposuretime: float | None = None, galaxy_tiles: bool = False
+) -> dict:
+    """
+    Load the gwemopt configuration of a telescope, including its tesselation,
+    reference images and observer. This follows the per-telescope part of
+    gwemopt's params_struct.
+
+    :param telescope: Telescope name
+    :param exposuretime: Single exposure time to scale the limiting magnitude to,
+        or None to use the configured exposure time
+    :param galaxy_tiles: Whether tiles are built from a galaxy catalog
+    :return: Telescope configuration
+    """
+    config = gwemopt.utils.readParamsFromFile(
+        CONFIG_DIR.joinpath(f"{telescope}.config")
+    )
+    config["telescope"] = telescope
+
+    if exposuretime is not None:
+        config["magnitude_orig"] = config["magnitude"]
+        config["exposuretime_orig"] = config["exposuretime"]
+        config["magnitude"] = config["magnitude"] - 2.5 * np.log10(
+            np.sqrt(config["exposuretime"] / exposuretime)
+        )
+        config["exposuretime"] = exposuretime
+
+    if "tesselationFile" in config:
+        tessfile = TESSELATION_DIR.joinpath(config["tesselationFile"])
+        if not os.path.isfile(tessfile):
+            if config["FOV_type"] == "circle":
+                gwemopt.tiles.tesselation_spiral(config)
+            elif config["FOV_type"] == "square":
+                gwemopt.tiles.tesselation_packing(config)
+        if galaxy_tiles:
+            config["tesselation"] = np.empty((3,))
+        else:
+            config["tesselation"] = np.loadtxt(
+                tessfile, usecols=(0, 1, 2), comments="%"
+            )
+
+    if "referenceFile" in config:
+        refs = table.unique(
+            table.Table.read(
+                REFS_DIR.joinpath(config["referenceFile"]),
+                format="ascii",
+                data_start=2,
+                data_end=-1,
+            )["field", "fid"]
+        )
+        reference_images_map = {0: "u", 1: "g", 2: "r", 3: "i", 4: "z", 5: "y"}
+        config["reference_images"] = {
+            group[0]["field"]: [
+                reference_images_map.get(n, n)
+                for n in group["fid"].astype(int).tolist()
+            ]
+            for group in refs.group_by("field").groups
+        }
+
+    location = EarthLocation(
+        config["longitude"], config["latitude"], config["elevation"]
+    )
+    config["observer"] = Observer(location=location)
+
+    return config
+
+
+def get_params(args) -> dict:
+    """
+    Create the gwemopt params from parsed arguments. This is equivalent to
+    gwemopt's params_struct, but the telescope configurations are
+    taken from the warm cache rather than re-read from disk.
+
+    :param args: Parsed gwemopt arguments
+    :return: gwemopt params
+    """
+    params = dict(args.__dict__)
+
+    telescopes = str(args.telescopes).split(",")
+    exposuretime = None
+    if args.doSingleExposure:
+        exposuretime = float(args.exposuretimes.split(",")[0])
+    galaxy_tiles = args.tilesType == "galaxy"
+
+    # Configurations are copied, because gwemopt adds the segments to them
+    params["config"] = {
+        telescope: dict(
+            warm_cache.get(
+                ("config", telescope, exposuretime, galaxy_tiles),
+                lambda: load_telescope_config(telescope, exposuretime, galaxy_tiles),
+            )
+        )
+        for telescope in telescopes
+    }
+
+    params["coverageFiles"] = (
+        args.coverageFiles.split(",") if args.coverageFiles else None
+    )
+    params["telescopes"] = telescopes
+    params["lightcurveFiles"] = str(args.lightcurveFiles).split(",")
+    params["Tobs"] = np.array(args.Tobs.split(","), dtype=float)
+    params["observedTiles"] = args.observedTiles.split(",")
+    params["treasuremap_status"] = args.treasuremap_status.split(",")
+    params["raslice"] = np.array(args.raslice.split(","), dtype=float)
+    params["unbalanced_tiles"] = None
+    params["filters"] = args.filters.split(",")
+    params["exposuretimes"] = np.array(args.exposuretimes.split(","), dtype=float)
+    params["catalogDir"] = Path(args.catalogDir)
+    params["ignore_observability"] = getattr(args, "ignore_observability", False)
+    params["true_location"] = getattr(args, "true_location", False)
+
+    for key in ["true_ra", "true_dec", "true_distance"]:
+        if hasattr(args, key):
+            params[key] = getattr(args, key)
+
+    if params["catalog"] is not None:
+        params["galaxy_limit"] = int(args.galaxy_limit)
+
+    if params["tilesType"] not in TILE_TYPES:
+        raise ValueError(
+            f"Unrecognised tilesType: {params['tilesType']}. "
+            f"Accepted values: {TILE_TYPES}"
+        )
+
+    if args.start_time is None:
+        params["start_time"] = Time.now() - TimeDelta(1.0 * u.day)
+    else:
+        params["start_time"] = Time(args.start_time, format="isot", scale="utc")
+
+    if args.end_time is None:
+        params["end_time"] = Time.now()
+    else:
+        params["end_time"] = Time(args.end_time, format="isot", scale="utc")
+
+    params["inclination"] = (
+        args.inclination if hasattr(args, "true_location") else False
+    )
+
+    return params
+
+
+def copy_patch(patch):
+    """
+    Copy a tile patch (or list of patches), detached from any figure,
+    as a matplotlib artist can only be drawn in one figure
+
+    :param patch: Patch, list of patches or empty list
+    :return: Copy of patch
+    """
+    if not patch:
+        return patch
+    if isinstance(patch, list):
+        return [copy_patch(x) for x in patch]
+    patch_copy = copy.copy(patch)
+    patch_copy.axes = None
+    patch_copy.figure = None
+    return patch_copy
+
+
+def get_tile_mocs(params: dict, map_struct: dict) -> dict:
+    """
+    Get the MOC of each tile for each telescope. Unless the tiling depends on
+    the skymap (doMinimalTiling), these are taken from the warm cache.
+
+    :param params: gwemopt params
+    :param map_struct: gwemopt map struct
+    :return: moc_structs
+    """
+    if params["doMinimalTiling"]:
+        return gwemopt.moc.create_moc(params, map_struct=map_struct)
+
+    moc_structs = {}
+    for telescope in params["telescopes"]:
+        key = (
+            "moc",
+            telescope,
+            params["nside"],
+            params["doChipGaps"],
+            params.get("rotation"),
+            params["doUsePrimary"],
+            params["doUseSecondary"],
+        )
+        mocs = warm_cache.get(
+            key,
+            lambda: gwemopt.moc.create_moc({**params, "telescopes": [telescope]})[
+                telescope
+            ],
+        )
+        # gwemopt adds the tile probabilities and segments to each tile
+        moc_structs[telescope] = {
+            index: {**x, "patch": copy_patch(x["patch"])} for index, x in mocs.items()
+        }
+
+    return moc_structs
+
+
+def add_tile_segments(params: dict, tile_structs: dict) -> dict:
+    """
+    Add the observable segments of each tile. These only depend on the tile
+    position, the telescope and the observing window, so are kept in the
+    warm cache per tile, and reused when replanning with the same start time.
+
+    :param params: gwemopt params
+    :param tile_structs: gwemopt tile structs, without segments
+    :return: tile_structs
+    """
+    for telescope, tile_struct in tile_structs.items():
+        config_struct = params["config"][telescope]
+
+        key = (
+            "segments",
+            telescope,
+            float(params["gpstime"]),
+            tuple(params["Tobs"]),
+            params["airmass"],
+            params["ignore_observability"],
+        )
+        # Segments are only ever added to this entry, never modified
+        segments = warm_cache.get(key, dict)
+
+        missing = {k: v for k, v in tile_struct.items() if k not in segments}
+        if len(missing) > 0:
+            gwemopt.segments.get_segments_tiles(params, config_struct, missing)
+            segments.update(
+                {k: copy.deepcopy(v["segmentlist"]) for k, v in missing.items()}
+            )
+
+        for index, tile in tile_struct.items():
+            tile["segmentlist"] = copy.deepcopy(segments[index])
+
+    return tile_structs
+
+
+def get_field_index(
+    params: dict,
+    telescope: str,
+    moc_struct: dict,
+    field_index_dir: Path | None = None,
+) -> FieldIndex:
+    """
+    Get the field index of a telescope grid, from the warm cache,
+    from disk, or built from the tile MOCs
+
+    :param params: gwemopt params
+    :param telescope: Telescope name
+    :param moc_struct: Tile MOCs of the telescope
+    :param field_index_dir: Directory of field indexes, or None to not save them
+    :return: FieldIndex
+    """
+    key = get_field_index_key(
+        telescope,
+        params["nside"],
+        doChipGaps=params["doChipGaps"],
+        rotation=params.get("rotation"),
+        doUsePrimary=params["doUsePrimary"],
+        doUseSecondary=params["doUseSecondary"],
+    )
+
+    def load() -> FieldIndex:
+        if field_index_dir is None:
+            return FieldIndex.from_tiles(telescope, params["nside"], moc_struct)
+        return load_field_index(
+            field_index_dir, key, telescope, params["nside"], moc_struct
+        )
+
+    return warm_cache.get(("field_index", key), load)
+
+
+def select_tiles(
+    params: dict,
+    map_struct: dict,
+    moc_structs: dict,
+    field_index_dir: Path | None = None,
+) -> dict:
+    """
+    Estimate the probability in each field with the field index, and drop the
+    fields without any probability before scheduling. gwemopt never schedules
+    these fields, but would otherwise still compute their tile values and
+    segments on every iteration.
+
+    Fields are only dropped when they cannot change the values of other tiles,
+    i.e when overlapping tiles are never zeroed (maximumOverlap >= 1).
+    Fields listed in --observedTiles (e.g by an incremental replan)
+    are always dropped.
+
+    :param params: gwemopt params
+    :param map_struct: gwemopt map struct
+    :param moc_structs: Tile MOCs for each telescope
+    :param field_index_dir: Directory of field indexes, or None to not save them
+    :return: moc_structs
+    """
+    prob = map_struct["prob"]
+    prefilter = (params["maximumOverlap"] >= 1.0) & ("observability" not in map_struct)
+    observed = {int(x) for x in params["observedTiles"] if x != ""}
+
+    for telescope, moc_struct in moc_structs.items():
+        index = get_field_index(params, telescope, moc_struct, field_index_dir)
+        fields = index.select_fields(prob)
+
+        logger.info(
+            f"{len(fields)} of {len(index)} {telescope} fields contain probability, "
+            f"the best {min(len(fields), N_BEST_FIELDS)} cover "
+            f"{100. * index.coverage(prob, fields[:N_BEST_FIELDS]):.1f}%"
+        )
+
+        keep = set(index.field_ids.tolist())
+        if prefilter & (len(fields) > 0):
+            keep = set(fields.tolist())
+        keep -= observed
+
+        moc_structs[telescope] = {k: v for k, v in moc_struct.items() if int(k) in keep}
+
+    return moc_structs
+
+
+@contextmanager
+def fast_tile_maps():
+    """
+    Context manager replacing gwemopt's compute_tiles_map with the equivalent
+    field_index.tile_values, for the tile functions it supports
+    """
+    original = gwemopt.tiles.compute_tiles_map
+
+    def compute_tiles_map(
+        params, tile_struct, skymap, func=None, ipix_keep=(), catalog_struct=None
+    ):
+        if func in [None, "np.sum(x)", "np.nanmedian(x)"]:
+            return tile_values(
+                params,
+                tile_struct,
+                skymap,
+                func=func or "np.sum(x)",
+                ipix_keep=ipix_keep,
+            )
+        return original(
+            params,
+            tile_struct,
+            skymap,
+            func=func,
+            ipix_keep=ipix_keep,
+            catalog_struct=catalog_struct,
+        )
+
+    gwemopt.tiles.compute_tiles_map = compute_tiles_map
+    try:
+        yield
+    finally:
+        gwemopt.tiles.compute_tiles_map = original
+
+
+def load_map_struct(
+    params: dict, skymap: Skymap, credible_level: float | None = None
+) -> tuple[dict, dict]:
+    """
+    Fill the skymap-dependent parameters, and create the gwemopt map struct
+    from an already-open Skymap, preprocessed to the planning nside
+
+    :param params: gwemopt params
+    :param skymap: Skymap
+    :param credible_level: Credible level to crop the skymap to, or None
+    :return: params, map_struct
+    """
+    params["skymap"] = skymap.skymap_path
+    params["name"] = Path(skymap.skymap_path).stem
+
+    params["eventtime"] = skymap.t_obs
+    if params["gpstime"] is None:
+        params["gpstime"] = skymap.t_obs.gps
+
+    if params["geometry"] is not None:
+        params["do_3d"] = params["geometry"] != "2d"
+    else:
+        params["do_3d"] = skymap.has_distance
+
+    map_struct = skymap.get_map_struct(
+        nside=params["nside"],
+        do_3d=params["do_3d"],
+        dscale=params["DScale"],
+        credible_level=credible_level,
+    )
+
+    return read_skymap(params, map_struct=map_struct)
+
+
+def save_footprints(
+    params: dict, skymap: Skymap, tile_structs: dict, coverage_struct: dict
+):
+    """
+    Save the footprints of the scheduled fields of each telescope, with the
+    probability of the full (uncropped) skymap, to footprints_{telescope}.npz
+    in the gwemopt output directory
+
+    :param params: gwemopt params
+    :param skymap: Skymap
+    :param tile_structs: gwemopt tile structs
+    :param coverage_struct: gwemopt coverage struct
+    """
+    sparse_skymap = skymap.preprocess(nside=params["nside"], do_3d=params["do_3d"])
+    telescopes = np.asarray(coverage_struct["telescope"], dtype=str)
+
+    for telescope in params["telescopes"]:
+        field_ids = []
+        mask = telescopes == telescope
+        if np.any(mask):
+            # The field ID is the sixth column of the coverage data
+            field_ids = np.asarray(coverage_struct["data"])[mask, 5]
+
+        footprints = Footprints.from_tiles(
+            telescope, params["nside"], tile_structs[telescope], field_ids=field_ids
+        )
+        footprints.prob = sparse_skymap.get_prob(footprints.pixels)
+        footprints.save(params["outputDir"].joinpath(f"footprints_{telescope}.npz"))
+
+
+def save_plot_inputs(path: Path, **structs):
+    """
+    Save the gwemopt structs needed to make plots after planning
+
+    :param path: Output path
+    :param structs: gwemopt structs (params, map_struct, tile_structs, ...)
+    """
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(structs, f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path.replace(path)
+
+
+def render_plots(plot_inputs_path: Path):
+    """
+    Make the skymap, tile and coverage plots from saved gwemopt structs
+
+    :param plot_inputs_path: Path of structs saved with save_plot_inputs
+    """
+    with open(plot_inputs_path, "rb") as f:
+        structs = pickle.load(f)
+
+    params = structs["params"]
+    params["doPlots"] = True
+    map_struct = structs["map_struct"]
+
+    logger.info("Plotting skymap")
+    plot_skymap(params, map_struct)
+
+    logger.info("Plotting tiles struct")
+    make_tile_plots(params, map_struct, structs["tile_structs"])
+
+    logger.info("Plotting coverage")
+    make_coverage_plots(
+        params,
+        map_struct,
+        structs["coverage_struct"],
+        catalog_struct=structs["catalog_struct"],
+    )
+
+
+def run_gwemopt_planner(
+    skymap: Skymap,
+    gwemopt_args: list[str],
+    credible_level: float | None = None,
+    plot_inputs_path: Path | None = None,
+    field_index_dir: Path | None = None,
+) -> dict:
+    """
+    Run the gwemopt planning steps for a skymap. This follows gwemopt's run(),
+    but takes the skymap data from the Skymap object.
+
+    :param skymap: Skymap
+    :param gwemopt_args: gwemopt command line arguments
+    :param credible_level: Credible level to crop the skymap to, or None
+    :param plot_inputs_path: If given, skip all plotting, and instead save the
+        structs needed to make the plots later to this path
+    :param field_index_dir: Directory to store field indexes in, or None
+    :return: gwemopt params
+    """
+    args = parse_args(gwemopt_args)
+
+    if plot_inputs_path is not None:
+        args.doPlots = False
+
+    params = get_params(args)
+
+    if len(params["filters"]) != len(params["exposuretimes"]):
+        raise ValueError(
+            "The number of filters specified must match the number of exposure times."
+        )
+
+    params, map_struct = load_map_struct(params, skymap, credible_level=credible_level)
+
+    output_dir = Path(args.outputDir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    params["outputDir"] = output_dir
+
+    params = gwemopt.segments.get_telescope_segments(params)
+
+    if params["catalog"] is not None:
+        logger.info("Generating catalog")
+        map_struct, catalog_struct = get_catalog(params, map_struct)
+    else:
+        catalog_struct = None
+
+    if args.doPlots:
+        logger.info("Plotting skymap")
+        plot_skymap(params, map_struct)
+        if args.inclination:
+            plot_inclination(params, map_struct)
+
+    if args.doObservability:
+        logger.info("Calculating observability")
+        map_struct["observability"] = calculate_observability(params, map_struct)
+        if args.doPlots:
+            plot_observability(params, map_struct)
+
+    if params["splitType"] is not None:
+        logger.info("Splitting skymap")
+        map_struct["groups"] = gwemopt.mapsplit.similar_range(params, map_struct)
+
+    if not args.doTiles:
+        raise ValueError("snipergw requires --doTiles for planning")
+
+    if params["tilesType"] == "moc":
+        logger.info("Generating MOC struct")
+        moc_structs = get_tile_mocs(params, map_struct)
+        if not params["doMinimalTiling"]:
+            moc_structs = select_tiles(
+                params, map_struct, moc_structs, field_index_dir=field_index_dir
+            )
+        with fast_tile_maps():
+            tile_structs = gwemopt.tiles.moc(
+                params, map_struct, moc_structs, doSegments=False
+            )
+        tile_structs = add_tile_segments(params, tile_structs)
+    elif params["tilesType"] == "galaxy":
+        logger.info("Generating galaxy struct")
+        tile_structs = gwemopt.tiles.galaxy(params, map_struct, catalog_struct)
+        for telescope in params["telescopes"]:
+            params["config"][telescope]["tesselation"] = np.array(
+                [
+                    [index, tile["ra"], tile["dec"]]
+                    for index, tile in tile_structs[telescope].items()
+                ]
+            ).reshape(-1, 3)
+    else:
+        raise ValueError(f"Unknown tilesType: {params['tilesType']}")
+
+    if args.doPlots:
+        logger.info("Plotting tiles struct")
+        make_tile_plots(params, map_struct, tile_structs)
+
+    if not args.doSchedule:
+        raise ValueError("snipergw requires --doSchedule for planning")
+
+    logger.info("Generating coverage")
+    with fast_tile_maps():
+        tile_structs, coverage_struct = gwemopt.coverage.timeallocation(
+            params, map_struct, tile_structs
+        )
+
+    summary(params, map_struct, coverage_struct, catalog_struct=catalog_struct)
+
+    save_footprints(params, skymap, tile_structs, coverage_struct)
+
+    if plot_inputs_path is not None:
+        save_plot_inputs(
+            plot_inputs_path,
+            params=params,
+            map_struct=map_struct,
+            tile_structs=tile_structs,
+            coverage_struct=coverage_struct,
+            catalog_struct=catalog_struct,
+        )
+    elif args.doPlots:
+        logger.info("Plotting coverage")
+        make_coverage_plots(
+            params, map_struct, coverage_struct, catalog_struct=catalog_struct
+        )
+
+    if args.doEfficiency:
+        logger.info("Computing efficiency")
+        if args.modelType == "file":
+            lightcurve_structs = gwemopt.lightcurve.read_files(
+                params, params["lightcurveFiles"]
+            )
+        else:
+            lightcurve_structs = gwemopt.lightcurve.tophat(
+                params, mag0=args.mag, dmag=args.dmag
+            )
+        efficiency_structs = {}
+        for key, lightcurve_struct in lightcurve_structs.items():
+            efficiency_structs[key] = gwemopt.efficiency.compute_efficiency(
+                params, map_struct, lightcurve_struct, coverage_struct
+            )
+            efficiency_structs[key]["legend_label"] = lightcurve_struct["legend_label"]
+        if args.doPlots:
+            make_efficiency_plots(params, map_struct, efficiency_structs)
+
+    return params
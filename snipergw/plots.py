@@ -0,0 +1,94 @@
+"""
+This module renders gwemopt plots in a background process after planning,
+so that plotting is not on the critical path of a submission.
+
+It can be run as `python -m snipergw.plots PLOT_INPUTS COVERAGE_PDF LINK`.
+"""
+
+import logging
+import os
+import subprocess
+import sys
+import uuid
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+PLOT_INPUTS_NAME = "plot_inputs.pkl"
+PLOT_LOG_NAME = "plots.log"
+
+
+def update_symlink(link: Path, target: Path):
+    """
+    Atomically point a symlink at a target, replacing any existing link
+
+    :param link: Path of symlink
+    :param target: Target of symlink
+    """
+    tmp_link = link.with_name(f".{link.name}.{uuid.uuid4().hex}")
+    tmp_link.symlink_to(target)
+    os.replace(tmp_link, link)
+
+
+def start_background_plots(
+    plot_inputs_path: Path, coverage_path: Path, coverage_link: Path
+) -> subprocess.Popen:
+    """
+    Start a detached process rendering the plots from saved gwemopt structs.
+    The coverage link is updated once the coverage plot exists.
+
+    :param plot_inputs_path: Path of saved gwemopt structs
+    :param coverage_path: Path of the coverage plot which gwemopt will write
+    :param coverage_link: Path of the symlink to update
+    :return: Process
+    """
+    log_path = plot_inputs_path.with_name(PLOT_LOG_NAME)
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "snipergw.plots",
+                str(plot_inputs_path),
+                str(coverage_path),
+                str(coverage_link),
+            ],
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+    logger.info(
+        f"Rendering plots in background process {process.pid}, "
+        f"coverage will be linked at {coverage_link} (log: {log_path})"
+    )
+    return process
+
+
+def make_background_plots(
+    plot_inputs_path: Path, coverage_path: Path, coverage_link: Path
+):
+    """
+    Render the plots, update the coverage link, and remove the saved structs
+
+    :param plot_inputs_path: Path of saved gwemopt structs
+    :param coverage_path: Path of the coverage plot which gwemopt will write
+    :param coverage_link: Path of the symlink to update
+    """
+    from snipergw.planner import render_plots
+
+    render_plots(plot_inputs_path)
+
+    if coverage_path.exists():
+        update_symlink(coverage_link, coverage_path)
+        logger.info(f"See coverage at {coverage_link}")
+    else:
+        logger.warning(f"No coverage plot was made at {coverage_path}")
+
+    plot_inputs_path.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    make_background_plots(*[Path(x) for x in sys.argv[1:4]])
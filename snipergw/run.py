@@ -5,63 +5,110 @@ This module contains the main function for running snipergw.
 import logging
 
 import numpy as np
+import pandas as pd
 
 from snipergw.model import EventConfig, PlanConfig
-from snipergw.plan import run_gwemopt
+from snipergw.plan import read_saved_schedule, run_gwemopt_parallel
 from snipergw.skymap import Skymap
-from snipergw.submit import submit_too_winter, submit_too_ztf
+from snipergw.submit.orchestrator import check_results, submit_schedules
+from snipergw.tracing import trace_run
 
 logger = logging.getLogger(__name__)
 
 
-def run_snipergw(
+def run_snipergw_multi(
     event: EventConfig,
-    plan_config: PlanConfig,
+    plan_configs: list[PlanConfig],
     gwemopt_args: list[str] | None = None,
     submit: bool = False,
     delete: bool = False,
-):
+    max_workers: int | None = None,
+) -> list[pd.DataFrame]:
     """
-    Run snipergw
+    Run snipergw for several telescopes, loading the skymap once
+    and planning for each telescope in parallel. The schedules
+    are then submitted to each telescope concurrently.
+    Deleting reuses the last schedule of each telescope, if there is one.
 
     :param event: event
-    :param plan_config: plan configuration
+    :param plan_configs: plan configurations, one per telescope
     :param gwemopt_args: gwemopt arguments
-    :param submit: submit the queue
-    :param delete: delete the queue
+    :param submit: submit the queues
+    :param delete: delete the queues
+    :param max_workers: maximum number of planning processes
+    :return: schedules, in the order of plan_configs
     """
 
     if gwemopt_args is None:
         gwemopt_args = []
 
-    skymap = Skymap(event_config=event)
-    schedule = run_gwemopt(
-        skymap=skymap, plan_config=plan_config, gwemopt_args=gwemopt_args
-    )
-
-    if np.sum([submit is True, delete is True]) > 0:
-        if plan_config.telescope == "ZTF":
-            submit_too_ztf(
-                schedule,
-                event_name=event.event,
-                plan_config=plan_config,
-                submit=submit,
-                delete=delete,
+    with trace_run(event.output_dir, event=event.event) as run_span:
+        skymap = Skymap(event_config=event)
+        run_span.set(event=skymap.event_name, revision=skymap.revision)
+
+        schedules = [None for _ in plan_configs]
+        if delete:
+            # The queue to delete is the one last submitted, so it is not replanned
+            schedules = [
+                read_saved_schedule(skymap.event_name, x) for x in plan_configs
+            ]
+
+        to_plan = [i for i, x in enumerate(schedules) if x is None]
+        if len(to_plan) > 0:
+            planned = run_gwemopt_parallel(
+                skymap=skymap,
+                plan_configs=[plan_configs[i] for i in to_plan],
+                gwemopt_args=gwemopt_args,
+                max_workers=max_workers,
             )
-        elif plan_config.telescope == "WINTER":
-            submit_too_winter(
-                schedule,
-                event_name=event.event,
-                plan_config=plan_config,
+            for i, schedule in zip(to_plan, planned):
+                schedules[i] = schedule
+
+        if np.sum([submit is True, delete is True]) > 0:
+            # Each facility is submitted concurrently, and all are attempted
+            # before any failure is raised
+            results = submit_schedules(
+                schedules,
+                event_name=skymap.event_name,
+                plan_configs=plan_configs,
                 submit=submit,
                 delete=delete,
             )
+            check_results(results)
+
         else:
-            raise NotImplementedError
-
-    else:
-        logger.info(
-            "Rerun with the --submit flag to actually submit a ToO. "
-            "You can additionally use the --cache flag to use the schedule "
-            "which was just generated, rather than regenerating one from scratch."
-        )
+            logger.info(
+                "Rerun with the --submit flag to actually submit a ToO. "
+                "The schedule which was just generated is cached, so it will be "
+                "reused unless the inputs change. Without --starttime, the start "
+                "time is rounded up to the next quarter hour, so it is the same "
+                "for reruns within that time."
+            )
+
+    return schedules
+
+
+def run_snipergw(
+    event: EventConfig,
+    plan_config: PlanConfig,
+    gwemopt_args: list[str] | None = None,
+    submit: bool = False,
+    delete: bool = False,
+) -> pd.DataFrame:
+    """
+    Run snipergw
+
+    :param event: event
+    :param plan_config: plan configuration
+    :param gwemopt_args: gwemopt arguments
+    :param submit: submit the queue
+    :param delete: delete the queue
+    :return: schedule
+    """
+    return run_snipergw_multi(
+        event=event,
+        plan_configs=[plan_config],
+        gwemopt_args=gwemopt_args,
+        submit=submit,
+        delete=delete,
+    )[0]
@@ -0,0 +1,314 @@
+"""
+This module contains the Schedule class, a columnar table of pointings
+produced by gwemopt, with compact dtypes and vectorised derived columns
+"""
+
+import logging
+import os
+from collections import Counter
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+from astropy.time import Time
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    from snipergw.coverage import CoverageSummary
+
+logger = logging.getLogger(__name__)
+
+timezone_format = "%Y-%m-%dT%H:%M:%S"
+
+PALOMAR_TIMEZONE = "America/Los_Angeles"
+
+# Columns of the schedule_{telescope}.dat files written by gwemopt
+GWEMOPT_COLUMNS = [
+    "field",
+    "ra",
+    "dec",
+    "tobs",
+    "limmag",
+    "texp",
+    "prob",
+    "airmass",
+    "filter",
+    "pid",
+]
+
+# Coordinates, times and probabilities (which are summed) are kept as float64,
+# while quantities written by gwemopt with at most 5 significant figures
+# are stored as float32
+SCHEDULE_DTYPES = {
+    "field": "int32",
+    "ra": "float64",
+    "dec": "float64",
+    "tobs": "float64",
+    "limmag": "float32",
+    "texp": "int32",
+    "prob": "float64",
+    "airmass": "float32",
+    "filter": "category",
+    "pid": "float32",
+    "utctime": "str",
+    "palomartime": "str",
+}
+
+
+# Schema of the binary schedule artifact, a structured numpy array
+SCHEDULE_ARRAY_DTYPE = np.dtype(
+    [
+        ("field", "<i4"),
+        ("ra", "<f8"),
+        ("dec", "<f8"),
+        ("tobs", "<f8"),
+        ("limmag", "<f4"),
+        ("texp", "<i4"),
+        ("prob", "<f8"),
+        ("airmass", "<f4"),
+        ("filter", "<U8"),
+        ("pid", "<f4"),
+        ("utctime", "<U19"),
+        ("palomartime", "<U19"),
+    ]
+)
+
+
+def load_schedule_array(path: Path, mmap: bool = True) -> np.ndarray:
+    """
+    Load a binary schedule artifact as a structured array,
+    checking it against the schedule schema
+
+    :param path: Path of .npy file
+    :param mmap: Memory-map the file rather than reading it
+    :return: Structured array
+    """
+    array = np.load(path, mmap_mode="r" if mmap else None, allow_pickle=False)
+    if array.dtype != SCHEDULE_ARRAY_DTYPE:
+        raise ValueError(
+            f"Schedule array {path} has dtype {array.dtype}, "
+            f"expected {SCHEDULE_ARRAY_DTYPE}"
+        )
+    return array
+
+
+class ScheduleSummary(BaseModel):
+    """
+    Summary of a schedule
+    """
+
+    n_pointings: int
+    n_fields: int
+    total_prob: float
+    duration_hours: float
+    area_deg2: float | None = None
+    filters: dict[str, int] = {}
+
+
+class ScheduleDiff(BaseModel):
+    """
+    Difference between two schedules, as (field, filter) targets.
+    A target scheduled several times appears once per pointing.
+    """
+
+    kept: list[tuple[int, str]] = []
+    added: list[tuple[int, str]] = []
+    removed: list[tuple[int, str]] = []
+
+    @property
+    def is_empty(self) -> bool:
+        """
+        Whether the schedules have the same targets
+        """
+        return (len(self.added) == 0) & (len(self.removed) == 0)
+
+
+def get_target_diff(
+    previous: list[tuple[int, str]], new: list[tuple[int, str]]
+) -> ScheduleDiff:
+    """
+    Compare two lists of (field, filter) targets, ignoring their order
+
+    :param previous: Previous targets
+    :param new: New targets
+    :return: ScheduleDiff
+    """
+    previous_counts, new_counts = Counter(previous), Counter(new)
+    return ScheduleDiff(
+        kept=sorted((previous_counts & new_counts).elements()),
+        added=sorted((new_counts - previous_counts).elements()),
+        removed=sorted((previous_counts - new_counts).elements()),
+    )
+
+
+class Schedule(pd.DataFrame):
+    """
+    Table of scheduled pointings, one row per exposure
+    """
+
+    @property
+    def _constructor(self):
+        return Schedule
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame) -> "Schedule":
+        """
+        Create a schedule from a dataframe, converting to the schedule dtypes
+
+        :param df: Dataframe
+        :return: Schedule
+        """
+        dtypes = {k: v for k, v in SCHEDULE_DTYPES.items() if k in df.columns}
+        return cls(df.astype(dtypes))
+
+    @classmethod
+    def from_gwemopt(cls, path: Path) -> "Schedule":
+        """
+        Read a schedule file written by gwemopt
+
+        :param path: Path of schedule_{telescope}.dat file
+        :return: Schedule
+        """
+        df = pd.read_csv(
+            path,
+            sep=" ",
+            names=GWEMOPT_COLUMNS,
+            dtype={k: SCHEDULE_DTYPES[k] for k in GWEMOPT_COLUMNS},
+        )
+        return cls(df)
+
+    @classmethod
+    def read_csv(cls, path: Path) -> "Schedule":
+        """
+        Read a schedule csv written by snipergw
+
+        :param path: Path of csv
+        :return: Schedule
+        """
+        return cls.from_dataframe(pd.read_csv(path, index_col=0))
+
+    @classmethod
+    def read_npy(cls, path: Path, mmap: bool = True) -> "Schedule":
+        """
+        Read a binary schedule artifact. When memory-mapped,
+        the numeric columns are read-only views of the file.
+
+        :param path: Path of .npy file
+        :param mmap: Memory-map the file rather than reading it
+        :return: Schedule
+        """
+        array = load_schedule_array(path, mmap=mmap)
+        columns = {}
+        for name in SCHEDULE_ARRAY_DTYPE.names:
+            if SCHEDULE_ARRAY_DTYPE[name].kind == "U":
+                columns[name] = pd.Series(array[name]).astype(SCHEDULE_DTYPES[name])
+            else:
+                columns[name] = array[name].view(np.ndarray)
+        return cls(pd.DataFrame(columns, copy=False))
+
+    def to_array(self) -> np.ndarray:
+        """
+        Convert the schedule to a structured array with the artifact schema
+
+        :return: Structured array
+        """
+        array = np.empty(len(self), dtype=SCHEDULE_ARRAY_DTYPE)
+        for name in SCHEDULE_ARRAY_DTYPE.names:
+            array[name] = self[name].to_numpy(dtype=SCHEDULE_ARRAY_DTYPE[name])
+        return array
+
+    def write_npy(self, path: Path):
+        """
+        Write the schedule as a binary artifact. The file is renamed into
+        place once complete, so readers never see a partial file.
+
+        :param path: Path of .npy file
+        """
+        path = Path(path)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, self.to_array(), allow_pickle=False)
+        os.replace(tmp_path, path)
+
+    def add_times(self) -> "Schedule":
+        """
+        Add columns with the observation times as UTC and Palomar time strings
+
+        :return: Schedule
+        """
+        # Round to microseconds as astropy does for datetime objects,
+        # so the strings match the previous per-row conversion
+        utcs = (
+            pd.Series(
+                Time(self["tobs"].to_numpy(), format="mjd").tt.datetime64,
+                index=self.index,
+            )
+            .dt.round("us")
+            .dt.tz_localize("UTC")
+        )
+
+        self["utctime"] = utcs.dt.strftime(timezone_format).astype(
+            SCHEDULE_DTYPES["utctime"]
+        )
+        self["palomartime"] = (
+            utcs.dt.tz_convert(PALOMAR_TIMEZONE)
+            .dt.strftime(timezone_format)
+            .astype(SCHEDULE_DTYPES["palomartime"])
+        )
+        return self
+
+    def get_targets(self) -> list[tuple[int, str]]:
+        """
+        Get the (field, filter) target of each pointing
+
+        :return: List of targets
+        """
+        return list(
+            zip(
+                self["field"].to_numpy(dtype=np.int64).tolist(),
+                self["filter"].astype(str).tolist(),
+            )
+        )
+
+    def diff(self, previous: "Schedule") -> ScheduleDiff:
+        """
+        Compare the targets of this schedule with a previous schedule
+
+        :param previous: Previous schedule
+        :return: ScheduleDiff
+        """
+        return get_target_diff(previous.get_targets(), self.get_targets())
+
+    def summarise(self, coverage: "CoverageSummary | None" = None) -> ScheduleSummary:
+        """
+        Summarise the schedule. With the pixel-exact coverage of the schedule
+        (see snipergw.coverage), the covered probability counts each pixel once.
+        Otherwise, it is estimated from the probability of the first pointing
+        of each field, which double-counts the overlap of fields.
+
+        :param coverage: Coverage of the schedule
+        :return: ScheduleSummary
+        """
+        field_probs = self.groupby("field", sort=False)["prob"].first()
+        filters = self.groupby("filter", observed=True).size()
+
+        total_prob = float(field_probs.sum())
+        area = None
+        if coverage is not None:
+            if coverage.n_pointings != len(self):
+                raise ValueError(
+                    f"Coverage of {coverage.n_pointings} pointings does not match "
+                    f"a schedule of {len(self)} pointings"
+                )
+            total_prob = coverage.total_prob
+            area = coverage.area_deg2
+
+        return ScheduleSummary(
+            n_pointings=len(self),
+            n_fields=len(field_probs),
+            total_prob=total_prob,
+            duration_hours=float(self["texp"].sum()) / 60.0 / 60.0,
+            area_deg2=area,
+            filters={str(k): int(v) for k, v in filters.items()},
+        )
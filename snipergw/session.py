@@ -0,0 +1,251 @@
+"""
+This module contains the shared HTTP session layer used for all remote calls
+(GraceDB, HEASARC and skymap URLs). Sessions are pooled and reused within a
+process, requests have default timeouts, and transient failures are retried
+with jittered exponential backoff.
+"""
+
+import logging
+import os
+import time
+from typing import Callable, TypeVar
+
+import backoff
+import requests
+from ligo.gracedb.rest import GraceDb
+from pydantic import BaseModel
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+TRANSIENT_STATUS_CODES = [408, 425, 429, 500, 502, 503, 504]
+
+TRANSIENT_EXCEPTIONS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.HTTPError,
+)
+
+
+class HTTPConfig(BaseModel):
+    """
+    Configuration of the shared HTTP layer
+    """
+
+    connect_timeout: float = float(os.getenv("SNIPERGW_HTTP_CONNECT_TIMEOUT", 10.0))
+    read_timeout: float = float(os.getenv("SNIPERGW_HTTP_READ_TIMEOUT", 30.0))
+    max_tries: int = int(os.getenv("SNIPERGW_HTTP_MAX_TRIES", 5))
+    max_time: float = float(os.getenv("SNIPERGW_HTTP_MAX_TIME", 120.0))
+    max_delay: float = 30.0
+    pool_maxsize: int = 16
+    gracedb_url: str = os.getenv(
+        "SNIPERGW_GRACEDB_URL", "https://gracedb.ligo.org/api/"
+    )
+    user_agent: str = "snipergw"
+
+    @property
+    def timeout(self) -> tuple[float, float]:
+        """
+        Timeout tuple to pass to requests
+        """
+        return self.connect_timeout, self.read_timeout
+
+
+http_config = HTTPConfig()
+
+# Sessions are cached per process, so that forked workers
+# never share connections with their parent
+_sessions: dict[tuple[int, str], requests.Session] = {}
+
+
+def configure_http(**kwargs):
+    """
+    Update the HTTP configuration, and drop any existing sessions
+    so that the new configuration is used
+
+    :param kwargs: Fields of HTTPConfig to update
+    """
+    for key, value in kwargs.items():
+        setattr(http_config, key, value)
+    close_sessions()
+
+
+def close_sessions():
+    """
+    Close all sessions of this process
+    """
+    for key in [x for x in _sessions if x[0] == os.getpid()]:
+        _sessions.pop(key).close()
+
+
+class PooledSession(requests.Session):
+    """
+    Session with a connection pool and default timeouts
+    """
+
+    def __init__(self):
+        super().__init__()
+        adapter = HTTPAdapter(
+            pool_connections=http_config.pool_maxsize,
+            pool_maxsize=http_config.pool_maxsize,
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.headers.update({"User-Agent": http_config.user_agent})
+
+    def request(self, method, url, *args, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = http_config.timeout
+        return super().request(method, url, *args, **kwargs)
+
+
+class PooledGraceDb(GraceDb):
+    """
+    GraceDB client with default timeouts. Retries are handled by
+    snipergw rather than by the client itself.
+    """
+
+    def __init__(self):
+        super().__init__(service_url=http_config.gracedb_url, retries=0)
+
+    def request(self, method, url, *args, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = http_config.timeout
+        return super().request(method, url, *args, **kwargs)
+
+
+def get_session() -> requests.Session:
+    """
+    Get the shared session for generic HTTP requests
+
+    :return: Session
+    """
+    key = (os.getpid(), "generic")
+    if key not in _sessions:
+        _sessions[key] = PooledSession()
+    return _sessions[key]
+
+
+def get_gracedb_client() -> GraceDb:
+    """
+    Get the shared GraceDB client
+
+    :return: GraceDb client
+    """
+    key = (os.getpid(), "gracedb")
+    if key not in _sessions:
+        _sessions[key] = PooledGraceDb()
+    return _sessions[key]
+
+
+def is_permanent_error(exc: Exception) -> bool:
+    """
+    Check whether an exception should not be retried
+
+    :param exc: Exception
+    :return: Boolean
+    """
+    if isinstance(exc, requests.exceptions.HTTPError):
+        response = getattr(exc, "response", None)
+        return (response is None) or (
+            response.status_code not in TRANSIENT_STATUS_CODES
+        )
+    return False
+
+
+def get_backoff_delay(attempt: int) -> float:
+    """
+    Get a jittered exponential backoff delay
+
+    :param attempt: Number of the attempt which failed, starting from 0
+    :return: Delay in seconds
+    """
+    return backoff.full_jitter(min(2.0**attempt, http_config.max_delay))
+
+
+def retry_transient(func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Call a function, retrying transient HTTP errors with jittered
+    exponential backoff
+
+    :param func: Function to call
+    :param args: Arguments of function
+    :param kwargs: Keyword arguments of function
+    :return: Result of function
+    """
+    wrapped = backoff.on_exception(
+        backoff.expo,
+        TRANSIENT_EXCEPTIONS,
+        max_tries=http_config.max_tries,
+        max_time=http_config.max_time,
+        max_value=http_config.max_delay,
+        jitter=backoff.full_jitter,
+        giveup=is_permanent_error,
+        logger=logger,
+        backoff_log_level=logging.WARNING,
+    )(func)
+    return wrapped(*args, **kwargs)
+
+
+def get(url: str, session: requests.Session | None = None, **kwargs):
+    """
+    Perform a GET request with the shared session, raising for bad statuses,
+    and retrying transient errors
+
+    :param url: URL
+    :param session: Session to use (defaults to the shared generic session)
+    :param kwargs: Other arguments for requests
+    :return: Response
+    """
+    if session is None:
+        session = get_session()
+
+    def _get():
+        response = session.get(url, **kwargs)
+        response.raise_for_status()
+        return response
+
+    return retry_transient(_get)
+
+
+def poll_until(
+    check: Callable[[], bool],
+    deadline: float,
+    initial_delay: float = 0.5,
+    max_delay: float = 8.0,
+    errors: tuple[type[Exception], ...] = (),
+) -> float:
+    """
+    Call a function until it returns True, with exponentially increasing
+    delays between calls, and an overall deadline
+
+    :param check: Function returning whether the condition is met
+    :param deadline: Maximum total time in seconds
+    :param initial_delay: Delay in seconds after the first failed check
+    :param max_delay: Maximum delay in seconds between checks
+    :param errors: Exceptions raised by check which count as a failed check
+    :return: Time in seconds until the condition was met
+    """
+    t_start = time.perf_counter()
+    delay = initial_delay
+    n_checks = 0
+
+    while True:
+        n_checks += 1
+        try:
+            if check():
+                return time.perf_counter() - t_start
+        except errors as exc:
+            logger.warning(f"Check {n_checks} failed: {exc}")
+
+        remaining = deadline - (time.perf_counter() - t_start)
+        if remaining <= 0.0:
+            raise TimeoutError(
+                f"Condition not met after {n_checks} checks in {deadline:.1f}s"
+            )
+
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2.0, max_delay)
@@ -0,0 +1,555 @@
+"""
+This module contains local stand-ins for the external services used by
+snipergw, for end-to-end testing without credentials or network access:
+
+* GraceDB and HEASARC are served by a local HTTP server, with superevents
+  and GRBs whose skymaps are generated on the fly
+* Kowalski and WINTER are replaced in-process, by stand-ins for the
+  planobs Queue and the WinterAPI client
+
+Each service can be configured with a latency and an error rate, and the
+payload size is set by the resolution and area of the synthetic skymaps.
+"""
+
+import json
+import logging
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Iterator
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import requests
+from pydantic import BaseModel
+
+from snipergw.benchmark import BenchmarkCase, write_benchmark_skymap
+from snipergw.gbm import parse_grb_name
+from snipergw.session import configure_http, http_config
+
+logger = logging.getLogger(__name__)
+
+SERVICES = ["gracedb", "heasarc", "kowalski", "winter"]
+
+GRACEDB_PREFIX = "/gracedb/api"
+HEASARC_PREFIX = "/heasarc"
+FILES_PREFIX = "/files"
+
+
+class ServiceConfig(BaseModel):
+    """
+    Behaviour of a simulated service
+    """
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 503
+
+
+class SimulatorConfig(BaseModel):
+    """
+    Configuration of the simulated services
+    """
+
+    gracedb: ServiceConfig = ServiceConfig()
+    heasarc: ServiceConfig = ServiceConfig()
+    kowalski: ServiceConfig = ServiceConfig()
+    winter: ServiceConfig = ServiceConfig()
+    n_revisions: int = 1
+    listing_padding: int = 0
+    seed: int | None = None
+
+    @classmethod
+    def uniform(cls, service_config: ServiceConfig, **kwargs) -> "SimulatorConfig":
+        """
+        Create a config with the same behaviour for all services
+
+        :param service_config: Behaviour of every service
+        :param kwargs: Other fields of the config
+        :return: SimulatorConfig
+        """
+        return cls(**{x: service_config for x in SERVICES}, **kwargs)
+
+
+class FaultInjector:
+    """
+    Adds latency to, and randomly fails, calls to a simulated service
+    """
+
+    def __init__(self, config: ServiceConfig, seed: int | None = None):
+        """
+        :param config: Behaviour of the service
+        :param seed: Random seed
+        """
+        self.config = config
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.n_calls = 0
+        self.n_errors = 0
+
+    def __call__(self) -> bool:
+        """
+        Wait for the latency of one call, and decide whether it fails
+
+        :return: Whether the call fails
+        """
+        with self.lock:
+            delay = self.rng.gauss(self.config.latency, self.config.jitter)
+            fail = self.rng.random() < self.config.error_rate
+            self.n_calls += 1
+            self.n_errors += int(fail)
+
+        if delay > 0.0:
+            time.sleep(delay)
+        return fail
+
+
+class LocalQueue:
+    """
+    Local stand-in for the Kowalski queue of planobs
+    """
+
+    triggers: dict[str, list] = {}
+    faults: FaultInjector | None = None
+
+    def __init__(self, user: str):
+        self.user = user
+        self.queue = []
+
+    def call(self):
+        """
+        Simulate a call to Kowalski, raising an APIError if it fails
+        """
+        if (self.faults is not None) and self.faults():
+            from planobs.api import APIError
+
+            raise APIError("Simulated Kowalski error")
+
+    def add_trigger_to_queue(self, targets: list, trigger_name: str, **kwargs):
+        self.queue.append((f"{trigger_name}_{len(self.queue)}", targets))
+
+    def submit_queue(self):
+        self.call()
+        self.triggers.update(self.queue)
+
+    def delete_queue(self):
+        self.call()
+        for name, _ in self.queue:
+            self.triggers.pop(name, None)
+
+    def delete_trigger(self, name: str):
+        self.call()
+        self.triggers.pop(name, None)
+
+    def get_too_queues_nameonly(self) -> list[str]:
+        self.call()
+        return list(self.triggers)
+
+
+class LocalWinterAPI:
+    """
+    Local stand-in for the WINTER API
+    """
+
+    faults: FaultInjector | None = None
+
+    def __init__(self):
+        self.programs = []
+
+    def call(self):
+        """
+        Simulate a call to the WINTER API, raising a ConnectionError if it fails
+        """
+        if (self.faults is not None) and self.faults():
+            raise requests.exceptions.ConnectionError("Simulated WINTER error")
+
+    def get_user(self) -> str:
+        return "benchmark"
+
+    def get_programs(self) -> list[str]:
+        self.call()
+        return self.programs
+
+    def add_program(self, program_name: str, program_key: str):
+        self.programs.append(program_name)
+
+    def submit_too(
+        self, program_name: str, data: list, submit_trigger: bool = False
+    ) -> tuple[str, pd.DataFrame]:
+        self.call()
+        return "OK", pd.DataFrame([x.model_dump() for x in data])
+
+
+def get_service(path: str) -> str:
+    """
+    Get the simulated service of a request path
+
+    :param path: Path of request
+    :return: Service name
+    """
+    if path.startswith(HEASARC_PREFIX):
+        return "heasarc"
+    return "gracedb"
+
+
+class SimulatorServer:
+    """
+    Local HTTP server standing in for GraceDB and the HEASARC GBM archive
+    """
+
+    def __init__(self, config: SimulatorConfig | None = None, data_dir: Path = None):
+        """
+        :param config: Simulator configuration
+        :param data_dir: Directory for the generated skymaps
+            (defaults to a temporary directory)
+        """
+        self.config = SimulatorConfig() if config is None else config
+        self.faults = {
+            x: FaultInjector(getattr(self.config, x), seed=self.config.seed)
+            for x in ["gracedb", "heasarc"]
+        }
+
+        self.tmp_dir = None
+        if data_dir is None:
+            self.tmp_dir = tempfile.TemporaryDirectory()
+            data_dir = self.tmp_dir.name
+        self.data_dir = Path(data_dir)
+
+        # Superevents, newest first, with the file name of their skymap
+        self.superevents: dict[str, str] = {}
+        # Superevents which have been retracted
+        self.retracted: set[str] = set()
+        # GBM triggers by year, with the file name of their skymap
+        self.triggers: dict[str, dict[str, str]] = {}
+        self.requests = Counter()
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.get_handler())
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        """
+        Base URL of the server
+        """
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    @property
+    def gracedb_url(self) -> str:
+        """
+        Service URL of the simulated GraceDB API
+        """
+        return f"{self.url}{GRACEDB_PREFIX}/"
+
+    @property
+    def heasarc_url(self) -> str:
+        """
+        URL of the simulated GBM trigger archive
+        """
+        return f"{self.url}{HEASARC_PREFIX}"
+
+    def start(self):
+        """
+        Start serving in a background thread
+        """
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info(f"Simulator serving at {self.url}")
+
+    def stop(self):
+        """
+        Stop serving, and remove the generated skymaps
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.tmp_dir is not None:
+            self.tmp_dir.cleanup()
+
+    def __enter__(self) -> "SimulatorServer":
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def add_superevent(self, name: str, case: BenchmarkCase | None = None):
+        """
+        Add a superevent with a synthetic 3D skymap
+
+        :param name: Superevent ID, e.g S190425a
+        :param case: Skymap to generate
+        """
+        if case is None:
+            case = BenchmarkCase(moc=True)
+        file_name = f"{name}.{'multiorder.' if case.moc else ''}fits"
+        write_benchmark_skymap(self.data_dir.joinpath(file_name), case)
+        self.superevents = {name: file_name, **self.superevents}
+
+    def retract(self, name: str):
+        """
+        Retract a superevent, adding a retraction VOEvent after its revisions
+
+        :param name: Superevent ID
+        """
+        self.retracted.add(name)
+
+    def add_grb(self, name: str, case: BenchmarkCase | None = None):
+        """
+        Add a GRB with a synthetic skymap, as the only GBM trigger of its date
+        with a skymap
+
+        :param name: Name of GRB, e.g GRB190425A
+        :param case: Skymap to generate
+        """
+        if case is None:
+            case = BenchmarkCase()
+        grb = parse_grb_name(name)
+        trigger = f"bn{grb.date}{grb.index:03d}"
+        file_name = f"glg_healpix_all_{trigger}_v00.fit"
+        write_benchmark_skymap(self.data_dir.joinpath(file_name), case)
+        self.triggers.setdefault(grb.year, {})[trigger] = file_name
+
+    def get_voevents(self, name: str) -> list[dict]:
+        """
+        Get the VOEvents of a superevent, in the format of GraceDB
+
+        :param name: Superevent ID
+        :return: List of VOEvent dictionaries
+        """
+        n_voevents = self.config.n_revisions + int(name in self.retracted)
+        voevents = []
+        for i in range(1, n_voevents + 1):
+            if i > self.config.n_revisions:
+                voevent_type = "Retraction"
+            else:
+                voevent_type = "Preliminary" if i < 3 else "Update"
+            voevents.append(
+                {
+                    "N": i,
+                    "filename": f"{name}-{i}-{voevent_type}.xml",
+                    "voevent_type": voevent_type[:2].upper(),
+                    "links": {
+                        "file": (
+                            f"{self.gracedb_url}superevents/{name}/files/{name}-{i}.xml"
+                        )
+                    },
+                }
+            )
+        return voevents
+
+    def get_voevent_xml(self, name: str) -> bytes:
+        """
+        Get the XML of a VOEvent of a superevent
+
+        :param name: Superevent ID
+        :return: XML
+        """
+        skymap_url = f"{self.url}{FILES_PREFIX}/{self.superevents[name]}"
+        return (
+            f'<voe:VOEvent xmlns:voe="http://www.ivoa.net/xml/VOEvent/v2.0" '
+            f'ivorn="ivo://gwnet/LVC#{name}" role="test" version="2.0">'
+            f'<What><Param name="GraceID" value="{name}"/>'
+            f'<Param name="skymap_fits" value="{skymap_url}"/></What>'
+            f"</voe:VOEvent>"
+        ).encode()
+
+    def get_listing(self, year: str, trigger: str | None = None) -> list[str] | None:
+        """
+        Get the links of a directory of the GBM trigger archive
+
+        :param year: Year
+        :param trigger: Trigger name, or None for the yearly index
+        :return: List of links, or None if the directory does not exist
+        """
+        triggers = self.triggers.get(year)
+        if triggers is None:
+            return None
+
+        if trigger is None:
+            padding = [
+                f"bn{year[2:]}00{i:05d}/" for i in range(self.config.listing_padding)
+            ]
+            return padding + [f"{x}/" for x in sorted(triggers)]
+
+        if trigger not in triggers:
+            return None
+
+        return [f"glg_tte_n0_{trigger}_v00.fit", triggers[trigger]]
+
+    def get_superevent_page(self, params: dict[str, list[str]]) -> dict:
+        """
+        Get a page of superevents, newest first, in the format of GraceDB
+
+        :param params: Query parameters, with the page size as 'count'
+            and the offset as 'start'
+        :return: Dictionary with the superevents, and a link to the next page
+        """
+        names = list(self.superevents)
+        count = int(params.get("count", [len(names)])[0])
+        start = int(params.get("start", [0])[0])
+
+        links = {}
+        if start + count < len(names):
+            links["next"] = (
+                f"{self.gracedb_url}superevents/?count={count}&start={start + count}"
+            )
+
+        return {
+            "superevents": [{"superevent_id": x} for x in names[start : start + count]],
+            "links": links,
+        }
+
+    def route(self, url: str) -> tuple[str, str, bytes] | None:
+        """
+        Get the response to a GET request
+
+        :param url: URL of request, relative to the server
+        :return: Service, content type and body, or None if not found
+        """
+        path = urlparse(url).path
+        parts = [x for x in path.split("/") if x != ""]
+
+        if path.startswith(GRACEDB_PREFIX):
+            parts = parts[2:]
+            if len(parts) == 0:
+                api = {
+                    "links": {"superevents": f"{self.gracedb_url}superevents/"},
+                    "templates": {
+                        "superevent-detail-template": f"{self.gracedb_url}"
+                        "superevents/{superevent_id}/",
+                        "superevent-voevent-list-template": f"{self.gracedb_url}"
+                        "superevents/{superevent_id}/voevents/",
+                    },
+                }
+                return "gracedb", "application/json", json.dumps(api).encode()
+
+            if parts == ["superevents"]:
+                body = self.get_superevent_page(parse_qs(urlparse(url).query))
+                return "gracedb", "application/json", json.dumps(body).encode()
+
+            if (len(parts) == 3) and (parts[1] in self.superevents):
+                if parts[2] == "voevents":
+                    body = {"voevents": self.get_voevents(parts[1])}
+                    return "gracedb", "application/json", json.dumps(body).encode()
+
+            if (len(parts) == 4) and (parts[1] in self.superevents):
+                if parts[2] == "files":
+                    return "gracedb", "text/xml", self.get_voevent_xml(parts[1])
+
+        elif path.startswith(HEASARC_PREFIX):
+            parts = parts[1:]
+            listing = None
+            if len(parts) == 1:
+                listing = self.get_listing(parts[0])
+            elif (len(parts) == 3) and (parts[2] == "current"):
+                listing = self.get_listing(parts[0], parts[1])
+
+            elif (len(parts) == 4) and (parts[2] == "current"):
+                if parts[3] in (self.get_listing(parts[0], parts[1]) or []):
+                    file_path = self.data_dir.joinpath(parts[3])
+                    return "heasarc", "application/fits", file_path.read_bytes()
+
+            if listing is not None:
+                body = "".join(f'<a href="{x}">{x}</a>\n' for x in listing)
+                body = f"<html><body><pre>\n{body}</pre></body></html>"
+                return "heasarc", "text/html", body.encode()
+
+        elif path.startswith(FILES_PREFIX) and (
+            parts[1:] in [[x] for x in self.superevents.values()]
+        ):
+            return (
+                "gracedb",
+                "application/fits",
+                self.data_dir.joinpath(parts[1]).read_bytes(),
+            )
+
+        return None
+
+    def get_handler(self) -> type[BaseHTTPRequestHandler]:
+        """
+        Get the request handler class of the server
+
+        :return: Handler class
+        """
+        simulator = self
+
+        class SimulatorHandler(BaseHTTPRequestHandler):
+            """
+            Handler serving the routes of the simulator
+            """
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                service = get_service(path)
+                simulator.requests[service] += 1
+
+                if simulator.faults[service]():
+                    self.send_response(getattr(simulator.config, service).error_status)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                response = simulator.route(self.path)
+                if response is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                _, content_type, body = response
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return SimulatorHandler
+
+
+@contextmanager
+def simulated_services(
+    gracedb_url: str, heasarc_url: str, config: SimulatorConfig | None = None
+) -> Iterator[None]:
+    """
+    Context manager pointing snipergw at the simulated services: GraceDB and
+    HEASARC requests go to a simulator server, and Kowalski and WINTER are
+    replaced by the in-process stand-ins
+
+    :param gracedb_url: Service URL of the simulated GraceDB
+    :param heasarc_url: URL of the simulated GBM trigger archive
+    :param config: Simulator configuration, for the in-process stand-ins
+    """
+    if config is None:
+        config = SimulatorConfig()
+
+    old_gracedb_url = http_config.gracedb_url
+
+    with ExitStack() as stack:
+        configure_http(gracedb_url=gracedb_url)
+        stack.callback(configure_http, gracedb_url=old_gracedb_url)
+
+        stack.enter_context(patch("snipergw.gbm.GBM_TRIGGER_URL", heasarc_url))
+        stack.enter_context(
+            patch.object(
+                LocalQueue, "faults", FaultInjector(config.kowalski, config.seed)
+            )
+        )
+        stack.enter_context(
+            patch.object(
+                LocalWinterAPI, "faults", FaultInjector(config.winter, config.seed)
+            )
+        )
+        stack.enter_context(patch("snipergw.submit.ztf.Queue", LocalQueue))
+        stack.enter_context(
+            patch("snipergw.submit.winter.get_winter_api", LocalWinterAPI)
+        )
+        yield
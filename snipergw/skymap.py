@@ -7,21 +7,26 @@ import logging
 #!/usr/bin/env python
 # coding: utf-8
 import os
+from functools import cached_property
 from pathlib import Path
 
-import lxml.etree
 import numpy as np
 import requests
-import wget
 from astropy.io import fits
 from astropy.time import Time
-from ligo.gracedb.rest import GraceDb
-from lxml import html
 
+from snipergw.download import download_file
+from snipergw.gbm import get_grb_skymap_urls, parse_grb_name
+from snipergw.gracedb_index import SupereventIndex
 from snipergw.model import EventConfig
+from snipergw.session import get_gracedb_client
+from snipergw.store import SkymapRecord, SkymapStore, read_header_metadata
+from snipergw.tracing import span
 
 logger = logging.getLogger(__name__)
 
+DISTANCE_COLUMNS = ["DISTMU", "DISTSIGMA", "DISTNORM"]
+
 
 class Skymap:
     """
@@ -40,34 +45,51 @@ class Skymap:
         self.base_skymap_dir = event_config.output_dir.joinpath(f"skymaps")
         self.base_skymap_dir.mkdir(parents=True, exist_ok=True)
 
-        self.is_3d = False
+        self.store = SkymapStore(self.base_skymap_dir)
+        self.offline = event_config.offline
+        self.record: SkymapRecord | None = None
+        self.revision: int | None = None
 
-        if event_name is None:
-            self.skymap_path, self.event_name = self.get_gw_skymap(
-                event_name=event_name, rev=event_config.rev
-            )
-            self.is_3d = True
-        elif ".fit" in event_name:
-            self.skymap_path, self.event_name = self.parse_fits_file(event_name)
-        elif np.sum([x in str(event_config.event) for x in ["s", "S", "gw", "GW"]]) > 0:
-            self.skymap_path, self.event_name = self.get_gw_skymap(
-                event_name=event_name, rev=event_config.rev
-            )
-            self.is_3d = True
-        elif "grb" in event_name or "GRB" in event_name:
-            self.skymap_path, self.event_name = self.get_grb_skymap(
-                event_name=event_name
-            )
-        else:
-            raise Exception(
-                f"Event {event_name} not recognised as a fits file, "
-                f"a GRB or a GW event."
+        self.is_3d = False
+        self.sparse_cache: dict[tuple, SparseSkymap] = {}
+
+        with span("skymap", event=event_name) as skymap_span:
+            if event_name is None:
+                self.skymap_path, self.event_name = self.get_gw_skymap(
+                    event_name=event_name, rev=event_config.rev
+                )
+                self.is_3d = True
+            elif ".fit" in event_name:
+                self.skymap_path, self.event_name = self.parse_fits_file(event_name)
+            elif (
+                np.sum([x in str(event_config.event) for x in ["s", "S", "gw", "GW"]])
+                > 0
+            ):
+                self.skymap_path, self.event_name = self.get_gw_skymap(
+                    event_name=event_name, rev=event_config.rev
+                )
+                self.is_3d = True
+            elif "grb" in event_name or "GRB" in event_name:
+                self.skymap_path, self.event_name = self.get_grb_skymap(
+                    event_name=event_name
+                )
+            else:
+                raise Exception(
+                    f"Event {event_name} not recognised as a fits file, "
+                    f"a GRB or a GW event."
+                )
+
+            logger.info(f"Unpacking skymap for event {self.event_name}")
+
+            self.t_obs = self.read_map()
+
+            skymap_span.set(
+                event=self.event_name,
+                revision=self.revision,
+                is_moc=self.is_moc,
+                file_size=Path(self.skymap_path).stat().st_size,
             )
 
-        logger.info(f"Unpacking skymap for event {self.event_name}")
-
-        self.t_obs = self.read_map()
-
     def parse_fits_file(self, event: str):
         """
         Parse a fits file event
@@ -84,15 +106,75 @@ class Skymap:
             event_name = basename
 
         elif event[:8] == "https://":
-            logger.info(f"Downloading from: {event}")
-            skymap_path = self.base_skymap_dir.joinpath(os.path.basename(event[7:]))
-            wget.download(event, str(skymap_path))
             event_name = os.path.basename(event[7:])
+
+            self.record = self.store.resolve(source_url=event)
+
+            if self.record is None:
+                self.check_online(event_name)
+                self.record = self.download_to_store(
+                    url=event, event_name=event_name, file_name=event_name
+                )
+
+            skymap_path = self.store.get_path(self.record)
         else:
             raise FileNotFoundError(f"Unrecognised file {skymap_path}")
 
         return skymap_path, event_name
 
+    def check_online(self, event_name: str):
+        """
+        Raise an error if a download is needed while running offline
+
+        :param event_name: Name of event
+        """
+        if self.offline:
+            raise FileNotFoundError(
+                f"No skymap for {event_name} found in the local store "
+                f"at {self.store.base_dir}, and running in offline mode."
+            )
+
+    def download_to_store(
+        self,
+        url: str,
+        event_name: str,
+        file_name: str,
+        revision: int | None = None,
+        session: requests.Session | None = None,
+    ) -> SkymapRecord:
+        """
+        Download a skymap and add it to the local store
+
+        :param url: URL of skymap
+        :param event_name: Name of event
+        :param file_name: Original file name
+        :param revision: Revision number
+        :param session: Session to use (defaults to the shared session)
+        :return: Store record
+        """
+        logger.info(f"Downloading skymap from {url}")
+        with span("download", url=url) as download_span:
+            # Each download is completed to its own path, so concurrent runs
+            # never move each other's files into the store
+            result = download_file(
+                url,
+                self.store.new_tmp_path(file_name),
+                session=session,
+                part_path=self.store.get_download_path(
+                    source_url=url, file_name=file_name
+                ),
+            )
+            download_span.set(
+                n_bytes=result.n_bytes_downloaded, throughput_mb_s=result.throughput
+            )
+        return self.store.add(
+            result.path,
+            event=event_name,
+            revision=revision,
+            source_url=url,
+            file_name=file_name,
+        )
+
     def get_grb_skymap(self, event_name: str):
         """
         Function to download GRB from GCN
@@ -106,140 +188,427 @@ class Skymap:
                 "They must have the form 'GRB210729A"
             )
 
-        event_name = event_name.upper().replace(" ", "")
+        event_name = parse_grb_name(event_name).name
+        self.event_name = event_name
 
-        event_year_short = event_name[3:5]
-        event_year = "20" + event_year_short
-        event_month = event_name[5:7]
-        event_day = event_name[7:9]
-        event_letter = event_name[9].upper()
-        event_number = ord(event_letter) - 65
+        # Online, the latest skymap is always looked up, as GBM may have
+        # released a new version (glg_healpix_all_*_vNN) since it was stored
+        final_link = None
+        discovery_error = None
+        if not self.offline:
+            try:
+                with span("gbm_discovery", event=event_name):
+                    final_link = get_grb_skymap_urls(
+                        [event_name], cache_dir=self.base_skymap_dir.joinpath("gbm")
+                    )[event_name]
+            except (requests.RequestException, ValueError) as exc:
+                logger.warning(f"Fermi-GBM skymap discovery for {event_name} failed")
+                discovery_error = exc
+
+        if final_link is None:
+            # Offline, or discovery failed: use the stored skymap if there is one
+            self.record = self.store.resolve(event=event_name)
+            if self.record is None:
+                self.check_online(event_name)
+                raise discovery_error
+            return self.store.get_path(self.record), event_name
+
+        self.record = self.store.resolve(source_url=final_link)
+        if self.record is None:
+            self.record = self.download_to_store(
+                url=final_link,
+                event_name=event_name,
+                file_name=os.path.basename(final_link),
+            )
 
-        # get possible skymap URLs
-        url = f"https://heasarc.gsfc.nasa.gov/FTP/fermi/data/gbm/triggers/{event_year}"
+        return self.store.get_path(self.record), event_name
 
-        page_overview = requests.get(url)
-        webpage_overview = html.fromstring(page_overview.content)
+    def get_gw_skymap(self, event_name: str, rev: int) -> [Path, str]:
+        """
+        Function to download GW event from GraceDB
 
-        links_overview = webpage_overview.xpath("//a/@href")
+        :param event_name: Name e.g S200316bj
+        :param rev: Revision number
+        :return: Fits path, event name
+        """
 
-        links_for_date = []
+        if self.offline:
+            return self.get_gw_skymap_offline(event_name=event_name, rev=rev)
 
-        for link in links_overview:
-            if link[2:8] == f"{event_year_short}{event_month}{event_day}":
-                links_for_date.append(url + "/" + link + "current/")
+        if (event_name is not None) & (rev is not None):
+            self.record = self.store.resolve(event=event_name, revision=rev)
+            if self.record is not None:
+                self.revision = rev
+                return self.store.get_path(self.record), event_name
 
-        if len(links_for_date) > 1:
-            logger.info(
-                f"Found multiple events. "
-                f"Will choose the one corresponding the GRB letter {event_letter}"
-            )
+        ligo_client = get_gracedb_client()
+        index = SupereventIndex(self.base_skymap_dir)
 
-        event_url = links_for_date[event_number]
+        logger.info("Obtaining skymap from GraceDB")
 
-        page_event = requests.get(event_url)
-        webpage_event = html.fromstring(page_event.content)
-        links_event = webpage_event.xpath("//a/@href")
+        if event_name is None:
+            event_name = index.latest(ligo_client)
+            logger.info(f"Latest superevent is {event_name}")
 
-        for link in links_event:
-            if "glg_healpix" in link:
-                final_link = event_url + link
-                break
+        voevent = index.get_voevent(ligo_client, event_name, rev=rev)
+        logger.info(f"Found voevent {voevent.filename}")
 
-        skymap_path = self.base_skymap_dir.joinpath(link)
+        self.revision = voevent.revision
+        self.record = self.store.resolve(event=event_name, revision=self.revision)
+        if self.record is not None:
+            return self.store.get_path(self.record), event_name
 
-        if skymap_path.exists():
-            logger.info(f"Continuing with saved skymap. Located at {skymap_path}")
-        else:
-            logger.info(f"Downloading skymap and saving to {skymap_path}")
-            wget.download(final_link, str(skymap_path))
+        if voevent.is_retraction:
+            raise ValueError(
+                f"The specified LIGO event, {voevent.filename}, was retracted."
+            )
 
-        self.event_name = event_name
-        return skymap_path, event_name
+        latest_skymap = index.get_skymap_url(ligo_client, event_name, voevent)
 
-    def get_gw_skymap(self, event_name: str, rev: int) -> [Path, str]:
+        logger.info(f"Latest skymap URL: {latest_skymap}")
+
+        self.record = self.download_to_store(
+            url=latest_skymap,
+            event_name=event_name,
+            file_name=os.path.basename(latest_skymap),
+            revision=self.revision,
+            session=ligo_client,
+        )
+
+        return self.store.get_path(self.record), event_name
+
+    def get_gw_skymap_offline(self, event_name: str | None, rev: int | None):
         """
-        Function to download GW event from GraceDB
+        Function to find a GW event skymap in the local store, without GraceDB
 
-        :param event_name: Name e.g S200316bj
-        :param rev: Revision number
+        :param event_name: Name e.g S200316bj, or None for the latest stored event
+        :param rev: Revision number, or None for the latest stored revision
         :return: Fits path, event name
         """
+        if event_name is None:
+            latest = self.store.latest(gw_only=True)
+            if latest is None:
+                self.check_online("the latest GW event")
+            event_name = latest.event
+            logger.info(f"Latest stored GW event is {event_name}")
 
-        ligo_client = GraceDb()
+        self.record = self.store.resolve(event=event_name, revision=rev)
 
-        logger.info("Obtaining skymap from GraceDB")
+        if self.record is None:
+            self.check_online(f"{event_name} (revision {rev})")
 
-        if event_name is None:
-            superevent_iterator = ligo_client.superevents("category: Production")
-            superevent_ids = [
-                superevent["superevent_id"] for superevent in superevent_iterator
-            ]
-            event_name = superevent_ids[0]
+        self.revision = self.record.revision
 
-        voevents = ligo_client.voevents(event_name).json()["voevents"]
+        return self.store.get_path(self.record), event_name
 
-        if rev is None:
-            rev = len(voevents)
+    def read_map(
+        self,
+    ) -> Time:
+        """
+        Function to read the time of a skymap from its header.
+        Only the header is read, and if the skymap is in the local store,
+        the file is not opened at all.
 
-        elif rev > len(voevents):
-            raise Exception("Revision {0} not found".format(rev))
+        :return: Time of skymap detection
+        """
 
-        latest_voevent = voevents[rev - 1]
-        logger.info(f"Found voevent {latest_voevent['filename']}")
+        logger.info(f"Reading header of file: {self.skymap_path}")
 
-        if "Retraction" in latest_voevent["filename"]:
-            raise ValueError(
-                f"The specified LIGO event, "
-                f"{latest_voevent['filename']}, was retracted."
+        if "DATE-OBS" in self.header:
+            t_obs = Time(self.header["DATE-OBS"], format="isot")
+        elif "EVENTMJD" in self.header:
+            t_obs = Time(self.header["EVENTMJD"], format="mjd")
+        else:
+            raise KeyError(
+                f"Skymap {self.skymap_path} has neither DATE-OBS nor EVENTMJD"
+            )
+
+        return t_obs
+
+    @cached_property
+    def header(self) -> dict:
+        """
+        Relevant header keywords of the skymap, from the store index if possible
+        """
+        if self.record is not None:
+            return self.record.header
+        return read_header_metadata(self.skymap_path)
+
+    @property
+    def is_moc(self) -> bool:
+        """
+        Whether the skymap is a multi-order (MOC) skymap
+        """
+        return self.header.get("ORDERING") == "NUNIQ"
+
+    @property
+    def has_distance(self) -> bool:
+        """
+        Whether the skymap contains distance information
+        """
+        return ("DISTMEAN" in self.header) | ("DISTSTD" in self.header)
+
+    @cached_property
+    def hdul(self) -> fits.HDUList:
+        """
+        HDU list of the skymap, opened with memory mapping on first access
+        """
+        return fits.open(self.skymap_path, memmap=True)
+
+    @cached_property
+    def table(self) -> fits.FITS_rec:
+        """
+        Memory-mapped table of the skymap. Columns are only read on access.
+        """
+        return self.hdul[1].data
+
+    def get_column(self, column: str | int) -> np.ndarray:
+        """
+        Get a column of the skymap table as a flat array
+
+        :param column: Column name or index
+        :return: Array
+        """
+        return np.ravel(self.table.field(column))
+
+    def preprocess(
+        self,
+        nside: int,
+        credible_level: float | None = None,
+        do_3d: bool | None = None,
+    ) -> "SparseSkymap":
+        """
+        Preprocess the skymap for planning: multi-order skymaps are read natively
+        and rasterised to nside, flat skymaps are resampled to nside, and the map
+        is optionally cropped to the given credible region.
+        Results are cached per set of arguments.
+
+        :param nside: HEALPix nside to rasterise to
+        :param credible_level: Credible level to crop to (e.g 0.99), or None
+        :param do_3d: Whether to include distances (defaults to has_distance)
+        :return: SparseSkymap
+        """
+        if do_3d is None:
+            do_3d = self.has_distance
+
+        key = (nside, credible_level, do_3d)
+        if key in self.sparse_cache:
+            return self.sparse_cache[key]
+
+        with span(
+            "preprocess_skymap", nside=nside, credible_level=credible_level
+        ) as preprocess_span:
+            # healpy and ligo.skymap are slow to import, and only needed for planning
+            import healpy as hp
+            from astropy.table import Table
+            from ligo.skymap.bayestar import rasterize
+
+            columns = ["PROB"] + (DISTANCE_COLUMNS if do_3d else [])
+
+            if self.is_moc:
+                moc_table = Table(
+                    {
+                        x: self.get_column(x)
+                        for x in ["UNIQ", "PROBDENSITY"]
+                        + (DISTANCE_COLUMNS if do_3d else [])
+                    }
+                )
+                raster = rasterize(moc_table, order=hp.nside2order(nside))
+                data = [np.asarray(raster[x], dtype=float) for x in columns]
+            else:
+                data = [self.get_column(i).astype(float) for i in range(len(columns))]
+                order_in = (
+                    "NESTED" if self.header.get("ORDERING") == "NESTED" else "RING"
+                )
+                data = [
+                    hp.ud_grade(
+                        x,
+                        nside,
+                        order_in=order_in,
+                        order_out="NESTED",
+                        power=-2 if i == 0 else None,
+                    )
+                    for i, x in enumerate(data)
+                ]
+
+            prob = data[0]
+            if not do_3d:
+                prob = prob / np.sum(prob)
+
+            ipix = np.arange(len(prob))
+            if credible_level is not None:
+                ipix = get_credible_pixels(prob, credible_level)
+
+            sparse = SparseSkymap(
+                nside=nside,
+                ipix=ipix,
+                prob=prob[ipix],
+                distances=[x[ipix] for x in data[1:]] if do_3d else None,
             )
 
-        response = requests.get(latest_voevent["links"]["file"])
+            logger.info(
+                f"Preprocessed skymap to nside={nside}, keeping {sparse.n_pixels} "
+                f"pixels ({sparse.area:.0f} sq. deg., "
+                f"{100.*np.sum(sparse.prob):.1f}% of probability)"
+            )
 
-        root = lxml.etree.fromstring(response.content)
-        params = {
-            elem.attrib["name"]: elem.attrib["value"]
-            for elem in root.iterfind(".//Param")
-        }
+            preprocess_span.set(n_pixels=int(sparse.n_pixels))
 
-        latest_skymap = params["skymap_fits"]
+        self.sparse_cache[key] = sparse
+        return sparse
 
-        logger.info(f"Latest skymap URL: {latest_skymap}")
+    def get_map_struct(
+        self,
+        nside: int,
+        do_3d: bool | None = None,
+        dscale: float = 1.0,
+        credible_level: float | None = None,
+    ) -> dict:
+        """
+        Get a gwemopt-style map struct at a given nside, with maps in RING ordering
 
-        base_file_name = os.path.basename(latest_skymap)
-        savepath = self.base_skymap_dir.joinpath(
-            f"{event_name}_{latest_voevent['N']}_{base_file_name}",
-        )
+        :param nside: HEALPix nside
+        :param do_3d: Whether to include distances (defaults to has_distance)
+        :param dscale: Scale factor applied to distances
+        :param credible_level: Credible level to crop to (e.g 0.99), or None
+        :return: Map struct
+        """
+        map_struct = self.preprocess(
+            nside=nside, credible_level=credible_level, do_3d=do_3d
+        ).to_map_struct(dscale=dscale)
 
-        if savepath.exists():
-            logger.info(f"File {savepath} already exists. Using this.")
-        else:
-            logger.info(f"Saving to: {savepath}")
-            response = requests.get(latest_skymap)
+        if "DATE" in self.header:
+            map_struct["trigtime"] = self.header["DATE"]
 
-            with open(savepath, "wb") as f:
-                f.write(response.content)
+        return map_struct
+
+    def close(self):
+        """
+        Close the memory-mapped file, if it was opened
+        """
+        if "hdul" in self.__dict__:
+            self.__dict__.pop("table", None)
+            self.__dict__.pop("hdul").close()
 
-        return savepath, event_name
+    def __getstate__(self) -> dict:
+        """
+        Drop open file handles when pickling, they are reopened on access
+        """
+        state = self.__dict__.copy()
+        for key in ["hdul", "table"]:
+            state.pop(key, None)
+        return state
 
-    def read_map(
+
+def get_credible_pixels(prob: np.ndarray, credible_level: float) -> np.ndarray:
+    """
+    Get the (sorted) indices of the smallest set of pixels
+    containing a given probability
+
+    :param prob: Probability per pixel
+    :param credible_level: Credible level, e.g 0.9
+    :return: Pixel indices
+    """
+    sort_idx = np.argsort(prob)[::-1]
+    cumprob = np.cumsum(prob[sort_idx])
+    n_keep = int(np.searchsorted(cumprob, credible_level * cumprob[-1])) + 1
+    return np.sort(sort_idx[:n_keep])
+
+
+class SparseSkymap:
+    """
+    Compact representation of a skymap at a fixed nside,
+    storing only the selected pixels in NESTED ordering
+    """
+
+    def __init__(
         self,
-    ) -> Time:
+        nside: int,
+        ipix: np.ndarray,
+        prob: np.ndarray,
+        distances: list[np.ndarray] | None = None,
+    ):
+        """
+        :param nside: HEALPix nside
+        :param ipix: NESTED pixel indices
+        :param prob: Probability per pixel
+        :param distances: DISTMU, DISTSIGMA and DISTNORM per pixel, or None
         """
-        Function to read skymap
+        self.nside = nside
+        self.ipix = ipix.astype(np.int64)
+        self.prob = prob
+        self.distances = distances
 
-        :return: Time of skymap detection
+    @property
+    def npix(self) -> int:
+        """
+        Number of pixels of the full map
+        """
+        import healpy as hp
+
+        return hp.nside2npix(self.nside)
+
+    @property
+    def n_pixels(self) -> int:
+        """
+        Number of stored pixels
         """
+        return len(self.ipix)
 
-        logger.info(f"Reading file: {self.skymap_path}")
+    @property
+    def area(self) -> float:
+        """
+        Area of the stored pixels in square degrees
+        """
+        import healpy as hp
 
-        with fits.open(self.skymap_path) as hdul:
-            for x in hdul:
-                if "DATE-OBS" in x.header:
-                    t_obs = Time(x.header["DATE-OBS"], format="isot")
+        return self.n_pixels * hp.nside2pixarea(self.nside, degrees=True)
 
-                elif "EVENTMJD" in x.header:
-                    t_obs_mjd = x.header["EVENTMJD"]
-                    t_obs = Time(t_obs_mjd, format="mjd")
+    def to_dense(self, values: np.ndarray, fill: float = 0.0) -> np.ndarray:
+        """
+        Expand values of the stored pixels to a full map in RING ordering
 
-        return t_obs
+        :param values: Values per stored pixel
+        :param fill: Value for pixels which are not stored
+        :return: Full map
+        """
+        import healpy as hp
+
+        dense = np.full(self.npix, fill, dtype=float)
+        dense[self.ipix] = values
+        return hp.reorder(dense, n2r=True)
+
+    def get_prob(self, ipix: np.ndarray) -> np.ndarray:
+        """
+        Get the probability of pixels, without expanding to a full map
+
+        :param ipix: Pixel indices in RING ordering
+        :return: Probability per pixel, zero for pixels which are not stored
+        """
+        import healpy as hp
+
+        nested = hp.ring2nest(self.nside, np.asarray(ipix, dtype=np.int64))
+        positions = np.searchsorted(self.ipix, nested)
+        found = positions < len(self.ipix)
+        found[found] = self.ipix[positions[found]] == nested[found]
+        prob = np.zeros(len(nested))
+        prob[found] = self.prob[positions[found]]
+        return prob
+
+    def to_map_struct(self, dscale: float = 1.0) -> dict:
+        """
+        Convert to a gwemopt-style map struct, with full maps in RING ordering.
+        Pixels which are not stored have zero probability and no distance data.
+
+        :param dscale: Scale factor applied to distances
+        :return: Map struct
+        """
+        map_struct = {"prob": self.to_dense(self.prob)}
+
+        if self.distances is not None:
+            distmu, distsigma, distnorm = self.distances
+            map_struct["distmu"] = self.to_dense(distmu, fill=np.inf) / dscale
+            map_struct["distsigma"] = self.to_dense(distsigma, fill=1.0) / dscale
+            map_struct["distnorm"] = self.to_dense(distnorm)
+
+        return map_struct
@@ -0,0 +1,384 @@
+"""
+This module contains the SkymapStore class, a content-addressed local store
+for skymap files
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from astropy.io import fits
+from astropy.time import Time
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 2**20
+
+# Header keywords which are worth keeping in the index,
+# so that we can answer simple questions without opening the file
+HEADER_KEYWORDS = [
+    "DATE",
+    "DATE-OBS",
+    "MJD-OBS",
+    "EVENTMJD",
+    "OBJECT",
+    "INSTRUME",
+    "ORDERING",
+    "NSIDE",
+    "INDXSCHM",
+    "MOCORDER",
+    "DISTMEAN",
+    "DISTSTD",
+]
+
+
+class SkymapRecord(BaseModel):
+    """
+    Index entry for a skymap in the store
+    """
+
+    event: str
+    revision: int | None = None
+    source_url: str | None = None
+    file_name: str
+    sha256: str
+    size: int
+    header: dict[str, str | int | float | bool] = {}
+    created: str
+
+
+def hash_file(path: Path) -> str:
+    """
+    Compute the sha256 hash of a file, reading it in chunks
+
+    :param path: Path of file
+    :return: Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_header_metadata(path: Path) -> dict:
+    """
+    Read the relevant header keywords from all HDUs of a fits file,
+    without loading any data
+
+    :param path: Path of fits file
+    :return: Dictionary of header keywords
+    """
+    metadata = {}
+    with fits.open(path) as hdul:
+        for hdu in hdul:
+            for key in HEADER_KEYWORDS:
+                if key in hdu.header and key not in metadata:
+                    metadata[key] = hdu.header[key]
+    return metadata
+
+
+def get_file_suffix(file_name: str) -> str:
+    """
+    Get a suffix for a stored skymap, so fits readers can still
+    recognise compressed files
+
+    :param file_name: Original file name
+    :return: Suffix
+    """
+    if ".gz" in file_name:
+        return ".fits.gz"
+    return ".fits"
+
+
+class SkymapStore:
+    """
+    Content-addressed store of skymaps, with an index mapping
+    (event, revision, source URL) to the hash of the file
+    """
+
+    def __init__(self, base_dir: Path):
+        """
+        :param base_dir: Directory of the store
+        """
+        self.base_dir = Path(base_dir)
+        self.objects_dir = self.base_dir.joinpath("objects")
+        self.tmp_dir = self.base_dir.joinpath("tmp")
+        self.index_path = self.base_dir.joinpath("index.json")
+        self.lock_path = self.base_dir.joinpath("index.lock")
+
+        for directory in [self.objects_dir, self.tmp_dir]:
+            directory.mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        """
+        Context manager holding an exclusive lock on the index
+        """
+        with open(self.lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_index(self) -> list[SkymapRecord]:
+        """
+        Read the index
+
+        :return: List of records
+        """
+        if not self.index_path.exists():
+            return []
+
+        with open(self.index_path, "r") as f:
+            entries = json.load(f)
+
+        return [SkymapRecord(**x) for x in entries]
+
+    def _write_index(self, records: list[SkymapRecord]):
+        """
+        Atomically write the index
+
+        :param records: List of records
+        """
+        tmp_path = self.tmp_dir.joinpath(f"index_{uuid.uuid4().hex}.json")
+        with open(tmp_path, "w") as f:
+            json.dump([x.model_dump() for x in records], f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def get_path(self, record: SkymapRecord) -> Path:
+        """
+        Get the path of the object corresponding to a record
+
+        :param record: Record
+        :return: Path of stored file
+        """
+        return self.objects_dir.joinpath(
+            record.sha256[:2], record.sha256 + get_file_suffix(record.file_name)
+        )
+
+    def new_tmp_path(self, file_name: str) -> Path:
+        """
+        Get a unique temporary path inside the store,
+        on the same filesystem as the objects
+
+        :param file_name: Original file name
+        :return: Temporary path
+        """
+        return self.tmp_dir.joinpath(
+            f"{uuid.uuid4().hex}_{os.path.basename(file_name)}"
+        )
+
+    def get_download_path(self, source_url: str, file_name: str) -> Path:
+        """
+        Get the partial file path inside the store for downloading a URL.
+        The path is the same for every run and process, so an interrupted
+        download can be resumed (the download engine locks it while in use).
+
+        :param source_url: Source URL
+        :param file_name: Original file name
+        :return: Partial file path
+        """
+        url_hash = hashlib.sha256(source_url.encode()).hexdigest()[:16]
+        return self.tmp_dir.joinpath(f"{url_hash}_{os.path.basename(file_name)}.part")
+
+    def find(
+        self,
+        event: str | None = None,
+        revision: int | None = None,
+        source_url: str | None = None,
+    ) -> SkymapRecord | None:
+        """
+        Find a record in the index. If several records match,
+        the one with the highest revision (then the most recent) is returned.
+
+        :param event: Event name
+        :param revision: Revision number
+        :param source_url: Source URL
+        :return: Matching record or None
+        """
+        matches = [
+            x
+            for x in self._read_index()
+            if (event is None or x.event == event)
+            and (revision is None or x.revision == revision)
+            and (source_url is None or x.source_url == source_url)
+        ]
+
+        if len(matches) == 0:
+            return None
+
+        return sorted(
+            matches, key=lambda x: (x.revision or 0, x.created), reverse=True
+        )[0]
+
+    def latest(self, gw_only: bool = False) -> SkymapRecord | None:
+        """
+        Get the most recently added record
+
+        :param gw_only: Only consider records with a revision, i.e GW events
+        :return: Latest record or None
+        """
+        records = [
+            x for x in self._read_index() if (not gw_only) or x.revision is not None
+        ]
+        if len(records) == 0:
+            return None
+        return sorted(records, key=lambda x: x.created)[-1]
+
+    def verify(self, record: SkymapRecord) -> bool:
+        """
+        Check that the stored file for a record exists and
+        matches the recorded size and hash
+
+        :param record: Record
+        :return: Boolean
+        """
+        path = self.get_path(record)
+
+        if not path.exists():
+            logger.warning(f"Stored skymap {path} is missing")
+            return False
+
+        if path.stat().st_size != record.size:
+            logger.warning(
+                f"Stored skymap {path} has size {path.stat().st_size}, "
+                f"expected {record.size}"
+            )
+            return False
+
+        if hash_file(path) != record.sha256:
+            logger.warning(f"Stored skymap {path} does not match its hash")
+            return False
+
+        return True
+
+    def resolve(
+        self,
+        event: str | None = None,
+        revision: int | None = None,
+        source_url: str | None = None,
+    ) -> SkymapRecord | None:
+        """
+        Find a record and verify the stored file.
+        Corrupt entries are removed from the store.
+
+        :param event: Event name
+        :param revision: Revision number
+        :param source_url: Source URL
+        :return: Verified record or None
+        """
+        record = self.find(event=event, revision=revision, source_url=source_url)
+
+        if record is None:
+            return None
+
+        if not self.verify(record):
+            self.remove(record)
+            return None
+
+        logger.info(
+            f"Found skymap for {record.event} in local store: {self.get_path(record)}"
+        )
+        return record
+
+    def add(
+        self,
+        path: Path,
+        event: str,
+        revision: int | None = None,
+        source_url: str | None = None,
+        file_name: str | None = None,
+    ) -> SkymapRecord:
+        """
+        Add a file to the store. The file is moved into the store,
+        so it should be a temporary file on the same filesystem.
+        An object with the same hash is only reused if it is intact.
+
+        :param path: Path of file to add
+        :param event: Event name
+        :param revision: Revision number
+        :param source_url: Source URL
+        :param file_name: Original file name (defaults to the name of path)
+        :return: New record
+        """
+        path = Path(path)
+
+        if file_name is None:
+            file_name = path.name
+
+        try:
+            header = read_header_metadata(path)
+        except OSError as exc:
+            path.unlink(missing_ok=True)
+            raise ValueError(
+                f"File from {source_url} is not a valid fits file"
+            ) from exc
+
+        record = SkymapRecord(
+            event=event,
+            revision=revision,
+            source_url=source_url,
+            file_name=os.path.basename(file_name),
+            sha256=hash_file(path),
+            size=path.stat().st_size,
+            header=header,
+            created=Time.now().isot,
+        )
+
+        object_path = self.get_path(record)
+        object_path.parent.mkdir(exist_ok=True)
+
+        if object_path.exists() and self.verify(record):
+            path.unlink()
+        else:
+            # A corrupt object is replaced by the new copy
+            os.replace(path, object_path)
+
+        with self._locked():
+            records = [
+                x
+                for x in self._read_index()
+                if not (
+                    x.event == record.event
+                    and x.revision == record.revision
+                    and x.source_url == record.source_url
+                )
+            ]
+            records.append(record)
+            self._write_index(records)
+
+        logger.info(f"Added skymap for {event} to store: {object_path}")
+
+        return record
+
+    def remove(self, record: SkymapRecord):
+        """
+        Remove a record from the index, and delete the stored file
+        if no other record refers to it
+
+        :param record: Record to remove
+        """
+        with self._locked():
+            records = [
+                x
+                for x in self._read_index()
+                if not (
+                    x.event == record.event
+                    and x.revision == record.revision
+                    and x.source_url == record.source_url
+                )
+            ]
+            self._write_index(records)
+
+        if record.sha256 not in [x.sha256 for x in records]:
+            self.get_path(record).unlink(missing_ok=True)
+
+        logger.info(f"Removed skymap for {record.event} from store")
@@ -1,6 +1,36 @@
 """
-This module contains functions to submit ToOs to various telescopes
+This module contains functions to submit ToOs to various telescopes.
+
+Each backend is only imported when it is used, because the client libraries
+are slow to import and may contact their servers or the system keychain.
 """
 
-from snipergw.submit.winter import submit_too_winter
-from snipergw.submit.ztf import submit_too_ztf
+import importlib
+from typing import Callable
+
+# Telescope -> (module, function) of each submission backend
+SUBMITTERS = {
+    "ZTF": ("snipergw.submit.ztf", "submit_too_ztf"),
+    "WINTER": ("snipergw.submit.winter", "submit_too_winter"),
+}
+
+
+def get_submitter(telescope: str) -> Callable:
+    """
+    Get the submission function for a telescope, importing its backend
+
+    :param telescope: Telescope name
+    :return: Submission function
+    """
+    if telescope not in SUBMITTERS:
+        raise NotImplementedError(f"No submission backend for {telescope}")
+
+    module_name, function_name = SUBMITTERS[telescope]
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def __getattr__(name: str):
+    for telescope, (_, function_name) in SUBMITTERS.items():
+        if name == function_name:
+            return get_submitter(telescope)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,254 @@
+"""
+This module contains the SubmissionLedger, a local record of the triggers
+submitted for an event. With it, a new schedule for the same event can be
+submitted as a delta: triggers which are still wanted are kept, triggers with
+targets which are no longer wanted are deleted, and only the targets not
+already in the queue are submitted.
+"""
+
+import fcntl
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from snipergw.model import PlanConfig
+from snipergw.schedule import Schedule
+
+logger = logging.getLogger(__name__)
+
+LEDGER_NAME = "submissions.json"
+
+# Number of completed operations whose idempotency keys are kept
+MAX_IDEMPOTENCY_KEYS = 20
+
+
+class SubmittedTrigger(BaseModel):
+    """
+    A trigger submitted to a facility, with its (field, filter) targets
+    """
+
+    name: str
+    targets: list[tuple[int, str]]
+    start_mjd: float
+    end_mjd: float
+    submitted: float = 0.0
+
+
+class SubmissionDelta(BaseModel):
+    """
+    Changes needed to bring the submitted triggers in line with a new schedule
+    """
+
+    keep: list[str] = []
+    remove: list[str] = []
+    add: list[tuple[int, str]] = []
+
+    @property
+    def is_empty(self) -> bool:
+        """
+        Whether the submitted triggers are already up to date
+        """
+        return (len(self.remove) == 0) & (len(self.add) == 0)
+
+
+class SubmissionLedger(BaseModel):
+    """
+    Triggers submitted for one event and telescope
+    """
+
+    triggers: list[SubmittedTrigger] = []
+    n_submitted: int = 0
+    # Keys of the last completed submissions and deletions, newest last
+    idempotency_keys: list[str] = []
+
+    @classmethod
+    def read(cls, path: Path) -> "SubmissionLedger":
+        """
+        Read a ledger, or create an empty one if it does not exist
+
+        :param path: Path of ledger
+        :return: SubmissionLedger
+        """
+        if not path.exists():
+            return cls()
+        with open(path, "r", encoding="utf8") as f:
+            return cls.model_validate_json(f.read())
+
+    def write(self, path: Path):
+        """
+        Write the ledger, replacing any previous version
+
+        :param path: Path of ledger
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf8") as f:
+            f.write(self.model_dump_json(indent=2))
+        os.replace(tmp_path, path)
+
+    @property
+    def idempotency_key(self) -> str | None:
+        """
+        Key of the last completed submission or deletion. Only this one is
+        skipped when repeated: repeating an older operation after a different
+        one is a real change, e.g. restoring the targets of an earlier schedule.
+        """
+        if len(self.idempotency_keys) == 0:
+            return None
+        return self.idempotency_keys[-1]
+
+    def record_operation(self, idempotency_key: str):
+        """
+        Record a completed submission or deletion, keeping the keys of
+        the last MAX_IDEMPOTENCY_KEYS operations
+
+        :param idempotency_key: Idempotency key of the operation
+        """
+        self.idempotency_keys.append(idempotency_key)
+        self.idempotency_keys = self.idempotency_keys[-MAX_IDEMPOTENCY_KEYS:]
+
+    @property
+    def names(self) -> list[str]:
+        """
+        Names of the submitted triggers
+        """
+        return [x.name for x in self.triggers]
+
+    @property
+    def targets(self) -> list[tuple[int, str]]:
+        """
+        Targets of all the submitted triggers
+        """
+        return [target for x in self.triggers for target in x.targets]
+
+    def get_delta(
+        self,
+        targets: list[tuple[int, str]],
+        observed_fields: list[int] | None = None,
+    ) -> SubmissionDelta:
+        """
+        Compare the submitted triggers with the targets of a new schedule.
+        Triggers are kept if all their targets are still wanted, and removed
+        otherwise, as triggers can only be submitted or deleted as a whole.
+        Targets of observed fields are left out of the comparison, as an
+        incremental plan never schedules them again.
+
+        :param targets: (field, filter) targets of the new schedule
+        :param observed_fields: Fields observed before the new schedule starts
+        :return: SubmissionDelta
+        """
+        observed = set(observed_fields or [])
+        wanted = Counter(targets)
+        delta = SubmissionDelta()
+
+        for trigger in self.triggers:
+            trigger_targets = Counter(
+                x for x in trigger.targets if x[0] not in observed
+            )
+            if len(trigger_targets - wanted) == 0:
+                wanted -= trigger_targets
+                delta.keep.append(trigger.name)
+            else:
+                delta.remove.append(trigger.name)
+
+        delta.add = sorted(wanted.elements())
+        return delta
+
+    def add(
+        self,
+        name: str,
+        targets: list[tuple[int, str]],
+        start_mjd: float,
+        end_mjd: float,
+    ):
+        """
+        Record a submitted trigger
+
+        :param name: Trigger name
+        :param targets: (field, filter) targets of the trigger
+        :param start_mjd: Start of validity window
+        :param end_mjd: End of validity window
+        """
+        self.triggers = [x for x in self.triggers if x.name != name]
+        self.triggers.append(
+            SubmittedTrigger(
+                name=name,
+                targets=targets,
+                start_mjd=start_mjd,
+                end_mjd=end_mjd,
+                submitted=time.time(),
+            )
+        )
+        self.n_submitted += 1
+
+    def remove(self, name: str):
+        """
+        Forget a trigger, once it has been deleted
+
+        :param name: Trigger name
+        """
+        self.triggers = [x for x in self.triggers if x.name != name]
+
+
+def get_ledger_path(plan_config: PlanConfig, event_name: str) -> Path:
+    """
+    Get the path of the submission ledger of an event
+
+    :param plan_config: Plan config
+    :param event_name: Event name
+    :return: Path of ledger
+    """
+    return plan_config.get_output_dir(event_name).joinpath(LEDGER_NAME)
+
+
+@contextmanager
+def lock_ledger(path: Path):
+    """
+    Context manager holding an exclusive lock on a ledger, so only one process
+    at a time submits (or deletes) the triggers of an event and telescope
+
+    :param path: Path of ledger
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_suffix(".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def get_trigger_name(plan_config: PlanConfig, event_name: str) -> str:
+    """
+    Get the base name of the triggers of an event
+
+    :param plan_config: Plan config
+    :param event_name: Event name
+    :return: Trigger name
+    """
+    if plan_config.telescope == "ZTF":
+        return f"ToO_{plan_config.subprogram}_{event_name}"
+    return event_name
+
+
+def select_targets(schedule: Schedule, targets: list[tuple[int, str]]) -> Schedule:
+    """
+    Select the pointings of a schedule matching a list of targets.
+    If a target is listed fewer times than it is scheduled,
+    its first pointings are selected.
+
+    :param schedule: Schedule
+    :param targets: (field, filter) targets
+    :return: Schedule of the selected pointings
+    """
+    remaining = Counter(targets)
+    mask = []
+    for target in schedule.get_targets():
+        mask.append(remaining[target] > 0)
+        remaining[target] -= 1
+    return schedule[mask]
@@ -0,0 +1,330 @@
+"""
+This module submits the schedules of several facilities concurrently.
+
+Each facility is submitted in its own daemon thread, as the clients of the
+backends are blocking, so a slow facility (e.g. waiting for a ZTF trigger to
+appear in the Kowalski queue) does not delay the others. Each facility has its
+own timeout, and gives one FacilityResult, whether it succeeded or not. A
+facility which times out is abandoned: its thread does not keep the process
+alive, so a hung facility cannot block the command line after the timeout.
+
+Each submission (or deletion) has an idempotency key, built from the trigger
+name of the event, the action and the scheduled targets. The keys of the last
+completed operations are recorded in the submission ledger, under a lock, so
+retrying the latest submission (e.g. after a timeout, or a failure of another
+facility) is skipped rather than sent twice.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextvars import copy_context
+from typing import Callable
+
+import pandas as pd
+from pydantic import BaseModel
+
+from snipergw.model import PlanConfig
+from snipergw.schedule import Schedule
+from snipergw.submit import get_submitter
+from snipergw.submit.ledger import (
+    SubmissionLedger,
+    get_ledger_path,
+    get_trigger_name,
+    lock_ledger,
+)
+from snipergw.tracing import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = float(os.getenv("SNIPERGW_SUBMIT_TIMEOUT", 300.0))
+
+# Timeout of each facility in seconds, including the confirmation of triggers
+DEFAULT_TIMEOUTS = {
+    "ZTF": float(os.getenv("SNIPERGW_SUBMIT_TIMEOUT_ZTF", DEFAULT_TIMEOUT)),
+    "WINTER": float(os.getenv("SNIPERGW_SUBMIT_TIMEOUT_WINTER", 120.0)),
+}
+
+# Status of a facility once each action has completed
+ACTION_STATUSES = {"submit": "submitted", "delete": "deleted", "dry_run": "dry_run"}
+
+FAILED_STATUSES = ["failed", "timeout"]
+
+
+class FacilityResult(BaseModel):
+    """
+    Outcome of submitting (or deleting) the schedule of one facility
+    """
+
+    telescope: str
+    event_name: str
+    action: str
+    idempotency_key: str
+    status: str = "pending"
+    n_targets: int = 0
+    duration: float = 0.0
+    error: str | None = None
+    details: dict = {}
+
+    @property
+    def ok(self) -> bool:
+        """
+        Whether the submission succeeded (or was not needed)
+        """
+        return self.status not in FAILED_STATUSES
+
+
+def get_action(submit: bool = False, delete: bool = False) -> str:
+    """
+    Get the name of a submission action
+
+    :param submit: Submit the queue
+    :param delete: Delete the queue
+    :return: Action name
+    """
+    if delete:
+        return "delete"
+    if submit:
+        return "submit"
+    return "dry_run"
+
+
+def get_idempotency_key(
+    schedule: pd.DataFrame, event_name: str, plan_config: PlanConfig, action: str
+) -> str:
+    """
+    Get the idempotency key of a submission, which is the same for any
+    retry of the same action with the same targets and validity window
+
+    :param schedule: Schedule dataframe
+    :param event_name: Event name
+    :param plan_config: Plan config
+    :param action: Action name
+    :return: Idempotency key
+    """
+    targets = sorted(Schedule.from_dataframe(schedule).get_targets())
+    window = None
+    if len(schedule) > 0:
+        window = [round(float(schedule["tobs"].min()), 6)]
+        window.append(round(float(schedule["tobs"].max()), 6))
+
+    payload = json.dumps(
+        {
+            "targets": targets,
+            "window": window,
+            "exposuretime": plan_config.exposuretime,
+            "incremental": plan_config.incremental,
+        }
+    )
+    digest = hashlib.sha256(payload.encode()).hexdigest()[:16]
+    trigger_name = get_trigger_name(plan_config, event_name)
+    return f"{trigger_name}:{action}:{digest}"
+
+
+def submit_facility(
+    schedule: pd.DataFrame,
+    event_name: str,
+    plan_config: PlanConfig,
+    submit: bool = False,
+    delete: bool = False,
+) -> FacilityResult:
+    """
+    Submit (or delete) the schedule of one facility, unless the same
+    operation has already been completed. Errors are recorded in the result.
+
+    :param schedule: Schedule dataframe
+    :param event_name: Event name
+    :param plan_config: Plan config
+    :param submit: Submit the queue
+    :param delete: Delete the queue
+    :return: FacilityResult
+    """
+    action = get_action(submit=submit, delete=delete)
+    result = FacilityResult(
+        telescope=plan_config.telescope,
+        event_name=event_name,
+        action=action,
+        idempotency_key=get_idempotency_key(schedule, event_name, plan_config, action),
+        n_targets=len(schedule),
+    )
+
+    t_start = time.perf_counter()
+
+    try:
+        # The span is left with the error, so failures show in the trace
+        with span(
+            "submit",
+            event=event_name,
+            telescope=plan_config.telescope,
+            n_pointings=len(schedule),
+            delete=delete,
+        ) as submit_span:
+            submitter = get_submitter(plan_config.telescope)
+            ledger_path = get_ledger_path(plan_config, event_name)
+
+            with lock_ledger(ledger_path):
+                ledger = SubmissionLedger.read(ledger_path)
+                if (action != "dry_run") & (
+                    ledger.idempotency_key == result.idempotency_key
+                ):
+                    logger.info(
+                        f"{plan_config.telescope} {action} of {event_name} "
+                        f"was already completed, skipping"
+                    )
+                    result.status = "duplicate"
+                else:
+                    res = submitter(
+                        schedule,
+                        event_name=event_name,
+                        plan_config=plan_config,
+                        submit=submit,
+                        delete=delete,
+                    )
+                    if res is not None:
+                        result.details = res.model_dump()
+                        result.n_targets = res.n_targets
+
+                    if action != "dry_run":
+                        # The submitter has updated the ledger
+                        ledger = SubmissionLedger.read(ledger_path)
+                        ledger.record_operation(result.idempotency_key)
+                        ledger.write(ledger_path)
+
+                    result.status = ACTION_STATUSES[action]
+
+            submit_span.set(status=result.status)
+
+    except Exception as exc:
+        logger.error(f"{plan_config.telescope} {action} of {event_name} failed: {exc}")
+        result.status = "failed"
+        result.error = f"{type(exc).__name__}: {exc}"
+
+    result.duration = time.perf_counter() - t_start
+    return result
+
+
+def start_daemon(name: str, func: Callable, *args, **kwargs) -> Future:
+    """
+    Call a function in a new daemon thread, which unlike the workers of a
+    ThreadPoolExecutor is not joined when the interpreter exits.
+    The thread runs in a copy of the context, so its spans are
+    children of the current span.
+
+    :param name: Thread name
+    :param func: Function
+    :param args: Arguments of function
+    :param kwargs: Keyword arguments of function
+    :return: Future of the result
+    """
+    future = Future()
+    context = copy_context()
+
+    def run():
+        try:
+            future.set_result(context.run(func, *args, **kwargs))
+        except BaseException as exc:
+            future.set_exception(exc)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return future
+
+
+def submit_schedules(
+    schedules: list[pd.DataFrame],
+    event_name: str,
+    plan_configs: list[PlanConfig],
+    submit: bool = False,
+    delete: bool = False,
+    timeouts: dict[str, float] | None = None,
+) -> list[FacilityResult]:
+    """
+    Submit (or delete) the schedules of several facilities concurrently.
+
+    A facility which does not finish within its timeout is reported as
+    "timeout". Its thread cannot be interrupted, so while the process runs
+    it may still complete the submission, which is then recorded in the
+    ledger as usual: a retry waits for it to finish, and is skipped as a
+    duplicate. The thread is a daemon, so the process does not wait for it
+    when exiting, and a submission interrupted then is not recorded.
+
+    :param schedules: Schedules, one per plan config
+    :param event_name: Event name
+    :param plan_configs: Plan configs
+    :param submit: Submit the queues
+    :param delete: Delete the queues
+    :param timeouts: Timeout of each telescope in seconds
+        (defaults to DEFAULT_TIMEOUTS, or DEFAULT_TIMEOUT)
+    :return: FacilityResult of each plan config, in the same order
+    """
+    timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+    action = get_action(submit=submit, delete=delete)
+
+    results = []
+
+    if len(plan_configs) == 0:
+        return results
+
+    t_start = time.perf_counter()
+    futures = [
+        start_daemon(
+            f"submit_{plan_config.telescope}",
+            submit_facility,
+            schedule,
+            event_name=event_name,
+            plan_config=plan_config,
+            submit=submit,
+            delete=delete,
+        )
+        for schedule, plan_config in zip(schedules, plan_configs)
+    ]
+
+    for schedule, plan_config, future in zip(schedules, plan_configs, futures):
+        timeout = timeouts.get(plan_config.telescope, DEFAULT_TIMEOUT)
+        remaining = max(t_start + timeout - time.perf_counter(), 0.0)
+        try:
+            result = future.result(timeout=remaining)
+        except FutureTimeoutError:
+            logger.error(
+                f"{plan_config.telescope} {action} of {event_name} "
+                f"did not finish within {timeout:.0f}s"
+            )
+            result = FacilityResult(
+                telescope=plan_config.telescope,
+                event_name=event_name,
+                action=action,
+                idempotency_key=get_idempotency_key(
+                    schedule, event_name, plan_config, action
+                ),
+                status="timeout",
+                n_targets=len(schedule),
+                duration=time.perf_counter() - t_start,
+                error=f"Timed out after {timeout:.0f}s",
+            )
+        results.append(result)
+
+    for result in results:
+        logger.info(
+            f"{result.telescope} {result.action} of {result.event_name}: "
+            f"{result.status} ({result.n_targets} targets, {result.duration:.2f}s)"
+        )
+
+    return results
+
+
+def check_results(results: list[FacilityResult]):
+    """
+    Raise an error if any facility failed or timed out
+
+    :param results: Results of each facility
+    """
+    failed = [x for x in results if not x.ok]
+    if len(failed) > 0:
+        raise RuntimeError(
+            "Submission failed for "
+            + ", ".join(f"{x.telescope} ({x.error})" for x in failed)
+        )
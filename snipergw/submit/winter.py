@@ -1,41 +1,118 @@
+import logging
 import os
+from functools import cache
 
 import pandas as pd
+from pydantic import BaseModel
 from winterapi import WinterAPI
 from winterapi.messenger import WinterFieldToO
 
 from snipergw.model import PlanConfig
+from snipergw.schedule import Schedule, get_target_diff
+from snipergw.submit.ledger import (
+    SubmissionLedger,
+    get_ledger_path,
+    get_trigger_name,
+    select_targets,
+)
 
-winter = WinterAPI()
+logger = logging.getLogger(__name__)
 
 MAX_EXPOSURE_TIME = 30
 MIN_DITHER = 5
 
 
+class WinterSubmissionResult(BaseModel):
+    """
+    Summary of a WINTER submission
+    """
+
+    trigger_name: str
+    n_targets: int
+    submitted: bool = False
+    response: str | None = None
+
+
+@cache
+def get_winter_api() -> WinterAPI:
+    """
+    Get the WINTER API client, which is only created when first needed,
+    as it contacts the WINTER server when initialised
+
+    :return: WinterAPI
+    """
+    return WinterAPI()
+
+
+def build_winter_targets(
+    schedule: pd.DataFrame,
+    event_name: str,
+    plan_config: PlanConfig,
+    t_start: float,
+    t_end: float,
+) -> list[WinterFieldToO]:
+    """
+    Build the WINTER targets for a schedule, all sharing one validity window
+
+    :param schedule: Schedule dataframe
+    :param event_name: Event name
+    :param plan_config: Plan config
+    :param t_start: Start of validity window in MJD
+    :param t_end: End of validity window in MJD
+    :return: List of targets
+    """
+    n_dithers = int(max(plan_config.exposuretime / MAX_EXPOSURE_TIME, MIN_DITHER))
+
+    logger.debug(
+        f"Using {n_dithers} dithers for an exposure time "
+        f"of {plan_config.exposuretime}s"
+    )
+
+    return [
+        WinterFieldToO(
+            target_name=f"{event_name}_{field_id}",
+            field_id=field_id,
+            filters=[filter_name],
+            total_exposure_time=plan_config.exposuretime,
+            start_time_mjd=t_start,
+            end_time_mjd=t_end,
+            n_dither=n_dithers,
+        )
+        for field_id, filter_name in zip(
+            schedule["field"].astype(int).tolist(),
+            schedule["filter"].astype(str).tolist(),
+        )
+    ]
+
+
 def submit_too_winter(
     schedule: pd.DataFrame,
     event_name: str,
     plan_config: PlanConfig,
     submit: bool = False,
     delete: bool = False,
-):
+) -> WinterSubmissionResult:
     """
-    Submit a ToO to Winter
+    Submit a ToO to Winter. With plan_config.incremental, only the targets
+    which have not been submitted yet for this event are submitted.
 
     :param schedule: Schedule dataframe
     :param event_name: Event name
     :param plan_config: Plan config
     :param submit: Submit the queue
     :param delete: Delete the queue
+    :return: WinterSubmissionResult
     """
 
     if delete:
         raise NotImplementedError("Delete not implemented for Winter")
 
+    winter = get_winter_api()
+
     try:
-        print(f"User is {winter.get_user()}")
+        logger.info(f"WINTER user is {winter.get_user()}")
     except KeyError:
-        print("No user credentials found. Please add these first!")
+        logger.warning("No WINTER user credentials found. Please add these first!")
         winter.add_user_details(overwrite=True)
 
     program_name = os.getenv("WINTER_PROGRAM_NAME")
@@ -44,31 +121,56 @@ def submit_too_winter(
     if program_name not in winter.get_programs():
         winter.add_program(program_name, program_key)
 
-    too_list = []
-
     t_start = min(schedule["tobs"])
     t_end = max(schedule["tobs"])
 
-    n_dithers = int(max(plan_config.exposuretime / MAX_EXPOSURE_TIME, MIN_DITHER))
+    ledger_path = get_ledger_path(plan_config, event_name)
+    ledger = SubmissionLedger.read(ledger_path)
 
-    print("n_dithers", n_dithers, "texp", plan_config.exposuretime)
-
-    for _, row in schedule.iterrows():
-        too_list.append(
-            WinterFieldToO(
-                target_name=f"{event_name}_{row['field']}",
-                field_id=row["field"],
-                filters=[row["filter"]],
-                t_exp=plan_config.exposuretime,
-                start_time_mjd=t_start,
-                end_time_mjd=t_end,
-                n_dither=n_dithers,
-            )
+    result = WinterSubmissionResult(
+        trigger_name=get_trigger_name(plan_config, event_name),
+        n_targets=len(schedule),
+    )
+
+    if plan_config.incremental:
+        # WINTER ToOs cannot be deleted, so all submitted targets stay active
+        diff = get_target_diff(
+            ledger.targets, Schedule.from_dataframe(schedule).get_targets()
         )
+        if len(diff.removed) > 0:
+            logger.warning(
+                f"{len(diff.removed)} submitted targets are no longer scheduled, "
+                f"but WINTER ToOs cannot be deleted"
+            )
+        if len(diff.added) == 0:
+            logger.info("All scheduled targets have already been submitted")
+            result.n_targets = 0
+            return result
+        logger.info(f"Submitting {len(diff.added)} new targets")
+        schedule = select_targets(Schedule.from_dataframe(schedule), diff.added)
+        result.n_targets = len(schedule)
+
+    too_list = build_winter_targets(
+        schedule, event_name, plan_config, t_start=t_start, t_end=t_end
+    )
 
     api_res, api_schedule = winter.submit_too(
         program_name=program_name, data=too_list, submit_trigger=submit
     )
 
-    print("Submitted too:", api_res)
-    print(api_schedule)
+    result.response = str(api_res)
+    logger.info(f"WINTER response to ToO of {len(too_list)} targets: {api_res}")
+    logger.debug(f"WINTER schedule:\n{api_schedule}")
+
+    if submit:
+        result.trigger_name = f"{result.trigger_name}_{ledger.n_submitted}"
+        ledger.add(
+            result.trigger_name,
+            Schedule.from_dataframe(schedule).get_targets(),
+            start_mjd=float(t_start),
+            end_mjd=float(t_end),
+        )
+        ledger.write(ledger_path)
+        result.submitted = True
+
+    return result
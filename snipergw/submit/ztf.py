@@ -1,15 +1,268 @@
-import os
+import logging
 import time
+from contextlib import contextmanager
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 from planobs.api import APIError, Queue
 from planobs.models import TooTarget
+from pydantic import BaseModel
 
-from snipergw.model import EventConfig, PlanConfig
+from snipergw.incremental import PLAN_STATE_NAME, PlanState
+from snipergw.model import PlanConfig
+from snipergw.schedule import Schedule
+from snipergw.session import poll_until
+from snipergw.submit.ledger import (
+    SubmissionLedger,
+    get_ledger_path,
+    get_trigger_name,
+    select_targets,
+)
+from snipergw.tracing import span
+
+logger = logging.getLogger(__name__)
 
 ZTF_FILTER_MAP = {"g": 1, "r": 2, "i": 3}
 
+MAX_EXPOSURE_TIME = 600.0
+
+# Confirmation of a submitted trigger: poll Kowalski with exponential backoff,
+# starting quickly, until the trigger appears or the deadline passes
+CONFIRM_DEADLINE = 120.0
+CONFIRM_INITIAL_DELAY = 0.5
+CONFIRM_MAX_DELAY = 8.0
+
+
+class ZTFSubmissionResult(BaseModel):
+    """
+    Summary of a ZTF submission, with the latency of each step in seconds
+    """
+
+    trigger_name: str
+    n_targets: int
+    submitted: bool = False
+    deleted: bool = False
+    kept_triggers: list[str] = []
+    removed_triggers: list[str] = []
+    latencies: dict[str, float] = {}
+
+
+@contextmanager
+def timed(latencies: dict[str, float], step: str):
+    """
+    Context manager recording and logging the latency of a step
+
+    :param latencies: Dictionary to record the latency in
+    :param step: Name of step
+    """
+    t_start = time.perf_counter()
+    try:
+        with span(f"submit.{step}", telescope="ZTF"):
+            yield
+    finally:
+        latencies[step] = time.perf_counter() - t_start
+        logger.info(f"ZTF submission step '{step}' took {latencies[step]:.2f}s")
+
+
+def build_ztf_targets(schedule: pd.DataFrame, subprogram: str) -> list[TooTarget]:
+    """
+    Build the ZTF targets for a schedule. The columns are converted and
+    validated in bulk, so the individual targets do not need to be validated.
+
+    :param schedule: Schedule dataframe
+    :param subprogram: Subprogram name
+    :return: List of targets
+    """
+    filters = schedule["filter"].astype(str)
+    unknown = sorted(set(filters) - set(ZTF_FILTER_MAP))
+    if len(unknown) > 0:
+        raise ValueError(
+            f"Unknown ZTF filters {unknown}, "
+            f"acceptable filters are {list(ZTF_FILTER_MAP)}"
+        )
+
+    request_ids = schedule.index.to_numpy(dtype=np.int64)
+    field_ids = schedule["field"].to_numpy(dtype=np.int64)
+    filter_ids = filters.map(ZTF_FILTER_MAP).to_numpy(dtype=np.int64)
+    exposure_times = schedule["texp"].to_numpy(dtype=np.float64)
+
+    if np.any(request_ids < 0):
+        raise ValueError("Schedule index must be non-negative")
+
+    if np.any((exposure_times < 0.0) | (exposure_times > MAX_EXPOSURE_TIME)):
+        raise ValueError(
+            f"ZTF exposure times must be between 0 and {MAX_EXPOSURE_TIME}s"
+        )
+
+    subprogram_name = f"ToO_{subprogram}"
+
+    return [
+        TooTarget.model_construct(
+            request_id=request_id,
+            field_id=field_id,
+            filter_id=filter_id,
+            subprogram_name=subprogram_name,
+            exposure_time=exposure_time,
+        )
+        for request_id, field_id, filter_id, exposure_time in zip(
+            request_ids.tolist(),
+            field_ids.tolist(),
+            filter_ids.tolist(),
+            exposure_times.tolist(),
+        )
+    ]
+
+
+def get_queue_names(q: Queue) -> list[str]:
+    """
+    Get the names of the ToO triggers in the Kowalski queue
+
+    :param q: Queue
+    :return: List of queue names
+    """
+    kowalski_list = q.get_too_queues_nameonly()
+    logger.debug(f"Current Kowalski queue has {len(kowalski_list)} entries")
+    return kowalski_list
+
+
+def wait_for_trigger(
+    q: Queue,
+    expected_name: str,
+    deadline: float = CONFIRM_DEADLINE,
+    initial_delay: float = CONFIRM_INITIAL_DELAY,
+    max_delay: float = CONFIRM_MAX_DELAY,
+) -> float:
+    """
+    Poll the Kowalski queue until a trigger appears
+
+    :param q: Queue
+    :param expected_name: Queue name of the trigger
+    :param deadline: Maximum time to wait in seconds
+    :param initial_delay: Delay after the first check in seconds
+    :param max_delay: Maximum delay between checks in seconds
+    :return: Time until the trigger appeared
+    """
+    try:
+        return poll_until(
+            lambda: expected_name in get_queue_names(q),
+            deadline=deadline,
+            initial_delay=initial_delay,
+            max_delay=max_delay,
+            errors=(APIError,),
+        )
+    except TimeoutError as exc:
+        raise RuntimeError(
+            f"Trigger {expected_name} not added to queue after {deadline:.0f}s"
+        ) from exc
+
+
+def delete_triggers(q: Queue, names: list[str], ledger: SubmissionLedger):
+    """
+    Delete submitted triggers, and remove them from the ledger.
+    Triggers which are no longer in the queue (e.g. deleted by hand)
+    are only removed from the ledger.
+
+    :param q: Queue
+    :param names: Queue names of triggers
+    :param ledger: Submission ledger
+    """
+    for name in names:
+        try:
+            q.delete_trigger(name)
+            logger.info(f"Deleted trigger {name}")
+        except APIError:
+            if name in get_queue_names(q):
+                raise
+            logger.warning(f"Trigger {name} was already removed from the queue")
+        ledger.remove(name)
+
+
+def submit_delta_ztf(
+    q: Queue,
+    schedule: pd.DataFrame,
+    trigger_name: str,
+    plan_config: PlanConfig,
+    ledger: SubmissionLedger,
+    result: ZTFSubmissionResult,
+    submit: bool = False,
+    observed_fields: list[int] | None = None,
+) -> ZTFSubmissionResult:
+    """
+    Submit only the changes between a schedule and the triggers already
+    submitted for the event. Kowalski triggers can only be added or deleted
+    as a whole, so triggers with targets which are no longer scheduled are
+    deleted, and the new targets (including any still-wanted targets of the
+    deleted triggers) are submitted as one new trigger. Fields which were
+    observed before the schedule starts do not count as removed targets.
+
+    :param q: Queue
+    :param schedule: Schedule dataframe
+    :param trigger_name: Base name of triggers for this event
+    :param plan_config: Plan config
+    :param ledger: Submission ledger of this event
+    :param result: Result to update
+    :param submit: Actually submit the changes, rather than only logging them
+    :param observed_fields: Fields observed before the schedule starts
+    :return: ZTFSubmissionResult
+    """
+    latencies = result.latencies
+
+    delta = ledger.get_delta(
+        Schedule.from_dataframe(schedule).get_targets(),
+        observed_fields=observed_fields,
+    )
+    result.kept_triggers = delta.keep
+    result.n_targets = len(delta.add)
+
+    logger.info(
+        f"Keeping {len(delta.keep)} submitted triggers, "
+        f"deleting {len(delta.remove)} and submitting {len(delta.add)} new targets"
+    )
+
+    if delta.is_empty:
+        logger.info("The submitted triggers already match the schedule")
+        return result
+
+    if not submit:
+        return result
+
+    with timed(latencies, "delete_existing"):
+        delete_triggers(q, delta.remove, ledger)
+    result.removed_triggers = delta.remove
+
+    if len(delta.add) > 0:
+        new = select_targets(Schedule.from_dataframe(schedule), delta.add)
+
+        with timed(latencies, "build_targets"):
+            targets = build_ztf_targets(new, subprogram=plan_config.subprogram)
+
+        name = f"{trigger_name}_{ledger.n_submitted}"
+        q.add_trigger_to_queue(
+            targets=targets,
+            trigger_name=name,
+            validity_window_start_mjd=schedule["tobs"].min(),
+            validity_window_end_mjd=schedule["tobs"].max(),
+        )
+        result.trigger_name = f"{name}_0"
+
+        with timed(latencies, "submit"):
+            q.submit_queue()
+
+        with timed(latencies, "confirm"):
+            wait_for_trigger(q, result.trigger_name)
+
+        ledger.add(
+            result.trigger_name,
+            new.get_targets(),
+            start_mjd=float(schedule["tobs"].min()),
+            end_mjd=float(schedule["tobs"].max()),
+        )
+        logger.info(f"Trigger {result.trigger_name} confirmed in Kowalski queue")
+
+    result.submitted = True
+    return result
+
 
 def submit_too_ztf(
     schedule: pd.DataFrame,
@@ -17,40 +270,56 @@ def submit_too_ztf(
     plan_config: PlanConfig,
     submit: bool = False,
     delete: bool = False,
-):
+) -> ZTFSubmissionResult:
     """
-    Submit a ToO to ZTF
+    Submit a ToO to ZTF. With plan_config.incremental, only the changes
+    since the last submission for this event are submitted.
 
     :param schedule: Schedule dataframe
     :param event_name: Event name
     :param plan_config: Plan config
     :param submit: Submit the queue
     :param delete: Delete the queue
-    :return: None
+    :return: ZTFSubmissionResult
     """
 
-    targets = []
+    trigger_name = get_trigger_name(plan_config, event_name)
 
-    for i, row in schedule.iterrows():
-        targets.append(
-            TooTarget(
-                request_id=i,
-                field_id=row["field"],
-                filter_id=ZTF_FILTER_MAP[row["filter"]],
-                subprogram_name=f"ToO_{plan_config.subprogram}",
-                exposure_time=row["texp"],
-            )
-        )
+    result = ZTFSubmissionResult(trigger_name=trigger_name, n_targets=len(schedule))
+    latencies = result.latencies
+
+    ledger_path = get_ledger_path(plan_config, event_name)
+    ledger = SubmissionLedger.read(ledger_path)
 
     # get name of user from home directory using Pathlib
     user = Path.home().stem
 
-    q = Queue(user=user)
+    with timed(latencies, "connect"):
+        q = Queue(user=user)
+
+    if plan_config.incremental and not delete:
+        # The plan state of the schedule lists the fields observed before it starts
+        plan_state = PlanState.read(
+            plan_config.get_output_dir(event_name).joinpath(PLAN_STATE_NAME)
+        )
+        result = submit_delta_ztf(
+            q,
+            schedule,
+            trigger_name,
+            plan_config,
+            ledger,
+            result,
+            submit=submit,
+            observed_fields=None if plan_state is None else plan_state.observed_fields,
+        )
+        ledger.write(ledger_path)
+        return result
 
-    t_0 = min(schedule["tobs"])
-    t_1 = max(schedule["tobs"])
+    with timed(latencies, "build_targets"):
+        targets = build_ztf_targets(schedule, subprogram=plan_config.subprogram)
 
-    trigger_name = f"ToO_{plan_config.subprogram}_{event_name}"
+    t_0 = schedule["tobs"].min()
+    t_1 = schedule["tobs"].max()
 
     q.add_trigger_to_queue(
         targets=targets,
@@ -61,46 +330,60 @@ def submit_too_ztf(
 
     expected_name = f"{trigger_name}_0"
 
-    def in_queue() -> bool:
-        current_too_queue = q.get_too_queues()
-
-        kowalski_list = [
-            current_too_queue["data"][i]["queue_name"]
-            for i in range(len(current_too_queue["data"]))
-        ]
-
-        print(
-            f"Current Kowalski queue has "
-            f"{len(current_too_queue['data'])} entries: \n {kowalski_list}"
-        )
-
-        return expected_name in kowalski_list
-
     if submit:
-        try:
-            q.delete_queue()
-            print("Deleted pre-existing queue entry of same name")
-        except APIError:
-            pass
+        with timed(latencies, "delete_existing"):
+            try:
+                q.delete_queue()
+                logger.info("Deleted pre-existing queue entry of same name")
+            except APIError:
+                pass
+
+            # Any triggers of earlier incremental submissions are replaced too
+            delete_triggers(q, [x for x in ledger.names if x != expected_name], ledger)
 
         # Now we submit our triggers
-        q.submit_queue()
+        with timed(latencies, "submit"):
+            q.submit_queue()
 
-        time.sleep(5)
+        with timed(latencies, "confirm"):
+            wait_for_trigger(q, expected_name)
 
-        if not in_queue():
-            raise RuntimeError("Trigger not added to queue")
+        result.submitted = True
+        ledger.add(
+            expected_name,
+            Schedule.from_dataframe(schedule).get_targets(),
+            start_mjd=float(t_0),
+            end_mjd=float(t_1),
+        )
+        logger.info(f"Trigger {expected_name} confirmed in Kowalski queue")
 
     if delete:
-        print("deleting queue")
-        if not in_queue():
+        logger.info("Deleting queue")
+        queue_names = get_queue_names(q)
+        # Triggers of earlier incremental submissions are deleted too
+        others = [x for x in ledger.names if (x != expected_name) & (x in queue_names)]
+        if (expected_name not in queue_names) & (len(others) == 0):
             raise RuntimeError(f"Trigger {expected_name} not in queue")
-        # Now we delete our triggers
-        q.delete_queue()
 
-        current_queue = q.get_too_queues()
+        # Now we delete our triggers
+        with timed(latencies, "delete"):
+            if expected_name in queue_names:
+                q.delete_queue()
+                ledger.remove(expected_name)
+            delete_triggers(q, others, ledger)
 
-        print(
-            f"Current Kowalski queue has {len(current_queue['data'])} "
+        result.deleted = True
+        logger.info(
+            f"Current Kowalski queue has {len(get_queue_names(q))} "
             f"entries (after deleting)"
         )
+
+    if submit or delete:
+        ledger.write(ledger_path)
+
+    logger.info(
+        f"ZTF submission of {len(targets)} targets took "
+        f"{sum(latencies.values()):.2f}s in total"
+    )
+
+    return result
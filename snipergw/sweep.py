@@ -0,0 +1,290 @@
+"""
+This module contains the parameter sweep, which plans an event for every
+combination of a grid of parameter values in parallel, and ranks the schedules.
+Grid parameters can be PlanConfig fields (e.g starttime, filters, exposuretime)
+or gwemopt arguments (e.g airmass, mindiff, powerlaw_cl).
+"""
+
+import argparse
+import itertools
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+from astropy.time import Time
+from pydantic import BaseModel, ConfigDict
+
+from snipergw.cli import add_plan_arguments, parse_starttime
+from snipergw.coverage import read_coverage
+from snipergw.model import EventConfig, PlanConfig
+from snipergw.plan import run_gwemopt
+from snipergw.schedule import ScheduleSummary
+from snipergw.skymap import Skymap
+
+logger = logging.getLogger(__name__)
+
+SWEEP_NAME = "sweep.csv"
+
+# Columns of the ranked table, after the grid parameters
+RESULT_COLUMNS = [
+    "total_prob",
+    "area_deg2",
+    "n_fields",
+    "n_pointings",
+    "duration_hours",
+    "runtime",
+    "error",
+]
+
+
+class SweepPoint(BaseModel):
+    """
+    One combination of parameter values in a sweep
+    """
+
+    label: str
+    params: dict[str, str]
+    plan_config: PlanConfig
+    gwemopt_args: list[str] = []
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+
+class SweepResult(BaseModel):
+    """
+    Summary of the schedule planned for a sweep point, or the error raised
+    """
+
+    label: str
+    params: dict[str, str]
+    summary: ScheduleSummary | None = None
+    error: str | None = None
+    runtime: float = 0.0
+
+
+def get_sweep_points(
+    grid: dict[str, list[str]],
+    plan_kwargs: dict[str, Any] | None = None,
+    gwemopt_args: list[str] | None = None,
+) -> list[SweepPoint]:
+    """
+    Get the sweep point for each combination of grid values. Grid parameters
+    which are PlanConfig fields update the plan config, and all others are
+    passed to gwemopt as arguments. Plots are skipped, and each point is
+    planned in its own output subdirectory.
+
+    :param grid: Dictionary of parameter name to list of values
+    :param plan_kwargs: Other fields of PlanConfig, shared by all points
+    :param gwemopt_args: Other gwemopt arguments, shared by all points
+    :return: List of sweep points
+    """
+    if plan_kwargs is None:
+        plan_kwargs = {}
+
+    if gwemopt_args is None:
+        gwemopt_args = []
+
+    points = []
+    for i, values in enumerate(itertools.product(*grid.values())):
+        params = dict(zip(grid.keys(), [str(x) for x in values]))
+        label = f"sweep/{i:03d}"
+
+        updates = {}
+        args = list(gwemopt_args)
+        for name, value in params.items():
+            if name == "starttime":
+                updates[name] = Time(value, format="isot", scale="utc")
+            elif name in PlanConfig.model_fields:
+                updates[name] = value
+            else:
+                args += [f"--{name.lstrip('-')}", value]
+
+        plan_config = PlanConfig(
+            **{
+                **plan_kwargs,
+                **updates,
+                "label": label,
+                "plots": False,
+                "incremental": False,
+            }
+        )
+        points.append(
+            SweepPoint(
+                label=label, params=params, plan_config=plan_config, gwemopt_args=args
+            )
+        )
+
+    return points
+
+
+def run_sweep_point(skymap: Skymap, point: SweepPoint) -> SweepResult:
+    """
+    Plan a sweep point, recording any error rather than raising it
+
+    :param skymap: Skymap of event
+    :param point: Sweep point
+    :return: SweepResult
+    """
+    result = SweepResult(label=point.label, params=point.params)
+    t_start = time.perf_counter()
+    try:
+        schedule = run_gwemopt(skymap, point.plan_config, point.gwemopt_args)
+        result.summary = schedule.summarise(
+            coverage=read_coverage(point.plan_config.get_output_dir(skymap.event_name))
+        )
+    except Exception as exc:
+        logger.exception(f"Planning failed for sweep point {point.params}")
+        result.error = f"{type(exc).__name__}: {exc}"
+    result.runtime = time.perf_counter() - t_start
+    return result
+
+
+def rank_sweep(results: list[SweepResult]) -> pd.DataFrame:
+    """
+    Rank the results of a sweep, by decreasing covered probability and then
+    increasing total time. Failed points are ranked last.
+
+    :param results: List of sweep results
+    :return: Ranked table, with one row per sweep point
+    """
+    rows = []
+    for result in results:
+        row = {"label": result.label, **result.params}
+        if result.summary is not None:
+            row.update(result.summary.model_dump(exclude={"filters"}))
+        row.update({"runtime": result.runtime, "error": result.error})
+        rows.append(row)
+
+    table = pd.DataFrame(rows).reindex(
+        columns=["label", *results[0].params.keys(), *RESULT_COLUMNS]
+    )
+    table = table.sort_values(
+        ["total_prob", "duration_hours"],
+        ascending=[False, True],
+        na_position="last",
+        kind="stable",
+    ).reset_index(drop=True)
+    table.insert(0, "rank", range(1, len(table) + 1))
+    return table
+
+
+def run_sweep(
+    event: EventConfig,
+    grid: dict[str, list[str]],
+    plan_kwargs: dict[str, Any] | None = None,
+    gwemopt_args: list[str] | None = None,
+    max_workers: int | None = None,
+) -> pd.DataFrame:
+    """
+    Plan an event for every combination of grid values, in parallel.
+    The skymap is only loaded once, and shared with the workers. The workers
+    are reused between points, so they keep the telescope setup warm
+    (see snipergw.planner.WarmCache), and all points share the plan cache.
+
+    :param event: Event
+    :param grid: Dictionary of parameter name to list of values
+    :param plan_kwargs: Other fields of PlanConfig, shared by all points
+    :param gwemopt_args: Other gwemopt arguments, shared by all points
+    :param max_workers: Maximum number of worker processes
+        (defaults to one per point, up to the number of CPUs)
+    :return: Ranked table, with one row per sweep point
+    """
+    points = get_sweep_points(grid, plan_kwargs=plan_kwargs, gwemopt_args=gwemopt_args)
+
+    if max_workers is None:
+        max_workers = min(len(points), os.cpu_count() or 1)
+
+    skymap = Skymap(event_config=event)
+
+    logger.info(
+        f"Sweeping {len(points)} combinations of {', '.join(grid)} "
+        f"with {max_workers} worker processes"
+    )
+
+    t_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_sweep_point, skymap, point) for point in points]
+        results = [future.result() for future in futures]
+
+    logger.info(
+        f"Swept {len(points)} combinations in {time.perf_counter() - t_start:.1f}s"
+    )
+
+    table = rank_sweep(results)
+
+    output_path = Path(points[0].plan_config.output_dir).joinpath(
+        f"{skymap.event_name}/{SWEEP_NAME}"
+    )
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    table.to_csv(output_path, index=False)
+    logger.info(f"See ranked sweep results at {output_path}")
+
+    return table
+
+
+def parse_grid(grid_args: list[list[str]] | None) -> dict[str, list[str]]:
+    """
+    Parse grid arguments of the form [name, value, value, ...]
+
+    :param grid_args: List of grid arguments
+    :return: Dictionary of parameter name to list of values
+    """
+    grid = {}
+    for grid_arg in grid_args or []:
+        if len(grid_arg) < 2:
+            raise ValueError(f"Grid parameter {grid_arg[0]} needs at least one value")
+        grid[grid_arg[0].lstrip("-")] = grid_arg[1:]
+    return grid
+
+
+def sweep_cli(argv: list[str]):
+    """
+    Command line interface for the parameter sweep
+
+    :param argv: Command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        prog="snipergw sweep",
+        description="Plan an event for every combination of a grid of "
+        "parameter values, and rank the schedules",
+    )
+    parser.add_argument("-e", "--event")
+    parser.add_argument("-r", "--rev", type=int)
+    parser.add_argument(
+        "--grid",
+        nargs="+",
+        action="append",
+        metavar=("NAME", "VALUE"),
+        help="Parameter name and values, e.g '--grid airmass 2.0 2.5'",
+    )
+    parser.add_argument("--max_workers", type=int, default=None)
+    parser.add_argument("--top", type=int, default=None)
+    add_plan_arguments(parser)
+    args, gwemopt_args = parser.parse_known_args(argv)
+
+    parse_starttime(args)
+
+    grid = parse_grid(args.grid)
+    telescopes = args.telescope.split(",")
+    if len(telescopes) > 1:
+        grid = {"telescope": telescopes, **grid}
+
+    if len(grid) == 0:
+        parser.error("At least one --grid parameter is needed")
+
+    table = run_sweep(
+        event=EventConfig(**args.__dict__),
+        grid=grid,
+        plan_kwargs=args.__dict__,
+        gwemopt_args=gwemopt_args,
+        max_workers=args.max_workers,
+    )
+
+    if args.top is not None:
+        table = table.head(args.top)
+
+    print(table.to_string(index=False))
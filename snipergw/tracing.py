@@ -0,0 +1,429 @@
+"""
+This module contains lightweight tracing of the pipeline stages. Each stage
+runs in a span, which records its duration and structured attributes
+(e.g event, revision, telescope, n_pointings). The spans of a run are exported
+to a JSON-lines file and a Prometheus textfile, and the main stages are
+compared against a latency budget.
+"""
+
+import functools
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE_NAME = "traces.jsonl"
+METRICS_FILE_NAME = "snipergw.prom"
+
+# Latency budget of each stage in seconds, for observations to start promptly
+LATENCY_BUDGETS = {
+    "run": float(os.getenv("SNIPERGW_BUDGET_RUN", 600.0)),
+    "skymap": float(os.getenv("SNIPERGW_BUDGET_SKYMAP", 60.0)),
+    "plan": float(os.getenv("SNIPERGW_BUDGET_PLAN", 480.0)),
+    "submit": float(os.getenv("SNIPERGW_BUDGET_SUBMIT", 60.0)),
+}
+
+METRIC_PREFIX = "snipergw"
+
+
+class SpanContext(BaseModel):
+    """
+    Identifiers of a span, used to continue a trace in another process
+    """
+
+    trace_id: str
+    span_id: str
+
+
+class Span(BaseModel):
+    """
+    A timed stage of the pipeline
+    """
+
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None = None
+    start: float
+    duration: float = 0.0
+    status: str = "ok"
+    error: str | None = None
+    attributes: dict[str, Any] = {}
+
+    @property
+    def context(self) -> SpanContext:
+        """
+        Context of this span
+        """
+        return SpanContext(trace_id=self.trace_id, span_id=self.span_id)
+
+    def set(self, **attributes):
+        """
+        Add attributes to the span
+
+        :param attributes: Attributes
+        """
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    """
+    Records spans, nested according to the current context.
+    Finished spans are only kept while they are being collected.
+    """
+
+    def __init__(self):
+        self.current: ContextVar[Span | SpanContext | None] = ContextVar(
+            "snipergw_span", default=None
+        )
+        self.finished: list[Span] | None = None
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """
+        Context manager running a stage in a new span
+
+        :param name: Name of stage
+        :param attributes: Attributes of the span
+        :return: Span
+        """
+        parent = self.current.get()
+        new_span = Span(
+            name=name,
+            trace_id=uuid.uuid4().hex if parent is None else parent.trace_id,
+            span_id=uuid.uuid4().hex[:16],
+            parent_id=None if parent is None else parent.span_id,
+            start=time.time(),
+            attributes=attributes,
+        )
+        token = self.current.set(new_span)
+        t_start = time.perf_counter()
+        try:
+            yield new_span
+        except BaseException as exc:
+            new_span.status = "error"
+            new_span.error = f"{type(exc).__name__}: {exc}"
+            raise
+        finally:
+            new_span.duration = time.perf_counter() - t_start
+            self.current.reset(token)
+            self.record([new_span])
+
+    def current_span(self) -> Span | None:
+        """
+        Get the current span, if it is in this process
+
+        :return: Span or None
+        """
+        current = self.current.get()
+        return current if isinstance(current, Span) else None
+
+    def current_context(self) -> SpanContext | None:
+        """
+        Get the context of the current span, to continue the trace elsewhere
+
+        :return: SpanContext or None
+        """
+        current = self.current.get()
+        if isinstance(current, Span):
+            return current.context
+        return current
+
+    @contextmanager
+    def attach(self, context: SpanContext | None):
+        """
+        Context manager continuing a trace, e.g in a worker process
+
+        :param context: Context of the parent span
+        """
+        token = self.current.set(context)
+        try:
+            yield
+        finally:
+            self.current.reset(token)
+
+    @contextmanager
+    def collect(self) -> Iterator[list[Span]]:
+        """
+        Context manager collecting the spans finished within it.
+        Collections can be nested, with the outer collection also
+        receiving the spans of the inner one.
+
+        :return: List of spans, filled as they finish
+        """
+        spans = []
+        previous = self.finished
+        self.finished = spans
+        try:
+            yield spans
+        finally:
+            self.finished = previous
+            self.record(spans)
+
+    def record(self, spans: list[Span]):
+        """
+        Record spans finished elsewhere, e.g in a worker process
+
+        :param spans: Spans
+        """
+        if self.finished is not None:
+            self.finished.extend(spans)
+
+
+tracer = Tracer()
+
+
+def span(name: str, **attributes):
+    """
+    Context manager running a stage in a new span of the global tracer
+
+    :param name: Name of stage
+    :param attributes: Attributes of the span
+    :return: Context manager yielding the span
+    """
+    return tracer.span(name, **attributes)
+
+
+def current_span() -> Span:
+    """
+    Get the current span of the global tracer. Outside any span, a detached
+    span is returned, so attributes can always be set.
+
+    :return: Span
+    """
+    current = tracer.current_span()
+    if current is None:
+        current = Span(name="detached", trace_id="", span_id="", start=time.time())
+    return current
+
+
+def traced(name: str) -> Callable:
+    """
+    Decorator running a function in a new span
+
+    :param name: Name of stage
+    :return: Decorator
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def call_traced(
+    context: SpanContext | None, func: Callable, *args, **kwargs
+) -> tuple[Any, list[Span]]:
+    """
+    Call a function as part of a trace, returning the spans it finished.
+    This is used to run stages in worker processes.
+
+    :param context: Context of the parent span
+    :param func: Function
+    :param args: Arguments of function
+    :param kwargs: Keyword arguments of function
+    :return: Result of function, spans
+    """
+    with tracer.attach(context), tracer.collect() as spans:
+        result = func(*args, **kwargs)
+    return result, spans
+
+
+def get_stage_name(span_: Span) -> str:
+    """
+    Get the name of the stage of a span, qualified by telescope if it has one
+
+    :param span_: Span
+    :return: Stage name
+    """
+    telescope = span_.attributes.get("telescope")
+    return span_.name if telescope is None else f"{span_.name}[{telescope}]"
+
+
+def get_budget_summary(
+    spans: list[Span], budgets: dict[str, float] | None = None
+) -> list[dict]:
+    """
+    Compare the spans of the budgeted stages with their budget
+
+    :param spans: Spans
+    :param budgets: Budget in seconds per stage (defaults to LATENCY_BUDGETS)
+    :return: List of dictionaries with stage, duration, budget and whether it is over
+    """
+    if budgets is None:
+        budgets = LATENCY_BUDGETS
+
+    return [
+        {
+            "stage": get_stage_name(x),
+            "duration": x.duration,
+            "budget": budgets[x.name],
+            "over": x.duration > budgets[x.name],
+        }
+        for x in sorted(spans, key=lambda x: x.start)
+        if x.name in budgets
+    ]
+
+
+def log_budget_summary(spans: list[Span], budgets: dict[str, float] | None = None):
+    """
+    Log the latency of each budgeted stage against its budget
+
+    :param spans: Spans
+    :param budgets: Budget in seconds per stage (defaults to LATENCY_BUDGETS)
+    """
+    summary = get_budget_summary(spans, budgets)
+    if len(summary) == 0:
+        return
+
+    lines = [
+        f"  {x['stage']:20s} {x['duration']:8.1f}s / {x['budget']:6.0f}s"
+        f"{'  OVER BUDGET' if x['over'] else ''}"
+        for x in summary
+    ]
+    logger.info("Latency budget:\n" + "\n".join(lines))
+
+    over = [x["stage"] for x in summary if x["over"]]
+    if len(over) > 0:
+        logger.warning(f"Stages over their latency budget: {', '.join(over)}")
+
+
+def write_jsonl(spans: list[Span], path: Path):
+    """
+    Append spans to a JSON-lines file, one span per line
+
+    :param spans: Spans
+    :param path: Path of file
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf8") as f:
+        f.write("".join(f"{x.model_dump_json()}\n" for x in spans))
+
+
+def format_labels(labels: dict[str, Any]) -> str:
+    """
+    Format Prometheus labels, skipping labels without a value
+
+    :param labels: Labels
+    :return: Formatted labels
+    """
+    values = []
+    for key, value in labels.items():
+        if value is None:
+            continue
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        values.append(f'{key}="{value}"')
+    return "{" + ",".join(values) + "}"
+
+
+def write_prometheus(spans: list[Span], path: Path):
+    """
+    Write the stage durations of a run to a Prometheus textfile, for the
+    node exporter textfile collector. The file is replaced atomically.
+
+    :param spans: Spans of one run
+    :param path: Path of file
+    """
+    durations, errors = {}, {}
+    for x in spans:
+        key = (x.name, x.attributes.get("telescope"))
+        durations[key] = durations.get(key, 0.0) + x.duration
+        errors[key] = errors.get(key, 0) + int(x.status == "error")
+
+    event = next(
+        (x.attributes["event"] for x in spans if "event" in x.attributes), None
+    )
+
+    lines = [
+        f"# HELP {METRIC_PREFIX}_stage_duration_seconds "
+        f"Duration of each stage in the last run",
+        f"# TYPE {METRIC_PREFIX}_stage_duration_seconds gauge",
+    ]
+    for (stage, telescope), duration in sorted(durations.items(), key=str):
+        labels = format_labels({"stage": stage, "telescope": telescope, "event": event})
+        lines.append(f"{METRIC_PREFIX}_stage_duration_seconds{labels} {duration:.6f}")
+
+    lines += [
+        f"# HELP {METRIC_PREFIX}_stage_errors Number of failed spans of each stage "
+        f"in the last run",
+        f"# TYPE {METRIC_PREFIX}_stage_errors gauge",
+    ]
+    for (stage, telescope), n_errors in sorted(errors.items(), key=str):
+        labels = format_labels({"stage": stage, "telescope": telescope, "event": event})
+        lines.append(f"{METRIC_PREFIX}_stage_errors{labels} {n_errors}")
+
+    lines += [
+        f"# HELP {METRIC_PREFIX}_stage_budget_seconds Latency budget of each stage",
+        f"# TYPE {METRIC_PREFIX}_stage_budget_seconds gauge",
+    ]
+    for stage, budget in LATENCY_BUDGETS.items():
+        labels = format_labels({"stage": stage})
+        lines.append(f"{METRIC_PREFIX}_stage_budget_seconds{labels} {budget}")
+
+    lines += [
+        f"# HELP {METRIC_PREFIX}_last_run_timestamp_seconds End time of the last run",
+        f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge",
+        f"{METRIC_PREFIX}_last_run_timestamp_seconds {time.time():.3f}",
+    ]
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+
+
+def export_trace(spans: list[Span], output_dir: Path):
+    """
+    Export the spans of a run to a JSON-lines file and a Prometheus textfile,
+    and log the latency budget summary. The paths default to the output
+    directory, and can be set with SNIPERGW_TRACE_FILE and SNIPERGW_METRICS_FILE.
+
+    :param spans: Spans of one run
+    :param output_dir: Output directory
+    """
+    trace_path = Path(
+        os.getenv("SNIPERGW_TRACE_FILE", output_dir.joinpath(TRACE_FILE_NAME))
+    )
+    metrics_path = Path(
+        os.getenv("SNIPERGW_METRICS_FILE", output_dir.joinpath(METRICS_FILE_NAME))
+    )
+
+    try:
+        write_jsonl(spans, trace_path)
+        write_prometheus(spans, metrics_path)
+    except OSError as exc:
+        logger.warning(f"Could not export trace: {exc}")
+
+    log_budget_summary(spans)
+
+
+@contextmanager
+def trace_run(output_dir: Path, **attributes) -> Iterator[Span]:
+    """
+    Context manager tracing a run, with all its stages in one trace.
+    Once the run finishes (or fails), its spans are exported.
+
+    :param output_dir: Output directory
+    :param attributes: Attributes of the run span
+    :return: Span of the run
+    """
+    with tracer.collect() as spans:
+        try:
+            with tracer.span("run", **attributes) as run_span:
+                yield run_span
+        finally:
+            export_trace(spans, output_dir)
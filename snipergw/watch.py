@@ -0,0 +1,666 @@
+"""
+This module contains the watch mode of snipergw: a long-running asyncio
+listener which consumes alerts from a source (GCN Kafka, a GraceDB poller,
+or a local directory/socket), and automatically plans (and optionally submits)
+observations for each new superevent or revision
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import AsyncIterator, Callable
+
+import pandas as pd
+from astropy.time import Time
+from pydantic import BaseModel, Field
+
+from snipergw.cli import add_plan_arguments, parse_starttime
+from snipergw.gracedb_index import DEFAULT_QUERY, SupereventIndex
+from snipergw.model import (
+    DEFAULT_START_DELAY,
+    EventConfig,
+    PlanConfig,
+    get_plan_configs,
+)
+from snipergw.paths import base_output_dir
+from snipergw.run import run_snipergw_multi
+from snipergw.session import get_gracedb_client
+
+logger = logging.getLogger(__name__)
+
+RETRACTION = "RETRACTION"
+
+# Alert type of each GraceDB voevent_type code
+VOEVENT_TYPES = {
+    "EA": "EARLY_WARNING",
+    "PR": "PRELIMINARY",
+    "IN": "INITIAL",
+    "UP": "UPDATE",
+    "RE": RETRACTION,
+}
+
+DEFAULT_KAFKA_TOPIC = "igwn.gwalert"
+
+
+class Alert(BaseModel):
+    """
+    A notice that a superevent has been created or updated
+    """
+
+    event: str
+    revision: int | None = None
+    alert_type: str = "UPDATE"
+    created: str | None = None
+    received: float = Field(default_factory=time.time)
+
+    @property
+    def key(self) -> tuple:
+        """
+        Key used to de-duplicate alerts. Alerts with neither a revision nor
+        a creation time cannot be told apart from their content, so each
+        one is keyed on the time it was received.
+        """
+        if (self.revision is None) & (self.created is None):
+            return self.event, self.alert_type, self.received
+        return self.event, self.revision, self.alert_type, self.created
+
+    @property
+    def is_retraction(self) -> bool:
+        """
+        Whether the alert retracts the superevent
+        """
+        return self.alert_type.upper() == RETRACTION
+
+    def supersedes(self, other: "Alert") -> bool:
+        """
+        Whether this alert should replace another alert for the same event.
+        Revisions are compared if both are known,
+        otherwise the most recently received alert wins.
+
+        :param other: Other alert
+        :return: Boolean
+        """
+        if (self.revision is not None) and (other.revision is not None):
+            return self.revision > other.revision
+        return self.received >= other.received
+
+
+def parse_alert(payload: dict) -> Alert:
+    """
+    Parse an alert from a JSON payload. This accepts IGWN alerts
+    as distributed by GCN Kafka, and simple dictionaries of the form
+    {"event": "S230529ay", "revision": 2}.
+
+    :param payload: Dictionary
+    :return: Alert
+    """
+    event = payload.get("superevent_id")
+    if event is None:
+        event = payload["event"]
+
+    revision = payload.get("revision", payload.get("rev"))
+
+    return Alert(
+        event=event,
+        revision=None if revision is None else int(revision),
+        alert_type=payload.get("alert_type", "UPDATE").upper(),
+        created=payload.get("time_created"),
+    )
+
+
+def get_alert_type(voevent_type: str | None) -> str:
+    """
+    Get the alert type of a GraceDB VOEvent, from its voevent_type code
+
+    :param voevent_type: VOEvent type, e.g 'RE'
+    :return: Alert type, e.g 'RETRACTION'
+    """
+    if voevent_type is None:
+        return "UPDATE"
+    return VOEVENT_TYPES.get(voevent_type.upper(), voevent_type.upper())
+
+
+class AlertSource:
+    """
+    Base class for sources of alerts
+    """
+
+    async def alerts(self) -> AsyncIterator[Alert]:
+        """
+        Iterate over alerts as they arrive
+
+        :return: Async iterator of alerts
+        """
+        raise NotImplementedError
+        yield
+
+
+class DirectorySource(AlertSource):
+    """
+    Source reading alerts from JSON files dropped into a directory.
+    Files are moved to a 'processed' subdirectory once read.
+    """
+
+    def __init__(self, directory: Path, interval: float = 1.0, once: bool = False):
+        """
+        :param directory: Directory to watch
+        :param interval: Polling interval in seconds
+        :param once: Stop after reading the files currently in the directory
+        """
+        self.directory = Path(directory)
+        self.processed_dir = self.directory.joinpath("processed")
+        self.interval = interval
+        self.once = once
+
+    def read_new_alerts(self) -> list[Alert]:
+        """
+        Read all new alert files, oldest first
+
+        :return: List of alerts
+        """
+        self.processed_dir.mkdir(parents=True, exist_ok=True)
+
+        paths = sorted(
+            self.directory.glob("*.json"), key=lambda x: (x.stat().st_mtime, x.name)
+        )
+
+        alerts = []
+        for path in paths:
+            try:
+                with open(path, "r") as f:
+                    alerts.append(parse_alert(json.load(f)))
+            except (ValueError, KeyError) as exc:
+                logger.error(f"Could not parse alert file {path}: {exc}")
+            os.replace(path, self.processed_dir.joinpath(path.name))
+
+        return alerts
+
+    async def alerts(self) -> AsyncIterator[Alert]:
+        while True:
+            for alert in self.read_new_alerts():
+                yield alert
+            if self.once:
+                return
+            await asyncio.sleep(self.interval)
+
+
+class SocketSource(AlertSource):
+    """
+    Source reading alerts as lines of JSON sent to a TCP socket
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765):
+        """
+        :param host: Host to listen on
+        :param port: Port to listen on
+        """
+        self.host = host
+        self.port = port
+        self.queue: asyncio.Queue[Alert] = asyncio.Queue()
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        """
+        Read alerts from a connection, one JSON payload per line
+
+        :param reader: Stream reader
+        :param writer: Stream writer
+        """
+        try:
+            async for line in reader:
+                if len(line.strip()) == 0:
+                    continue
+                try:
+                    await self.queue.put(parse_alert(json.loads(line)))
+                except (ValueError, KeyError) as exc:
+                    logger.error(f"Could not parse alert {line!r}: {exc}")
+        finally:
+            writer.close()
+
+    async def alerts(self) -> AsyncIterator[Alert]:
+        server = await asyncio.start_server(
+            self.handle_connection, host=self.host, port=self.port
+        )
+        logger.info(f"Listening for alerts on {self.host}:{self.port}")
+        async with server:
+            while True:
+                yield await self.queue.get()
+
+
+class GraceDBPollSource(AlertSource):
+    """
+    Source polling GraceDB for new superevents and revisions, through the
+    local SupereventIndex: each poll only lists the superevents created since
+    the previous one, and the VOEvents of retracted superevents are not fetched
+    again. The index is shared with the skymap lookup of each alert.
+    """
+
+    def __init__(
+        self,
+        index_dir: Path = base_output_dir.joinpath("skymaps"),
+        interval: float = 30.0,
+        n_recent: int = 5,
+        query: str = DEFAULT_QUERY,
+        skip_existing: bool = True,
+    ):
+        """
+        :param index_dir: Directory of the superevent index
+        :param interval: Polling interval in seconds
+        :param n_recent: Number of most recent superevents to check on each poll
+        :param query: GraceDB superevent query
+        :param skip_existing: Ignore the revisions which exist at startup
+        """
+        self.index = SupereventIndex(index_dir, query=query)
+        self.interval = interval
+        self.n_recent = n_recent
+        self.skip_existing = skip_existing
+
+    def poll(self) -> list[Alert]:
+        """
+        Get the latest revision of each recent superevent
+
+        :return: List of alerts
+        """
+        client = get_gracedb_client()
+
+        self.index.sync_superevents(client)
+
+        alerts = []
+        for superevent in self.index.query_superevents(limit=self.n_recent):
+            # A retracted superevent has no further revisions
+            if (len(superevent.voevents) == 0) or (
+                not superevent.voevents[-1].is_retraction
+            ):
+                superevent = self.index.sync_voevents(client, superevent.superevent_id)
+
+            if len(superevent.voevents) == 0:
+                continue
+
+            latest = superevent.voevents[-1]
+            alert_type = get_alert_type(latest.voevent_type)
+            if latest.is_retraction:
+                alert_type = RETRACTION
+
+            alerts.append(
+                Alert(
+                    event=superevent.superevent_id,
+                    revision=latest.revision,
+                    alert_type=alert_type,
+                    created=latest.created,
+                )
+            )
+        return alerts
+
+    async def alerts(self) -> AsyncIterator[Alert]:
+        loop = asyncio.get_running_loop()
+        known = set()
+        first = True
+
+        while True:
+            try:
+                alerts = await loop.run_in_executor(None, self.poll)
+            except Exception as exc:
+                logger.error(f"Failed to poll GraceDB: {exc}")
+                alerts = []
+
+            for alert in alerts:
+                if (alert.event, alert.revision) in known:
+                    continue
+                known.add((alert.event, alert.revision))
+                if first & self.skip_existing:
+                    logger.debug(f"Skipping existing alert {alert.key}")
+                    continue
+                yield alert
+
+            first = False
+            await asyncio.sleep(self.interval)
+
+
+class KafkaSource(AlertSource):
+    """
+    Source reading IGWN alerts from GCN Kafka
+    """
+
+    def __init__(
+        self,
+        client_id: str | None = None,
+        client_secret: str | None = None,
+        topic: str = DEFAULT_KAFKA_TOPIC,
+        include_mock: bool = False,
+    ):
+        """
+        :param client_id: GCN client ID (defaults to $GCN_KAFKA_CLIENT_ID)
+        :param client_secret: GCN client secret (defaults to $GCN_KAFKA_CLIENT_SECRET)
+        :param topic: Kafka topic
+        :param include_mock: Whether to include mock superevents (e.g MS230529a)
+        """
+        self.client_id = client_id or os.getenv("GCN_KAFKA_CLIENT_ID")
+        self.client_secret = client_secret or os.getenv("GCN_KAFKA_CLIENT_SECRET")
+        self.topic = topic
+        self.include_mock = include_mock
+
+    def get_consumer(self):
+        """
+        Create a Kafka consumer subscribed to the topic
+
+        :return: Consumer
+        """
+        try:
+            from gcn_kafka import Consumer
+        except ImportError as exc:
+            raise ImportError(
+                "The kafka source requires gcn-kafka, "
+                "which you can install with `pip install snipergw[kafka]`"
+            ) from exc
+
+        if (self.client_id is None) | (self.client_secret is None):
+            raise ValueError(
+                "GCN_KAFKA_CLIENT_ID and GCN_KAFKA_CLIENT_SECRET must be set"
+            )
+
+        consumer = Consumer(client_id=self.client_id, client_secret=self.client_secret)
+        consumer.subscribe([self.topic])
+        return consumer
+
+    async def alerts(self) -> AsyncIterator[Alert]:
+        loop = asyncio.get_running_loop()
+        consumer = self.get_consumer()
+        try:
+            while True:
+                messages = await loop.run_in_executor(None, consumer.consume, 1, 1.0)
+                for message in messages:
+                    if message.error():
+                        logger.error(f"Kafka error: {message.error()}")
+                        continue
+                    try:
+                        alert = parse_alert(json.loads(message.value()))
+                    except (ValueError, KeyError) as exc:
+                        logger.error(f"Could not parse Kafka alert: {exc}")
+                        continue
+                    if alert.event.startswith("M") & (not self.include_mock):
+                        continue
+                    yield alert
+        finally:
+            consumer.close()
+
+
+def process_alert(
+    alert: Alert,
+    event_config: EventConfig,
+    plan_configs: list[PlanConfig],
+    gwemopt_args: list[str],
+    submit: bool,
+) -> list[pd.DataFrame]:
+    """
+    Plan (and optionally submit) observations for an alert.
+    This runs in a worker process.
+
+    :param alert: Alert
+    :param event_config: Event configuration
+    :param plan_configs: Plan configurations, one per telescope
+    :param gwemopt_args: gwemopt arguments
+    :param submit: Whether to submit the schedules
+    :return: Schedules, one per telescope
+    """
+    logging.getLogger("snipergw").setLevel(logging.INFO)
+    return run_snipergw_multi(
+        event=event_config,
+        plan_configs=plan_configs,
+        gwemopt_args=list(gwemopt_args),
+        submit=submit,
+    )
+
+
+class Watcher:
+    """
+    Class to consume alerts from a source, and run snipergw for each new
+    superevent or revision. Alerts are de-duplicated, at most one run per
+    event is in progress at any time (with only the newest pending revision
+    kept), and the total number of concurrent runs is limited.
+    """
+
+    def __init__(
+        self,
+        source: AlertSource,
+        plan_configs: list[PlanConfig],
+        gwemopt_args: list[str] | None = None,
+        submit: bool = False,
+        output_dir: Path | None = None,
+        offline: bool = False,
+        max_concurrent: int = 2,
+        update_starttime: bool = True,
+        executor: Executor | None = None,
+        process: Callable = process_alert,
+    ):
+        """
+        :param source: Source of alerts
+        :param plan_configs: Plan configurations, one per telescope
+        :param gwemopt_args: gwemopt arguments
+        :param submit: Whether to submit schedules
+        :param output_dir: Output directory (defaults to that of the plan configs)
+        :param offline: Only use skymaps from the local store
+        :param max_concurrent: Maximum number of concurrent runs
+        :param update_starttime: Start observations shortly after each alert,
+            rather than at the starttime of the plan configs
+        :param executor: Executor for runs (defaults to a process pool)
+        :param process: Function called for each alert
+        """
+        self.source = source
+        self.plan_configs = plan_configs
+        self.gwemopt_args = [] if gwemopt_args is None else list(gwemopt_args)
+        self.submit = submit
+        self.output_dir = (
+            plan_configs[0].output_dir if output_dir is None else output_dir
+        )
+        self.offline = offline
+        self.max_concurrent = max_concurrent
+        self.update_starttime = update_starttime
+        self.executor = executor
+        self.process = process
+
+        self.seen: set[tuple] = set()
+        self.retracted: set[str] = set()
+        self.results: dict[tuple, list[pd.DataFrame] | Exception] = {}
+        self._running: dict[str, asyncio.Task] = {}
+        self._pending: dict[str, Alert] = {}
+        self._semaphore: asyncio.Semaphore | None = None
+
+    def handle(self, alert: Alert):
+        """
+        Handle a new alert, starting a run if needed
+
+        :param alert: Alert
+        """
+        if alert.key in self.seen:
+            logger.debug(f"Ignoring duplicate alert {alert.key}")
+            return
+        self.seen.add(alert.key)
+
+        if alert.is_retraction:
+            logger.warning(f"{alert.event} was retracted, cancelling pending runs")
+            self.retracted.add(alert.event)
+            self._pending.pop(alert.event, None)
+            return
+
+        if alert.event in self.retracted:
+            logger.info(f"Ignoring alert for retracted event {alert.event}")
+            return
+
+        if alert.event in self._running:
+            previous = self._pending.get(alert.event)
+            if (previous is None) or alert.supersedes(previous):
+                logger.info(
+                    f"Run for {alert.event} in progress, "
+                    f"queueing revision {alert.revision}"
+                )
+                self._pending[alert.event] = alert
+            return
+
+        self._running[alert.event] = asyncio.create_task(self.run_event(alert))
+
+    async def run_event(self, alert: Alert):
+        """
+        Run snipergw for an alert, followed by any newer revision
+        which arrives in the meantime
+
+        :param alert: Alert
+        """
+        event = alert.event
+        try:
+            while alert is not None:
+                await self.run_alert(alert)
+                alert = self._pending.pop(event, None)
+        finally:
+            self._running.pop(event, None)
+
+    async def run_alert(self, alert: Alert):
+        """
+        Run snipergw for a single alert, in the executor
+
+        :param alert: Alert
+        """
+        async with self._semaphore:
+            if alert.event in self.retracted:
+                return
+
+            event_config = EventConfig(
+                event=alert.event,
+                rev=alert.revision,
+                output_dir=self.output_dir,
+                offline=self.offline,
+            )
+
+            plan_configs = self.plan_configs
+            if self.update_starttime:
+                starttime = Time.now() + DEFAULT_START_DELAY
+                plan_configs = [
+                    x.model_copy(update={"starttime": starttime}) for x in plan_configs
+                ]
+
+            logger.info(
+                f"Processing {alert.event} (revision {alert.revision}, "
+                f"{alert.alert_type})"
+            )
+
+            loop = asyncio.get_running_loop()
+            try:
+                result = await loop.run_in_executor(
+                    self.executor,
+                    self.process,
+                    alert,
+                    event_config,
+                    plan_configs,
+                    self.gwemopt_args,
+                    self.submit,
+                )
+                logger.info(
+                    f"Finished {alert.event} (revision {alert.revision}), "
+                    f"{time.time() - alert.received:.1f}s after the alert was received"
+                )
+            except Exception as exc:
+                logger.exception(f"Failed to process {alert.event}: {exc}")
+                result = exc
+
+            self.results[alert.key] = result
+
+    async def wait(self):
+        """
+        Wait for all runs in progress, including pending revisions
+        """
+        while len(self._running) > 0:
+            await asyncio.gather(*list(self._running.values()))
+
+    async def run(self):
+        """
+        Consume alerts from the source until it is exhausted,
+        then wait for all runs to finish
+        """
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        own_executor = self.executor is None
+        if own_executor:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_concurrent)
+
+        try:
+            async for alert in self.source.alerts():
+                self.handle(alert)
+            await self.wait()
+        finally:
+            if own_executor:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+
+
+def get_source(args: argparse.Namespace) -> AlertSource:
+    """
+    Create the alert source from command line arguments
+
+    :param args: Parsed arguments
+    :return: Alert source
+    """
+    if args.source == "gracedb":
+        return GraceDBPollSource(
+            index_dir=Path(args.output_dir).joinpath("skymaps"),
+            interval=args.interval,
+        )
+    if args.source == "kafka":
+        return KafkaSource(topic=args.topic)
+    if args.source == "directory":
+        if args.directory is None:
+            raise ValueError("--directory is required for the directory source")
+        return DirectorySource(args.directory, interval=args.interval, once=args.once)
+    if args.source == "socket":
+        return SocketSource(host=args.host, port=args.port)
+    raise ValueError(f"Unknown source {args.source}")
+
+
+def watch_cli(argv: list[str]):
+    """
+    Command line interface for the watch mode
+
+    :param argv: Command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        prog="snipergw watch",
+        description="Listen for alerts, and automatically plan observations "
+        "for each new superevent or revision",
+    )
+    parser.add_argument(
+        "--source",
+        choices=["gracedb", "kafka", "directory", "socket"],
+        default="gracedb",
+    )
+    parser.add_argument("--interval", type=float, default=30.0)
+    parser.add_argument("--topic", default=DEFAULT_KAFKA_TOPIC)
+    parser.add_argument("--directory", default=None)
+    parser.add_argument("--once", default=False, action="store_true")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max_concurrent", type=int, default=2)
+    parser.add_argument("-s", "--submit", default=False, action="store_true")
+    add_plan_arguments(parser)
+    args, gwemopt_args = parser.parse_known_args(argv)
+
+    update_starttime = args.starttime is None
+    parse_starttime(args)
+
+    watcher = Watcher(
+        source=get_source(args),
+        plan_configs=get_plan_configs(**args.__dict__),
+        gwemopt_args=gwemopt_args,
+        submit=args.submit,
+        offline=args.offline,
+        max_concurrent=args.max_concurrent,
+        update_starttime=update_starttime,
+    )
+
+    try:
+        asyncio.run(watcher.run())
+    except KeyboardInterrupt:
+        logger.info("Stopped watching")
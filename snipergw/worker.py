@@ -0,0 +1,200 @@
+"""
+This module contains a long-lived planning worker, a local process which
+accepts plan requests over a pipe. The worker keeps gwemopt's telescope
+configurations, tile MOCs and tile segments warm between requests
+(see snipergw.planner.WarmCache), so repeated plans for new revisions or
+parameter variants skip the cold-start cost.
+"""
+
+import logging
+import multiprocessing
+import threading
+import time
+from multiprocessing.connection import Connection
+
+from pydantic import BaseModel, ConfigDict
+
+from snipergw.model import PlanConfig
+from snipergw.plan import run_gwemopt
+from snipergw.schedule import Schedule
+from snipergw.skymap import Skymap
+
+logger = logging.getLogger(__name__)
+
+WORKER_STOP_TIMEOUT = 10.0
+
+
+class PlanRequest(BaseModel):
+    """
+    Request to plan observations of a skymap
+    """
+
+    skymap: Skymap
+    plan_config: PlanConfig
+    gwemopt_args: list[str] = []
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+
+class PlanResponse(BaseModel):
+    """
+    Response to a plan request, with either a schedule or an error
+    """
+
+    schedule: Schedule | None = None
+    error: Exception | None = None
+    duration: float = 0.0
+    warm_hits: int = 0
+    warm_misses: int = 0
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+
+def serve(conn: Connection):
+    """
+    Serve plan requests from a connection until None is received,
+    or the connection is closed
+
+    :param conn: Connection to receive requests and send responses on
+    """
+    from snipergw.planner import warm_cache
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+
+        if request is None:
+            break
+
+        hits, misses = warm_cache.hits, warm_cache.misses
+        t_start = time.perf_counter()
+        response = PlanResponse()
+        try:
+            response.schedule = run_gwemopt(
+                request.skymap, request.plan_config, request.gwemopt_args
+            )
+        except Exception as exc:
+            logger.exception(f"Planning failed for {request.plan_config.telescope}")
+            response.error = exc
+
+        response.duration = time.perf_counter() - t_start
+        response.warm_hits = warm_cache.hits - hits
+        response.warm_misses = warm_cache.misses - misses
+
+        try:
+            conn.send(response)
+        except Exception as exc:
+            # e.g. an exception which cannot be pickled
+            conn.send(
+                PlanResponse(error=RuntimeError(repr(exc)), duration=response.duration)
+            )
+
+    conn.close()
+
+
+class PlanningWorker:
+    """
+    Long-lived planning process with a request/response API.
+    Requests are handled one at a time, in the order they are made.
+
+    Usage:
+
+        with PlanningWorker() as worker:
+            schedule = worker.plan(skymap, plan_config)
+    """
+
+    def __init__(self, start_method: str | None = None):
+        """
+        :param start_method: multiprocessing start method, or None for the default
+        """
+        context = multiprocessing.get_context(start_method)
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=serve, args=(child_conn,), name="snipergw-planner", daemon=True
+        )
+        self._process.start()
+        child_conn.close()
+        self._lock = threading.Lock()
+        logger.info(f"Started planning worker {self._process.pid}")
+
+    @property
+    def is_alive(self) -> bool:
+        """
+        Whether the worker process is running
+        """
+        return self._process.is_alive()
+
+    def request(self, request: PlanRequest) -> PlanResponse:
+        """
+        Send a plan request to the worker, and wait for the response
+
+        :param request: Plan request
+        :return: Plan response
+        """
+        with self._lock:
+            if not self.is_alive:
+                raise RuntimeError("Planning worker is not running")
+            try:
+                self._conn.send(request)
+                response = self._conn.recv()
+            except (EOFError, BrokenPipeError) as exc:
+                raise RuntimeError(
+                    f"Planning worker exited with code {self._process.exitcode}"
+                ) from exc
+
+        logger.info(
+            f"Planning worker handled {request.plan_config.telescope} request "
+            f"in {response.duration:.1f}s "
+            f"({response.warm_hits} warm hits, {response.warm_misses} misses)"
+        )
+        return response
+
+    def plan(
+        self,
+        skymap: Skymap,
+        plan_config: PlanConfig,
+        gwemopt_args: list[str] | None = None,
+    ) -> Schedule:
+        """
+        Plan observations of a skymap with the worker
+
+        :param skymap: Skymap of event
+        :param plan_config: Plan config
+        :param gwemopt_args: List of arguments to pass to gwemopt
+        :return: Schedule
+        """
+        response = self.request(
+            PlanRequest(
+                skymap=skymap,
+                plan_config=plan_config,
+                gwemopt_args=list(gwemopt_args or []),
+            )
+        )
+        if response.error is not None:
+            raise response.error
+        return response.schedule
+
+    def close(self):
+        """
+        Stop the worker process, after any request in progress
+        """
+        with self._lock:
+            if self.is_alive:
+                try:
+                    self._conn.send(None)
+                except BrokenPipeError:
+                    pass
+                self._process.join(timeout=WORKER_STOP_TIMEOUT)
+            if self.is_alive:
+                logger.warning("Planning worker did not stop, terminating it")
+                self._process.terminate()
+                self._process.join()
+            self._conn.close()
+
+    def __enter__(self) -> "PlanningWorker":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,65 @@
+"""
+Helpers shared by the tests, to make synthetic tiles and schedules
+"""
+
+import numpy as np
+import pandas as pd
+
+from snipergw.schedule import Schedule
+
+NSIDE = 8
+
+
+def make_tiles(
+    n_tiles: int = 40, min_pixels: int = 0, max_pixels: int = 30, seed: int = 42
+) -> dict:
+    """
+    Make random overlapping tiles
+
+    :param n_tiles: Number of tiles
+    :param min_pixels: Minimum number of pixels of each tile
+    :param max_pixels: Maximum number of pixels of each tile (exclusive)
+    :param seed: Random seed
+    :return: Dictionary of field ID to tile
+    """
+    rng = np.random.default_rng(seed)
+    npix = 12 * NSIDE**2
+    return {
+        field_id: {
+            "ipix": rng.choice(
+                npix, size=rng.integers(min_pixels, max_pixels), replace=False
+            ),
+            "ra": 0.0,
+            "dec": 0.0,
+        }
+        for field_id in range(100, 100 + n_tiles)
+    }
+
+
+def make_schedule(
+    fields: list[int],
+    filters: list[str] | None = None,
+    tobs: list[float] | None = None,
+) -> Schedule:
+    """
+    Make a schedule of 30s exposures
+
+    :param fields: Field IDs
+    :param filters: Filters (defaults to g)
+    :param tobs: Start times in MJD (defaults to every 0.01 days from 60000.1)
+    :return: Schedule
+    """
+    if filters is None:
+        filters = ["g"] * len(fields)
+    if tobs is None:
+        tobs = [60000.1 + 0.01 * i for i in range(len(fields))]
+    return Schedule.from_dataframe(
+        pd.DataFrame(
+            {
+                "field": fields,
+                "filter": filters,
+                "tobs": tobs,
+                "texp": [30.0] * len(fields),
+            }
+        )
+    )
@@ -0,0 +1,130 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+import pandas as pd
+
+from snipergw.batch import (
+    RESULT_COLUMNS,
+    BatchEvent,
+    BatchResult,
+    get_batch_table,
+    get_stage_runtimes,
+    read_completed,
+    read_event_list,
+    run_batch,
+)
+from snipergw.model import PlanConfig
+from snipergw.schedule import ScheduleSummary
+from snipergw.tracing import Span
+
+
+def make_span(name: str, duration: float, **attributes) -> Span:
+    return Span(
+        name=name,
+        trace_id="t",
+        span_id=name,
+        start=0.0,
+        duration=duration,
+        attributes=attributes,
+    )
+
+
+class TestBatch(TestCase):
+    """
+    Test the batch mode
+    """
+
+    def test_read_event_list(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir).joinpath("events.txt")
+            with open(path, "w") as f:
+                f.write("# O4 replay\nS230529ay\n\nS230627c, 2\nGRB210729A 1 # GRB\n")
+
+            events = read_event_list(path)
+
+            with open(path, "a") as f:
+                f.write("S1 2 3\n")
+            with self.assertRaises(ValueError):
+                read_event_list(path)
+
+        self.assertEqual(
+            events,
+            [
+                BatchEvent(event="S230529ay"),
+                BatchEvent(event="S230627c", rev=2),
+                BatchEvent(event="GRB210729A", rev=1),
+            ],
+        )
+
+    def test_stage_runtimes(self):
+        spans = [
+            make_span("skymap", 1.0),
+            make_span("plan", 2.0, telescope="ZTF"),
+            make_span("gwemopt", 1.5, telescope="ZTF"),
+            make_span("plan", 3.0, telescope="WINTER"),
+            make_span("run", 6.0),
+        ]
+        self.assertEqual(
+            get_stage_runtimes(spans, "ZTF"),
+            {"skymap": 1.0, "plan": 2.0, "gwemopt": 1.5},
+        )
+        self.assertEqual(
+            get_stage_runtimes(spans, "WINTER"), {"skymap": 1.0, "plan": 3.0}
+        )
+
+    def test_table(self):
+        results = [
+            BatchResult(
+                event="S1",
+                telescope="ZTF",
+                summary=ScheduleSummary(
+                    n_pointings=4, n_fields=2, total_prob=0.5, duration_hours=0.3
+                ),
+                stage_runtimes={"skymap": 1.0, "plan": 2.0},
+                runtime=3.0,
+            ),
+            BatchResult(event="S2", telescope="ZTF", error="ValueError: bad"),
+        ]
+        table = get_batch_table(results)
+        self.assertEqual(list(table.columns), RESULT_COLUMNS)
+        self.assertEqual(table.loc[0, "total_prob"], 0.5)
+        self.assertEqual(table.loc[0, "plan_runtime"], 2.0)
+        self.assertTrue(pd.isna(table.loc[0, "gwemopt_runtime"]))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir).joinpath("batch.csv")
+            table.to_csv(path, index=False)
+            self.assertEqual(read_completed(path), {("S1", "ZTF")})
+
+    def test_failures(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_dir = Path(tmp_dir)
+            events = [
+                BatchEvent(event=str(output_dir.joinpath("missing.fits"))),
+                BatchEvent(event="X123"),
+            ]
+            table = run_batch(
+                events,
+                plan_configs=[PlanConfig(telescope="ZTF")],
+                output_dir=output_dir,
+                max_workers=1,
+            )
+
+            # Each failure is recorded, and the table keeps the order of the events
+            self.assertEqual(list(table["event"]), [x.event for x in events])
+            self.assertTrue(table["error"].notna().all())
+            self.assertIn("not recognised", table.loc[1, "error"])
+
+            saved = pd.read_csv(output_dir.joinpath("batch.csv"))
+            self.assertEqual(len(saved), 2)
+
+            # Failed events are retried when resuming
+            table = run_batch(
+                events[1:],
+                plan_configs=[PlanConfig(telescope="ZTF")],
+                output_dir=output_dir,
+                max_workers=1,
+                resume=True,
+            )
+            self.assertEqual(list(table["event"]), ["X123"])
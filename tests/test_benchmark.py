@@ -0,0 +1,95 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+import healpy as hp
+import numpy as np
+
+from snipergw.benchmark import (
+    BenchmarkCase,
+    BenchmarkReport,
+    BenchmarkResult,
+    compare_reports,
+    run_benchmarks,
+    write_benchmark_skymap,
+)
+from snipergw.model import EventConfig
+from snipergw.skymap import Skymap
+
+NSIDE = 64
+
+
+class TestBenchmark(TestCase):
+    """
+    Test the offline benchmark suite
+    """
+
+    def test_skymaps(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_dir = Path(tmp_dir)
+            output_dir.joinpath("skymaps").mkdir()
+
+            for case in [
+                BenchmarkCase(nside=NSIDE, area=1000.0),
+                BenchmarkCase(nside=NSIDE, area=1000.0, moc=True),
+            ]:
+                name = f"{case.name}.{'multiorder.' if case.moc else ''}fits"
+                prob = write_benchmark_skymap(
+                    output_dir.joinpath(f"skymaps/{name}"), case
+                )
+
+                skymap = Skymap(EventConfig(event=name, output_dir=output_dir))
+                self.assertEqual(skymap.is_moc, case.moc)
+
+                sparse = skymap.preprocess(nside=NSIDE, credible_level=0.9)
+                self.assertAlmostEqual(sparse.area / case.area, 1.0, delta=0.1)
+
+                # Multi-order skymaps are only coarser outside the credible region
+                if case.moc:
+                    self.assertLess(len(skymap.get_column("UNIQ")), len(prob))
+                    full = skymap.preprocess(nside=NSIDE, do_3d=False)
+                    np.testing.assert_allclose(
+                        full.prob[sparse.ipix], prob[sparse.ipix]
+                    )
+                    self.assertAlmostEqual(np.sum(full.prob), 1.0)
+                skymap.close()
+
+        self.assertEqual(len(prob), hp.nside2npix(NSIDE))
+
+    def test_submission(self):
+        report = run_benchmarks(
+            [], stages=["submit_ztf", "submit_winter"], repeat=2, n_pointings=20
+        )
+        self.assertEqual(
+            [x.stage for x in report.results],
+            [
+                "build_ztf_targets",
+                "submit_ztf",
+                "build_winter_targets",
+                "submit_winter",
+            ],
+        )
+        self.assertTrue(all(len(x.times) == 2 for x in report.results))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir).joinpath("benchmark.json")
+            report.write(path)
+            self.assertEqual(BenchmarkReport.read(path), report)
+
+    def test_compare(self):
+        baseline = BenchmarkReport.new()
+        baseline.results = [
+            BenchmarkResult(stage="plan", case="a", times=[1.0, 2.0, 3.0]),
+            BenchmarkResult(stage="plan", case="b", times=[1.0]),
+        ]
+        current = BenchmarkReport.new()
+        current.results = [
+            BenchmarkResult(stage="plan", case="a", times=[3.0]),
+            BenchmarkResult(stage="plan", case="b", times=[1.1]),
+            BenchmarkResult(stage="plan", case="c", times=[1.0]),
+        ]
+
+        comparison = compare_reports(baseline, current, tolerance=0.25)
+        self.assertEqual(comparison["key"].tolist(), ["plan/a", "plan/b"])
+        self.assertEqual(comparison["ratio"].tolist()[0], 1.5)
+        self.assertEqual(comparison["regression"].tolist(), [True, False])
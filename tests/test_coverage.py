@@ -0,0 +1,139 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+import healpy as hp
+import numpy as np
+import pandas as pd
+from helpers import NSIDE, make_tiles
+
+from snipergw.coverage import (
+    Footprints,
+    get_coverage_curve,
+    get_nights,
+    read_coverage,
+    summarise_coverage,
+    write_coverage,
+)
+from snipergw.schedule import Schedule
+from snipergw.skymap import SparseSkymap
+
+
+class TestCoverage(TestCase):
+    """
+    Test the pixel-exact coverage of schedules
+    """
+
+    def setUp(self):
+        self.tiles = make_tiles(n_tiles=20, min_pixels=1, max_pixels=60)
+        rng = np.random.default_rng(1)
+        self.prob = rng.random(12 * NSIDE**2)
+        self.prob /= np.sum(self.prob)
+
+        # Fields observed in g and then r on the first night (UTC 04:00 is
+        # the evening of 2019-04-24 at Palomar), and some again the next night
+        fields = [100, 101, 102, 103, 100, 101, 102, 103, 101, 104, 105, 106]
+        filters = ["g"] * 4 + ["r"] * 4 + ["g"] * 4
+        tobs = 58598.17 + np.arange(12) * 0.01
+        tobs[8:] += 1.0
+        self.schedule = Schedule.from_dataframe(
+            pd.DataFrame(
+                {
+                    "field": fields,
+                    "tobs": tobs,
+                    "prob": [self.get_union([x]) for x in fields],
+                    "texp": 30,
+                    "filter": filters,
+                }
+            ).iloc[::-1]
+        )
+
+        self.footprints = Footprints.from_tiles(
+            "ZTF", NSIDE, self.tiles, field_ids=self.schedule["field"]
+        )
+        self.footprints.prob = self.prob[self.footprints.pixels]
+
+    def get_union(self, field_ids: list[int]) -> float:
+        pixels = set()
+        for x in field_ids:
+            pixels |= set(self.tiles[x]["ipix"].tolist())
+        return float(np.sum(self.prob[list(pixels)]))
+
+    def test_footprints(self):
+        self.assertEqual(len(self.footprints), 7)
+        self.assertEqual(self.footprints.field_ids[0], 100)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir).joinpath("footprints_ZTF.npz")
+            self.footprints.save(path)
+            loaded = Footprints.load(path)
+
+        self.assertEqual(loaded.telescope, "ZTF")
+        np.testing.assert_array_equal(loaded.pixels, self.footprints.pixels)
+        np.testing.assert_array_equal(loaded.prob, self.footprints.prob)
+
+        with self.assertRaises(ValueError):
+            self.footprints.get_rows([100, 110])
+
+        with self.assertRaises(KeyError):
+            Footprints.from_tiles("ZTF", NSIDE, self.tiles, field_ids=[999])
+
+    def test_curve(self):
+        curve = get_coverage_curve(self.schedule, self.footprints)
+        fields = curve["field"].tolist()
+
+        self.assertTrue(np.all(np.diff(curve["tobs"]) > 0))
+        self.assertEqual(list(curve["night"].unique()), ["2019-04-24", "2019-04-25"])
+
+        # Each pixel is counted once, unlike the sum over fields
+        expected = [self.get_union(fields[: i + 1]) for i in range(len(fields))]
+        np.testing.assert_allclose(curve["prob_cumulative"], expected)
+        self.assertLess(
+            curve["prob_cumulative"].iloc[-1],
+            self.schedule.groupby("field")["prob"].first().sum(),
+        )
+
+        # Repeated fields add no probability
+        self.assertTrue(np.all(curve["prob_new"].iloc[4:8] == 0.0))
+
+        # Unions within each filter and each night
+        summary = summarise_coverage(curve)
+        self.assertAlmostEqual(
+            summary.filters["g"], self.get_union(fields[:4] + fields[8:])
+        )
+        self.assertAlmostEqual(summary.filters["r"], self.get_union(fields[4:8]))
+        self.assertAlmostEqual(summary.nights["2019-04-24"], self.get_union(fields[:8]))
+        self.assertAlmostEqual(summary.nights["2019-04-25"], self.get_union(fields[8:]))
+
+        n_pixels = len(set().union(*[self.tiles[x]["ipix"].tolist() for x in fields]))
+        self.assertAlmostEqual(
+            summary.area_deg2, n_pixels * hp.nside2pixarea(NSIDE, degrees=True)
+        )
+
+    def test_summary(self):
+        curve = get_coverage_curve(self.schedule, self.footprints)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.assertIsNone(read_coverage(Path(tmp_dir)))
+            write_coverage(curve, Path(tmp_dir))
+            coverage = read_coverage(Path(tmp_dir))
+
+        summary = self.schedule.summarise(coverage=coverage)
+        self.assertEqual(summary.total_prob, curve["prob_cumulative"].iloc[-1])
+        self.assertEqual(summary.area_deg2, coverage.area_deg2)
+
+        with self.assertRaises(ValueError):
+            self.schedule.iloc[:3].summarise(coverage=coverage)
+
+        empty = get_coverage_curve(self.schedule.iloc[:0], self.footprints)
+        self.assertEqual(summarise_coverage(empty).total_prob, 0.0)
+
+    def test_nights(self):
+        # 06:00 UTC is still the evening before at Palomar, 20:00 UTC is the next day
+        tobs = np.array([58598.25, 58598.8333])
+        self.assertEqual(list(get_nights(tobs)), ["2019-04-24", "2019-04-25"])
+
+    def test_sparse_prob(self):
+        nested = np.array([3, 10, 400])
+        sparse = SparseSkymap(nside=NSIDE, ipix=nested, prob=np.array([0.1, 0.2, 0.3]))
+        ring = hp.nest2ring(NSIDE, np.array([10, 5, 400]))
+        np.testing.assert_allclose(sparse.get_prob(ring), [0.2, 0.0, 0.3])
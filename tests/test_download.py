@@ -0,0 +1,171 @@
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import TestCase
+
+from snipergw.download import (
+    DownloadError,
+    download_file,
+    get_part_path,
+    get_validator_path,
+)
+
+PAYLOAD = bytes(range(256)) * 4096
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    Minimal handler serving PAYLOAD with Range support.
+    The first full request is cut off halfway if `fail_first` is set.
+    If `etag` is set, it is sent, and ranges are only served if If-Range matches.
+    """
+
+    fail_first = False
+    n_requests = 0
+    chunk_delay = 0.0
+    etag = None
+
+    def do_GET(self):
+        RangeHandler.n_requests += 1
+        offset = 0
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if (if_range is not None) & (if_range != RangeHandler.etag):
+            range_header = None
+        if range_header is not None:
+            offset = int(range_header.split("=")[1].split("-")[0])
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {offset}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}"
+            )
+        else:
+            self.send_response(200)
+
+        body = PAYLOAD[offset:]
+        self.send_header("Content-Length", str(len(body)))
+        if RangeHandler.etag is not None:
+            self.send_header("ETag", RangeHandler.etag)
+        self.end_headers()
+
+        if RangeHandler.fail_first and RangeHandler.n_requests == 1:
+            self.wfile.write(body[: len(body) // 2])
+            self.wfile.flush()
+            self.connection.close()
+            return
+
+        if RangeHandler.chunk_delay > 0.0:
+            for i in range(0, len(body), 2**17):
+                self.wfile.write(body[i : i + 2**17])
+                time.sleep(RangeHandler.chunk_delay)
+            return
+
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDownload(TestCase):
+    """
+    Test the download engine
+    """
+
+    def setUp(self):
+        RangeHandler.fail_first = False
+        RangeHandler.n_requests = 0
+        RangeHandler.chunk_delay = 0.0
+        RangeHandler.etag = None
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/skymap.fits"
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_path = Path(self.tmp_dir.name).joinpath("skymap.fits")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def test_download(self):
+        result = download_file(self.url, self.output_path, chunk_size=1024)
+        self.assertEqual(self.output_path.read_bytes(), PAYLOAD)
+        self.assertEqual(result.size, len(PAYLOAD))
+        self.assertFalse(result.resumed)
+        self.assertFalse(get_part_path(self.output_path).exists())
+
+    def test_resume_after_interruption(self):
+        RangeHandler.fail_first = True
+        result = download_file(self.url, self.output_path, chunk_size=1024)
+        self.assertEqual(self.output_path.read_bytes(), PAYLOAD)
+        self.assertTrue(result.resumed)
+        self.assertEqual(RangeHandler.n_requests, 2)
+
+    def test_resume_existing_part(self):
+        get_part_path(self.output_path).write_bytes(PAYLOAD[:1000])
+        result = download_file(self.url, self.output_path)
+        self.assertEqual(self.output_path.read_bytes(), PAYLOAD)
+        self.assertEqual(result.n_bytes_downloaded, len(PAYLOAD) - 1000)
+
+    def test_resume_changed_file(self):
+        RangeHandler.etag = '"v2"'
+        part_path = get_part_path(self.output_path)
+        validator_path = get_validator_path(part_path)
+
+        # A partial file of the same version is resumed
+        part_path.write_bytes(PAYLOAD[:1000])
+        validator_path.write_text('"v2"')
+        result = download_file(self.url, self.output_path)
+        self.assertTrue(result.resumed)
+        self.assertEqual(self.output_path.read_bytes(), PAYLOAD)
+        self.assertFalse(validator_path.exists())
+
+        # A partial file of an older version is downloaded again
+        part_path.write_bytes(b"x" * 1000)
+        validator_path.write_text('"v1"')
+        result = download_file(self.url, self.output_path)
+        self.assertFalse(result.resumed)
+        self.assertEqual(result.n_bytes_downloaded, len(PAYLOAD))
+        self.assertEqual(self.output_path.read_bytes(), PAYLOAD)
+
+        # The version of an interrupted download is recorded
+        RangeHandler.fail_first = True
+        RangeHandler.n_requests = 0
+        result = download_file(self.url, self.output_path, chunk_size=1024)
+        self.assertTrue(result.resumed)
+        self.assertEqual(self.output_path.read_bytes(), PAYLOAD)
+
+    def test_concurrent(self):
+        # Downloads of the same URL share a partial file, but take turns
+        RangeHandler.chunk_delay = 0.02
+        part_path = get_part_path(self.output_path)
+        output_paths = [
+            Path(self.tmp_dir.name).joinpath(f"skymap_{i}.fits") for i in range(4)
+        ]
+
+        with ThreadPoolExecutor(max_workers=len(output_paths)) as executor:
+            results = list(
+                executor.map(
+                    lambda x: download_file(
+                        self.url, x, chunk_size=1024, part_path=part_path
+                    ),
+                    output_paths,
+                )
+            )
+
+        for path, result in zip(output_paths, results):
+            self.assertEqual(path.read_bytes(), PAYLOAD)
+            self.assertFalse(result.resumed)
+        self.assertFalse(part_path.exists())
+
+    def test_failure(self):
+        with self.assertRaises(DownloadError):
+            download_file(
+                "http://127.0.0.1:1/skymap.fits",
+                self.output_path,
+                max_attempts=1,
+            )
+        self.assertFalse(self.output_path.exists())
@@ -0,0 +1,66 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+import numpy as np
+from gwemopt.tiles import compute_tiles_map
+from helpers import NSIDE, make_tiles
+
+from snipergw.field_index import FieldIndex, load_field_index, tile_values
+
+
+class TestFieldIndex(TestCase):
+    """
+    Test the sparse field x pixel index
+    """
+
+    def setUp(self):
+        self.tiles = make_tiles()
+        self.prob = np.random.default_rng(1).random(12 * NSIDE**2)
+        self.prob /= np.sum(self.prob)
+
+    def test_index(self):
+        index = FieldIndex.from_tiles("ZTF", NSIDE, self.tiles)
+
+        expected = np.array([np.sum(self.prob[x["ipix"]]) for x in self.tiles.values()])
+        np.testing.assert_allclose(index.field_probs(self.prob), expected)
+
+        fields = index.select_fields(self.prob)
+        self.assertEqual(len(fields), np.sum(expected > 0.0))
+        self.assertEqual(fields[0], 100 + np.argmax(expected))
+
+        pixels = np.unique(np.concatenate([self.tiles[x]["ipix"] for x in fields[:5]]))
+        self.assertAlmostEqual(
+            index.coverage(self.prob, fields[:5]), np.sum(self.prob[pixels])
+        )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            loaded = load_field_index(Path(tmp_dir), "key", "ZTF", NSIDE, self.tiles)
+            # Once saved, the index is loaded rather than rebuilt
+            loaded = load_field_index(Path(tmp_dir), "key", "ZTF", NSIDE, {})
+            self.assertEqual(loaded.telescope, "ZTF")
+            self.assertEqual(loaded.nside, NSIDE)
+            np.testing.assert_array_equal(loaded.field_ids, index.field_ids)
+            np.testing.assert_array_equal(
+                loaded.field_probs(self.prob), index.field_probs(self.prob)
+            )
+
+    def test_tile_values(self):
+        distances = 100.0 * self.prob
+        distances[::7] = np.nan
+        distances[::11] = -1.0
+
+        for maximum_overlap, ipix_keep in [
+            (1.0, []),
+            (0.2, []),
+            (0.2, np.arange(0, 200, 3)),
+        ]:
+            params = {"maximumOverlap": maximum_overlap}
+            for skymap, func in [
+                (self.prob, "np.sum(x)"),
+                (distances, "np.nanmedian(x)"),
+            ]:
+                np.testing.assert_array_equal(
+                    tile_values(params, self.tiles, skymap, func, ipix_keep),
+                    compute_tiles_map(params, self.tiles, skymap, func, ipix_keep),
+                )
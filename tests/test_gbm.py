@@ -0,0 +1,139 @@
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from snipergw.gbm import get_grb_skymap_urls, parse_grb_name
+
+# Directory listings served by the fake HEASARC, by path
+LISTINGS = {
+    "/2021/": ["bn210728456/", "bn210729123/", "bn210729500/", "bn210729900/"],
+    "/2021/bn210728456/current/": ["glg_healpix_all_bn210728456_v00.fit"],
+    "/2021/bn210729123/current/": [
+        "glg_healpix_all_bn210729123_v00.fit",
+        "glg_healpix_all_bn210729123_v01.fit",
+    ],
+    # A TGF, without any skymap
+    "/2021/bn210729500/current/": ["glg_tte_n0_bn210729500_v00.fit"],
+    "/2021/bn210729900/current/": ["glg_healpix_all_bn210729900_v00.fit"],
+}
+
+
+class ListingHandler(BaseHTTPRequestHandler):
+    """
+    Handler serving directory listings with an ETag,
+    and answering conditional requests with a 304
+    """
+
+    requests = []
+
+    def do_GET(self):
+        ListingHandler.requests.append(
+            (self.path, self.headers.get("If-None-Match") is not None)
+        )
+        if self.path not in LISTINGS:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        etag = f'"{hash(tuple(LISTINGS[self.path]))}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = "".join(f'<a href="{x}">{x}</a>' for x in LISTINGS[self.path])
+        body = f"<html><body>{body}</body></html>".encode()
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestGBM(TestCase):
+    """
+    Test the discovery of Fermi-GBM skymaps
+    """
+
+    def setUp(self):
+        ListingHandler.requests = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), ListingHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.patch = patch("snipergw.gbm.GBM_TRIGGER_URL", self.url)
+        self.patch.start()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.patch.stop()
+        self.tmp_dir.cleanup()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_parse_grb_name(self):
+        grb = parse_grb_name("grb 210729b")
+        self.assertEqual(grb.name, "GRB210729B")
+        self.assertEqual(grb.year, "2021")
+        self.assertEqual(grb.date, "210729")
+        self.assertEqual(grb.index, 1)
+
+        with self.assertRaises(ValueError):
+            parse_grb_name("GRB2107")
+
+    def test_resolve(self):
+        urls = get_grb_skymap_urls(
+            ["GRB210729A", "GRB210729B", "GRB210728A"], cache_dir=self.cache_dir
+        )
+        self.assertEqual(
+            urls,
+            {
+                "GRB210729A": f"{self.url}/2021/bn210729123/current/"
+                f"glg_healpix_all_bn210729123_v01.fit",
+                "GRB210729B": f"{self.url}/2021/bn210729900/current/"
+                f"glg_healpix_all_bn210729900_v00.fit",
+                "GRB210728A": f"{self.url}/2021/bn210728456/current/"
+                f"glg_healpix_all_bn210728456_v00.fit",
+            },
+        )
+
+        # The yearly index and each trigger are only fetched once
+        paths = [x[0] for x in ListingHandler.requests]
+        self.assertEqual(sorted(paths), sorted(LISTINGS))
+
+        with self.assertRaises(ValueError):
+            get_grb_skymap_urls(["GRB210729C"], cache_dir=self.cache_dir)
+
+    def test_cache(self):
+        get_grb_skymap_urls(["GRB210729A"], cache_dir=self.cache_dir)
+        n_requests = len(ListingHandler.requests)
+
+        # Fresh listings are reused without any request
+        get_grb_skymap_urls(["GRB210729A"], cache_dir=self.cache_dir)
+        self.assertEqual(len(ListingHandler.requests), n_requests)
+
+        # Stale listings are revalidated with conditional requests
+        get_grb_skymap_urls(["GRB210729A"], cache_dir=self.cache_dir, max_age=0.0)
+        new_requests = ListingHandler.requests[n_requests:]
+        self.assertEqual(len(new_requests), n_requests)
+        self.assertTrue(all(x[1] for x in new_requests))
+
+    def test_new_trigger(self):
+        get_grb_skymap_urls(["GRB210729A"], cache_dir=self.cache_dir)
+
+        new_listings = {
+            "/2021/": LISTINGS["/2021/"] + ["bn210730100/"],
+            "/2021/bn210730100/current/": ["glg_healpix_all_bn210730100_v00.fit"],
+        }
+        with patch.dict(LISTINGS, new_listings):
+            # A date missing from the cached index triggers a revalidation
+            urls = get_grb_skymap_urls(["GRB210730A"], cache_dir=self.cache_dir)
+
+        self.assertIn("bn210730100", urls["GRB210730A"])
@@ -0,0 +1,119 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from snipergw.benchmark import BenchmarkCase
+from snipergw.gracedb_index import SupereventIndex
+from snipergw.model import EventConfig
+from snipergw.session import get_gracedb_client
+from snipergw.simulator import SimulatorConfig, SimulatorServer, simulated_services
+from snipergw.skymap import Skymap
+
+NSIDE = 64
+
+
+class TestSupereventIndex(TestCase):
+    """
+    Test the incremental index of GraceDB superevents
+    """
+
+    def setUp(self):
+        self.simulator = SimulatorServer(SimulatorConfig(n_revisions=2))
+        self.simulator.start()
+        self.services = simulated_services(
+            self.simulator.gracedb_url, self.simulator.heasarc_url
+        )
+        self.services.__enter__()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = Path(self.tmp_dir.name)
+
+        # The client fetches the API description on first use
+        self.client = get_gracedb_client()
+        self.assertIn("superevents", self.client.links)
+
+    def tearDown(self):
+        self.services.__exit__(None, None, None)
+        self.simulator.stop()
+        self.tmp_dir.cleanup()
+
+    def count_requests(self, func, *args, **kwargs):
+        """
+        Call a function, and count the requests made to GraceDB
+
+        :return: Result of function, number of requests
+        """
+        n_before = self.simulator.requests["gracedb"]
+        result = func(*args, **kwargs)
+        return result, self.simulator.requests["gracedb"] - n_before
+
+    def test_sync(self):
+        # Superevents of the simulator are newest first
+        for i in reversed(range(25)):
+            self.simulator.superevents[f"S1904{i:02d}a"] = f"S1904{i:02d}a.fits"
+        index = SupereventIndex(self.output_dir)
+
+        # A new index only lists the first page of superevents
+        latest, n_requests = self.count_requests(index.latest, self.client)
+        self.assertEqual(latest, "S190424a")
+        self.assertEqual(n_requests, 1)
+        self.assertEqual(len(index.query_superevents()), 10)
+
+        # Only new superevents are added
+        self.simulator.superevents = {
+            "S190426a": "S190426a.fits",
+            "S190425a": "S190425a.fits",
+            **self.simulator.superevents,
+        }
+        new, n_requests = self.count_requests(
+            index.sync_superevents, self.client, page_size=2
+        )
+        self.assertEqual(new, ["S190426a", "S190425a"])
+        self.assertEqual(n_requests, 2)
+        self.assertEqual(
+            [x.superevent_id for x in index.query_superevents(limit=3)],
+            ["S190426a", "S190425a", "S190424a"],
+        )
+
+        # Revisions and skymap URLs are answered from the index once known
+        voevent, n_requests = self.count_requests(
+            index.get_voevent, self.client, "S190426a"
+        )
+        self.assertEqual((voevent.revision, n_requests), (2, 1))
+
+        url, n_requests = self.count_requests(
+            index.get_skymap_url, self.client, "S190426a", voevent
+        )
+        self.assertEqual(n_requests, 1)
+        self.assertTrue(url.endswith("/files/S190426a.fits"))
+
+        voevent, n_requests = self.count_requests(
+            index.get_voevent, self.client, "S190426a", rev=2
+        )
+        self.assertEqual((voevent.skymap_url, n_requests), (url, 0))
+
+        with self.assertRaises(Exception):
+            index.get_voevent(self.client, "S190426a", rev=3)
+
+    def test_skymap(self):
+        self.simulator.add_superevent("S190425a", BenchmarkCase(nside=NSIDE))
+        self.simulator.add_superevent("S190425b", BenchmarkCase(nside=NSIDE, ra=200.0))
+
+        skymap, n_cold = self.count_requests(
+            Skymap, EventConfig(output_dir=self.output_dir)
+        )
+        self.assertEqual((skymap.event_name, skymap.revision), ("S190425b", 2))
+        # Superevents, VOEvents, VOEvent XML and skymap
+        self.assertEqual(n_cold, 4)
+
+        # A rerun only checks for new superevents and revisions
+        skymap, n_warm = self.count_requests(
+            Skymap, EventConfig(output_dir=self.output_dir)
+        )
+        self.assertEqual(skymap.event_name, "S190425b")
+        self.assertEqual(n_warm, 2)
+
+        # A known revision of a named event needs no request at all
+        skymap, n_named = self.count_requests(
+            Skymap, EventConfig(event="S190425b", rev=2, output_dir=self.output_dir)
+        )
+        self.assertEqual(n_named, 0)
@@ -0,0 +1,62 @@
+import json
+import subprocess
+import sys
+from unittest import TestCase
+
+# Modules which must only be imported when planning or submitting
+LAZY_MODULES = [
+    "gwemopt",
+    "healpy",
+    "ligo.skymap",
+    "matplotlib",
+    "planobs",
+    "winterapi",
+]
+
+# Allowed import time of snipergw beyond its core dependencies, in seconds
+IMPORT_TIME_MARGIN = 1.0
+
+BASELINE_IMPORTS = "import numpy, pandas, astropy.time, astropy.io.fits, requests"
+
+
+def measure_import(statement: str) -> dict:
+    """
+    Measure the time to run import statements in a fresh interpreter
+
+    :param statement: Import statements
+    :return: Dictionary with the import time and the modules loaded
+    """
+    code = (
+        "import json, sys, time\n"
+        "t_start = time.perf_counter()\n"
+        f"{statement}\n"
+        "print(json.dumps({'time': time.perf_counter() - t_start, "
+        "'modules': list(sys.modules)}))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, check=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+class TestImportTime(TestCase):
+    """
+    Guard the startup time of the command line interface
+    """
+
+    def test_lazy_imports(self):
+        result = measure_import("import snipergw.run, snipergw.watch")
+
+        loaded = [
+            x
+            for x in LAZY_MODULES
+            if any(m == x or m.startswith(f"{x}.") for m in result["modules"])
+        ]
+        self.assertEqual(loaded, [])
+
+    def test_import_time(self):
+        baseline = min(measure_import(BASELINE_IMPORTS)["time"] for _ in range(2))
+        import_time = min(
+            measure_import("import snipergw.run")["time"] for _ in range(2)
+        )
+        self.assertLess(import_time, baseline + IMPORT_TIME_MARGIN)
@@ -0,0 +1,108 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from helpers import make_schedule
+
+from snipergw.incremental import (
+    PLAN_STATE_NAME,
+    PlanState,
+    get_incremental_args,
+    get_window_days,
+)
+from snipergw.schedule import get_target_diff
+from snipergw.submit.ledger import SubmissionLedger, select_targets
+
+
+class TestIncremental(TestCase):
+    """
+    Test incremental replanning and delta submission
+    """
+
+    def test_target_diff(self):
+        diff = get_target_diff(
+            [(1, "g"), (2, "g"), (2, "g"), (3, "r")],
+            [(2, "g"), (3, "r"), (4, "r")],
+        )
+        self.assertEqual(diff.kept, [(2, "g"), (3, "r")])
+        self.assertEqual(diff.added, [(4, "r")])
+        self.assertEqual(diff.removed, [(1, "g"), (2, "g")])
+        self.assertFalse(diff.is_empty)
+
+        schedule = make_schedule([1, 2], ["g", "r"], [60000.1, 60000.2])
+        self.assertTrue(schedule.diff(schedule).is_empty)
+
+    def test_plan_state(self):
+        self.assertEqual(get_window_days([]), 1.0)
+        self.assertEqual(get_window_days(["--Tobs", "0.0,0.5"]), 0.5)
+
+        previous = make_schedule(
+            [1, 2, 1, 3], ["g", "g", "r", "g"], [60000.1, 60000.2, 60000.3, 60000.6]
+        )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_dir = Path(tmp_dir)
+
+            # The first plan starts a new window
+            args, state = get_incremental_args(
+                output_dir, None, 60000.0, [], incremental=True
+            )
+            self.assertEqual(args, [])
+            self.assertEqual(state.window_end_mjd, 60001.0)
+            state.write(output_dir.joinpath(PLAN_STATE_NAME))
+
+            # Field 1 is only observed once both its pointings have ended
+            args, state = get_incremental_args(
+                output_dir, previous, 60000.25, [], incremental=True
+            )
+            self.assertEqual(state.observed_fields, [2])
+            self.assertEqual(state.n_plans, 2)
+            self.assertEqual(args, ["--Tobs", "0.0,0.750000", "--observedTiles", "2"])
+
+            state = state.advance(previous, 60000.5)
+            self.assertEqual(state.observed_fields, [1, 2])
+
+            # Without incremental, or after the window, a new window is started
+            for cut_mjd, incremental in [(60000.25, False), (60001.5, True)]:
+                args, state = get_incremental_args(
+                    output_dir, previous, cut_mjd, [], incremental=incremental
+                )
+                self.assertEqual(args, [])
+                self.assertEqual(state.window_start_mjd, cut_mjd)
+                self.assertEqual(state.observed_fields, [])
+
+        self.assertEqual(PlanState.read(output_dir.joinpath(PLAN_STATE_NAME)), None)
+
+    def test_ledger(self):
+        ledger = SubmissionLedger()
+        ledger.add("a", [(1, "g"), (2, "g")], start_mjd=60000.0, end_mjd=60001.0)
+        ledger.add("b", [(3, "r")], start_mjd=60000.0, end_mjd=60001.0)
+
+        delta = ledger.get_delta([(1, "g"), (2, "g"), (3, "r")])
+        self.assertTrue(delta.is_empty)
+        self.assertEqual(delta.keep, ["a", "b"])
+
+        # Trigger a has an unwanted target, so it is replaced
+        delta = ledger.get_delta([(2, "g"), (3, "r"), (4, "g")])
+        self.assertEqual(delta.keep, ["b"])
+        self.assertEqual(delta.remove, ["a"])
+        self.assertEqual(delta.add, [(2, "g"), (4, "g")])
+
+        # Unless field 1 has been observed, so the new plan skips it
+        delta = ledger.get_delta([(2, "g"), (3, "r"), (4, "g")], observed_fields=[1])
+        self.assertEqual(delta.keep, ["a", "b"])
+        self.assertEqual(delta.add, [(4, "g")])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir).joinpath("submissions.json")
+            ledger.write(path)
+            loaded = SubmissionLedger.read(path)
+            self.assertEqual(loaded.names, ["a", "b"])
+            self.assertEqual(loaded.n_submitted, 2)
+            self.assertEqual(loaded.get_delta([(3, "r")]).remove, ["a"])
+
+        schedule = make_schedule(
+            [1, 2, 1, 2], ["g", "g", "g", "r"], [60000.1, 60000.2, 60000.3, 60000.4]
+        )
+        selected = select_targets(schedule, [(1, "g"), (2, "r")])
+        self.assertEqual(selected["tobs"].tolist(), [60000.1, 60000.4])
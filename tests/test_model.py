@@ -0,0 +1,46 @@
+from unittest import TestCase
+
+from snipergw.model import get_plan_configs
+from snipergw.plan import run_gwemopt_parallel
+
+
+class TestPlanConfigs(TestCase):
+    """
+    Test creating plan configs for several telescopes
+    """
+
+    def test_get_plan_configs(self):
+        plan_configs = get_plan_configs(telescope="ZTF, WINTER", subprogram="test")
+
+        self.assertEqual([x.telescope for x in plan_configs], ["ZTF", "WINTER"])
+        self.assertEqual([x.filters for x in plan_configs], ["g,r,g", "J"])
+        self.assertEqual([x.nside for x in plan_configs], [256, 512])
+        self.assertEqual(plan_configs[1].subprogram, "test")
+
+        with self.assertRaises(ValueError):
+            get_plan_configs(telescope="ZTF,HST")
+
+    def test_telescope_filters(self):
+        plan_configs = get_plan_configs(
+            telescope="ZTF,WINTER", filters="ZTF:g,r;WINTER:Hs"
+        )
+        self.assertEqual([x.filters for x in plan_configs], ["g,r", "Hs"])
+
+        # Telescopes which are not listed use their default filters
+        plan_configs = get_plan_configs(telescope="ZTF,WINTER", filters="ZTF:g")
+        self.assertEqual([x.filters for x in plan_configs], ["g", "J"])
+
+        # Filters shared by all telescopes must be valid for each of them
+        with self.assertRaises(ValueError):
+            get_plan_configs(telescope="ZTF,WINTER", filters="g")
+
+        with self.assertRaises(ValueError):
+            get_plan_configs(telescope="ZTF,WINTER", filters="ZTF:g;J")
+
+    def test_duplicate_telescopes(self):
+        with self.assertRaises(ValueError):
+            run_gwemopt_parallel(
+                skymap=None,
+                plan_configs=get_plan_configs(telescope="ZTF,ZTF"),
+                gwemopt_args=[],
+            )
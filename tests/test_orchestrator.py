@@ -0,0 +1,185 @@
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+from pathlib import Path
+from unittest import TestCase
+
+from snipergw.benchmark import make_benchmark_schedule
+from snipergw.model import PlanConfig
+from snipergw.simulator import (
+    LocalQueue,
+    ServiceConfig,
+    SimulatorConfig,
+    simulated_services,
+)
+from snipergw.submit import get_submitter
+from snipergw.submit.ledger import SubmissionLedger, get_ledger_path
+from snipergw.submit.orchestrator import (
+    check_results,
+    get_idempotency_key,
+    submit_schedules,
+)
+from snipergw.tracing import tracer
+
+
+class TestOrchestrator(TestCase):
+    """
+    Test the concurrent submission to several facilities
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # Import the backends first, so the timings only include submission
+        for telescope in ["ZTF", "WINTER"]:
+            get_submitter(telescope)
+
+    def setUp(self):
+        LocalQueue.triggers = {}
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.plan_configs = [
+            PlanConfig(output_dir=Path(self.tmp_dir.name), telescope=x)
+            for x in ["ZTF", "WINTER"]
+        ]
+        self.schedules = [
+            make_benchmark_schedule(10, ["g", "r"]),
+            make_benchmark_schedule(10, ["J"]),
+        ]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def submit(self, config: SimulatorConfig, **kwargs):
+        with simulated_services("", "", config):
+            return submit_schedules(
+                self.schedules, "S1", self.plan_configs, submit=True, **kwargs
+            )
+
+    def test_idempotency_key(self):
+        schedule = self.schedules[0]
+        key = get_idempotency_key(schedule, "S1", self.plan_configs[0], "submit")
+        self.assertTrue(key.startswith("ToO_EMGW_S1:submit:"))
+
+        # The key does not depend on the order of the targets
+        self.assertEqual(
+            key,
+            get_idempotency_key(
+                schedule.iloc[::-1], "S1", self.plan_configs[0], "submit"
+            ),
+        )
+        self.assertNotEqual(
+            key,
+            get_idempotency_key(
+                schedule.iloc[1:], "S1", self.plan_configs[0], "submit"
+            ),
+        )
+        self.assertNotEqual(
+            key, get_idempotency_key(schedule, "S1", self.plan_configs[0], "delete")
+        )
+
+    def test_concurrent(self):
+        # ZTF makes three calls and WINTER two, so sequentially this takes 1.5s
+        config = SimulatorConfig.uniform(ServiceConfig(latency=0.3))
+
+        t_start = time.perf_counter()
+        with tracer.collect() as spans:
+            results = self.submit(config)
+        runtime = time.perf_counter() - t_start
+
+        self.assertLess(runtime, 1.3)
+        self.assertEqual([x.telescope for x in results], ["ZTF", "WINTER"])
+        self.assertEqual([x.status for x in results], ["submitted", "submitted"])
+        self.assertTrue(results[0].details["submitted"])
+        self.assertEqual(results[1].details["trigger_name"], "S1_0")
+        self.assertEqual(len([x for x in spans if x.name == "submit"]), 2)
+        check_results(results)
+
+        # A retry is not submitted again
+        results = self.submit(config)
+        self.assertEqual([x.status for x in results], ["duplicate", "duplicate"])
+        self.assertEqual(list(LocalQueue.triggers), ["ToO_EMGW_S1_0"])
+
+        ledger = SubmissionLedger.read(get_ledger_path(self.plan_configs[1], "S1"))
+        self.assertEqual(ledger.names, ["S1_0"])
+        self.assertEqual(ledger.idempotency_keys, [results[1].idempotency_key])
+
+    def test_history(self):
+        plan_configs = self.plan_configs[1:]
+        schedules = [self.schedules[1], self.schedules[1].iloc[1:]]
+
+        keys = []
+        for schedule in [schedules[0], schedules[1], schedules[0]]:
+            with simulated_services("", "", SimulatorConfig()):
+                results = submit_schedules([schedule], "S1", plan_configs, submit=True)
+            keys.append(results[0].idempotency_key)
+
+            # Only a retry of the latest submission is skipped
+            self.assertEqual(results[0].status, "submitted")
+
+        ledger = SubmissionLedger.read(get_ledger_path(plan_configs[0], "S1"))
+        self.assertEqual(ledger.idempotency_keys, keys)
+        self.assertEqual(ledger.idempotency_key, keys[0])
+
+    def test_failures(self):
+        # One facility failing does not stop the other
+        config = SimulatorConfig(winter=ServiceConfig(error_rate=1.0))
+        results = self.submit(config)
+        self.assertEqual([x.status for x in results], ["submitted", "failed"])
+        self.assertIn("ConnectionError", results[1].error)
+        with self.assertRaises(RuntimeError):
+            check_results(results)
+
+        # The failed facility is retried
+        results = self.submit(SimulatorConfig())
+        self.assertEqual([x.status for x in results], ["duplicate", "submitted"])
+
+    def test_timeout(self):
+        config = SimulatorConfig(winter=ServiceConfig(latency=0.3))
+        with simulated_services("", "", config):
+            results = submit_schedules(
+                self.schedules,
+                "S1",
+                self.plan_configs,
+                submit=True,
+                timeouts={"WINTER": 0.1},
+            )
+            self.assertEqual([x.status for x in results], ["submitted", "timeout"])
+            self.assertFalse(results[1].ok)
+
+            # The submission still completes, so a retry waits and is skipped
+            results = submit_schedules(
+                self.schedules[1:], "S1", self.plan_configs[1:], submit=True
+            )
+            self.assertEqual(results[0].status, "duplicate")
+
+    def test_exit(self):
+        # A facility which hangs does not keep the process alive after its timeout
+        script = textwrap.dedent(
+            f"""
+            from pathlib import Path
+
+            from snipergw.benchmark import make_benchmark_schedule
+            from snipergw.model import PlanConfig
+            from snipergw.simulator import ServiceConfig, SimulatorConfig
+            from snipergw.simulator import simulated_services
+            from snipergw.submit.orchestrator import submit_schedules
+
+            config = SimulatorConfig(winter=ServiceConfig(latency=60.0))
+            plan_config = PlanConfig(output_dir=Path("{self.tmp_dir.name}"))
+            plan_config = plan_config.model_copy(update={{"telescope": "WINTER"}})
+            with simulated_services("", "", config):
+                results = submit_schedules(
+                    [make_benchmark_schedule(10, ["J"])],
+                    "S1",
+                    [plan_config],
+                    submit=True,
+                    timeouts={{"WINTER": 0.1}},
+                )
+            assert results[0].status == "timeout", results[0].status
+            """
+        )
+        process = subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, text=True, timeout=50
+        )
+        self.assertEqual(process.returncode, 0, process.stderr)
@@ -1,11 +1,17 @@
+import tempfile
 from pathlib import Path
 from unittest import TestCase
+from unittest.mock import patch
 
 import pandas as pd
 from astropy.time import Time
+from test_skymap import write_synthetic_skymap
 
-from snipergw.model import EventConfig, PlanConfig
-from snipergw.plan import run_gwemopt
+from snipergw.benchmark import make_benchmark_schedule
+from snipergw.model import EventConfig, PlanConfig, get_plan_configs
+from snipergw.plan import SCHEDULE_ARRAY_NAME, run_gwemopt
+from snipergw.run import run_snipergw_multi
+from snipergw.schedule import Schedule
 from snipergw.skymap import Skymap
 
 test_path = Path(__file__).parent.joinpath("testdata/test_schedule.csv")
@@ -28,7 +34,7 @@ class TestRun(TestCase):
         skymap = Skymap(event_config=event)
         schedule = run_gwemopt(skymap=skymap, plan_config=plan_config, gwemopt_args=[])
 
-        expected_schedule = pd.read_csv(test_path, index_col=0)
+        expected_schedule = Schedule.read_csv(test_path)
 
         # Uncomment to update the test data
         # schedule.to_csv(test_path)
@@ -36,3 +42,50 @@ class TestRun(TestCase):
         pd.testing.assert_frame_equal(
             schedule.reset_index(drop=True), expected_schedule.reset_index(drop=True)
         )
+
+        saved_schedule = Schedule.read_npy(
+            plan_config.output_dir.joinpath("S190425z/ZTF/schedule.npy")
+        )
+        pd.testing.assert_frame_equal(saved_schedule, schedule)
+
+
+class TestDelete(TestCase):
+    """
+    Test that deleting a queue reuses the saved schedule
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = Path(self.tmp_dir.name)
+        self.output_dir.joinpath("skymaps").mkdir()
+        write_synthetic_skymap(self.output_dir.joinpath("skymaps/flat.fits"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_delete(self):
+        event = EventConfig(event="flat.fits", output_dir=self.output_dir)
+        plan_configs = get_plan_configs(
+            telescope="ZTF,WINTER", output_dir=self.output_dir
+        )
+
+        # Only ZTF has been planned, so only WINTER is planned before deleting
+        saved = Schedule.read_csv(test_path)
+        output_dir = plan_configs[0].get_output_dir("flat.fits")
+        output_dir.mkdir(parents=True)
+        saved.write_npy(output_dir.joinpath(SCHEDULE_ARRAY_NAME))
+        planned = make_benchmark_schedule(10, ["J"])
+
+        with (
+            patch("snipergw.run.run_gwemopt_parallel", return_value=[planned]) as plan,
+            patch("snipergw.run.submit_schedules", return_value=[]) as submit,
+        ):
+            schedules = run_snipergw_multi(event, plan_configs, delete=True)
+
+        self.assertEqual(
+            [x.telescope for x in plan.call_args.kwargs["plan_configs"]], ["WINTER"]
+        )
+        pd.testing.assert_frame_equal(schedules[0], saved)
+        self.assertIs(schedules[1], planned)
+        self.assertIs(submit.call_args.args[0], schedules)
+        self.assertTrue(submit.call_args.kwargs["delete"])
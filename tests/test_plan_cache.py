@@ -0,0 +1,138 @@
+import argparse
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from astropy import units as u
+from astropy.time import Time
+from test_skymap import write_synthetic_skymap
+
+from snipergw.cli import add_plan_arguments, parse_starttime
+from snipergw.model import EventConfig, PlanConfig, get_plan_configs
+from snipergw.plan_cache import PlanCache, get_plan_inputs, get_plan_key
+from snipergw.skymap import Skymap
+
+
+class TestPlanCache(TestCase):
+    """
+    Test the input-hashed plan cache
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = Path(self.tmp_dir.name)
+        self.skymap_dir = self.output_dir.joinpath("skymaps")
+        self.skymap_dir.mkdir()
+        write_synthetic_skymap(self.skymap_dir.joinpath("flat.fits"))
+        self.skymap = Skymap(
+            event_config=EventConfig(event="flat.fits", output_dir=self.output_dir)
+        )
+        self.plan_config = PlanConfig(
+            output_dir=self.output_dir,
+            starttime=Time("2019-04-25T09:00:00", format="isot", scale="utc"),
+        )
+        self.args = ["--doTiles", "-o", "/a/b", "--event", "/c/flat.fits"]
+
+    def tearDown(self):
+        self.skymap.close()
+        self.tmp_dir.cleanup()
+
+    def get_key(self, plan_config: PlanConfig, args: list[str]) -> str:
+        return get_plan_key(get_plan_inputs(self.skymap, plan_config, args))
+
+    def test_key(self):
+        key = self.get_key(self.plan_config, self.args)
+
+        self.assertEqual(
+            key,
+            self.get_key(
+                self.plan_config.model_copy(
+                    update={"subprogram": "other", "label": "sweep/000"}
+                ),
+                ["--doTiles", "-o", "/d/e", "--event", "/f/flat.fits"],
+            ),
+        )
+
+        for update in [
+            {"filters": "r"},
+            {"nside": 64},
+            {"starttime": Time("2019-04-25T10:00:00", format="isot", scale="utc")},
+        ]:
+            self.assertNotEqual(
+                key, self.get_key(self.plan_config.model_copy(update=update), self.args)
+            )
+
+        self.assertNotEqual(
+            key, self.get_key(self.plan_config, self.args + ["--airmass", "2.0"])
+        )
+
+    def test_default_starttime(self):
+        parser = argparse.ArgumentParser()
+        add_plan_arguments(parser)
+
+        # Rerunning a few minutes later, without --starttime, gives the same key
+        keys = []
+        now = Time("2019-04-25T09:01:30", format="isot", scale="utc")
+        for delay in [0.0, 5.0, 13.0]:
+            with patch.object(Time, "now", return_value=now + delay * u.min):
+                args = parser.parse_args(["-o", str(self.output_dir)])
+                parse_starttime(args)
+            plan_config = get_plan_configs(**args.__dict__)[0]
+            self.assertEqual(plan_config.starttime.isot, "2019-04-25T09:30:00.000")
+            gps_args = ["--gpstime", f"{plan_config.starttime.gps}"]
+            keys.append(self.get_key(plan_config, self.args + gps_args))
+
+        self.assertEqual(len(set(keys)), 1)
+
+    def test_get_put_evict(self):
+        cache = PlanCache(self.output_dir.joinpath("plan_cache"), max_size_mb=0.0025)
+        artifact_dir = self.output_dir.joinpath("gwemopt")
+        artifact_dir.mkdir()
+        artifact = artifact_dir.joinpath("schedule_ZTF.dat")
+
+        self.assertFalse(cache.get("a" * 64, artifact_dir))
+
+        for i, key in enumerate(["a" * 64, "b" * 64]):
+            with open(artifact, "w") as f:
+                f.write(f"{key[0]}\n" * 500)
+            cache.put(key, {"i": i}, artifacts=[artifact])
+            time.sleep(0.01)
+
+        artifact.unlink()
+        self.assertTrue(cache.get("a" * 64, artifact_dir))
+        with open(artifact, "r") as f:
+            self.assertEqual(f.readline(), "a\n")
+
+        # Adding a third entry evicts the least recently used one, b
+        time.sleep(0.01)
+        cache.put("c" * 64, {"i": 2}, artifacts=[artifact])
+        self.assertTrue(cache.get("a" * 64, artifact_dir))
+        self.assertFalse(cache.get("b" * 64, artifact_dir))
+        self.assertTrue(cache.get("c" * 64, artifact_dir))
+
+    def test_concurrent_put(self):
+        # Sweep and batch workers share the cache, and may plan the same inputs
+        cache = PlanCache(self.output_dir.joinpath("plan_cache"))
+        key = "a" * 64
+
+        def put_and_get(i: int) -> bool:
+            artifact_dir = self.output_dir.joinpath(f"worker_{i}")
+            artifact_dir.mkdir()
+            artifact = artifact_dir.joinpath("schedule_ZTF.dat")
+            with open(artifact, "w") as f:
+                f.write("a\n" * 50000)
+            for _ in range(5):
+                cache.put(key, {"i": i}, artifacts=[artifact])
+                if not cache.get(key, artifact_dir.joinpath("copy")):
+                    return False
+            with open(artifact_dir.joinpath("copy/schedule_ZTF.dat"), "r") as f:
+                return f.read() == "a\n" * 50000
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            self.assertTrue(all(executor.map(put_and_get, range(8))))
+
+        self.assertEqual([x[0].name for x in cache.get_entries()], [key])
+        self.assertEqual(list(cache.tmp_dir.iterdir()), [])
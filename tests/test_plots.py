@@ -0,0 +1,29 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from snipergw.plots import update_symlink
+
+
+class TestPlots(TestCase):
+    """
+    Test the helpers for background plots
+    """
+
+    def test_update_symlink(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            old, new = tmp_dir.joinpath("old.pdf"), tmp_dir.joinpath("new.pdf")
+            old.touch()
+            new.touch()
+            link = tmp_dir.joinpath("tiles_coverage.pdf")
+
+            update_symlink(link, old)
+            self.assertEqual(link.resolve(), old.resolve())
+
+            update_symlink(link, new)
+            self.assertEqual(link.resolve(), new.resolve())
+            self.assertEqual(
+                sorted(x.name for x in tmp_dir.iterdir()),
+                ["new.pdf", "old.pdf", "tiles_coverage.pdf"],
+            )
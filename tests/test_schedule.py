@@ -0,0 +1,67 @@
+import mmap
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from snipergw.schedule import Schedule, load_schedule_array
+
+# Three pointings of two fields, in the format written by gwemopt
+test_schedule = """584 245.31027 18.95000 58598.37500 21.65000 299 0.25405 1.05943 g 
+583 238.04173 18.95000 58598.37859 21.65000 299 0.12280 1.03695 g 
+584 245.31027 18.95000 58598.41500 21.65000 299 0.25405 1.10943 r 
+"""
+
+
+class TestSchedule(TestCase):
+    """
+    Test the Schedule class
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.schedule_path = Path(self.tmp_dir.name).joinpath("schedule_ZTF.dat")
+        with open(self.schedule_path, "w") as f:
+            f.write(test_schedule)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_read_gwemopt(self):
+        schedule = Schedule.from_gwemopt(self.schedule_path).add_times()
+
+        self.assertEqual(str(schedule["field"].dtype), "int32")
+        self.assertEqual(str(schedule["airmass"].dtype), "float32")
+        self.assertEqual(str(schedule["filter"].dtype), "category")
+        self.assertEqual(schedule["utctime"].iloc[0], "2019-04-25T09:01:09")
+        self.assertEqual(schedule["palomartime"].iloc[0], "2019-04-25T02:01:09")
+        self.assertIsInstance(schedule[schedule["filter"] == "g"], Schedule)
+
+        summary = schedule.summarise()
+        self.assertEqual(summary.n_pointings, 3)
+        self.assertEqual(summary.n_fields, 2)
+        self.assertAlmostEqual(summary.total_prob, 0.37685)
+        self.assertAlmostEqual(summary.duration_hours, 3 * 299 / 3600.0)
+        self.assertEqual(summary.filters, {"g": 2, "r": 1})
+
+    def test_binary_artifact(self):
+        schedule = Schedule.from_gwemopt(self.schedule_path).add_times()
+        array_path = Path(self.tmp_dir.name).joinpath("schedule.npy")
+        schedule.write_npy(array_path)
+
+        array = load_schedule_array(array_path)
+        self.assertIsInstance(array, np.memmap)
+
+        loaded = Schedule.read_npy(array_path)
+        pd.testing.assert_frame_equal(loaded, schedule)
+        # The numeric columns are views of the memory-mapped file
+        base = loaded["tobs"].to_numpy()
+        while not isinstance(base, mmap.mmap):
+            base = base.base
+        self.assertIsInstance(base, mmap.mmap)
+
+        np.save(array_path, np.zeros(3))
+        with self.assertRaises(ValueError):
+            Schedule.read_npy(array_path)
@@ -0,0 +1,113 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+
+import requests
+
+from snipergw.session import configure_http, get, get_session, http_config, poll_until
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """
+    Handler which fails with a 503 for the first `n_failures` requests
+    """
+
+    n_failures = 0
+    n_requests = 0
+
+    def do_GET(self):
+        FlakyHandler.n_requests += 1
+        if self.path == "/missing":
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        if FlakyHandler.n_requests <= FlakyHandler.n_failures:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSession(TestCase):
+    """
+    Test the shared HTTP session layer
+    """
+
+    def setUp(self):
+        FlakyHandler.n_failures = 0
+        FlakyHandler.n_requests = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.old_config = http_config.model_dump()
+        configure_http(max_delay=0.01, max_tries=3)
+
+    def tearDown(self):
+        configure_http(**self.old_config)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_shared_session(self):
+        self.assertIs(get_session(), get_session())
+
+    def test_retry_transient(self):
+        FlakyHandler.n_failures = 2
+        response = get(f"{self.url}/skymap")
+        self.assertEqual(response.content, b"ok")
+        self.assertEqual(FlakyHandler.n_requests, 3)
+
+    def test_give_up(self):
+        FlakyHandler.n_failures = 5
+        with self.assertRaises(requests.exceptions.HTTPError):
+            get(f"{self.url}/skymap")
+        self.assertEqual(FlakyHandler.n_requests, 3)
+
+    def test_no_retry_permanent(self):
+        with self.assertRaises(requests.exceptions.HTTPError):
+            get(f"{self.url}/missing")
+        self.assertEqual(FlakyHandler.n_requests, 1)
+
+
+class TestPollUntil(TestCase):
+    """
+    Test polling with backoff and a deadline
+    """
+
+    def test_poll_until(self):
+        results = iter([False, ValueError("not ready"), False, True])
+
+        def check():
+            result = next(results)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        elapsed = poll_until(
+            check,
+            deadline=5.0,
+            initial_delay=0.01,
+            max_delay=0.02,
+            errors=(ValueError,),
+        )
+        self.assertLess(elapsed, 1.0)
+
+    def test_deadline(self):
+        n_checks = []
+
+        def check():
+            n_checks.append(1)
+            return False
+
+        with self.assertRaises(TimeoutError):
+            poll_until(check, deadline=0.1, initial_delay=0.01, max_delay=0.05)
+        self.assertGreater(len(n_checks), 2)
@@ -0,0 +1,105 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from planobs.api import APIError
+
+from snipergw.benchmark import BenchmarkCase, make_benchmark_schedule
+from snipergw.load import get_gw_name, get_stage_latencies, make_alerts
+from snipergw.model import EventConfig, PlanConfig
+from snipergw.session import configure_http, http_config
+from snipergw.simulator import (
+    LocalQueue,
+    ServiceConfig,
+    SimulatorConfig,
+    SimulatorServer,
+    simulated_services,
+)
+from snipergw.skymap import Skymap
+from snipergw.submit.ztf import submit_too_ztf
+from snipergw.tracing import span, trace_run
+
+NSIDE = 64
+
+
+class TestSimulator(TestCase):
+    """
+    Test the simulated services and the load driver
+    """
+
+    def setUp(self):
+        self.old_config = http_config.model_dump()
+        configure_http(max_delay=0.01)
+
+    def tearDown(self):
+        configure_http(**self.old_config)
+
+    def test_skymaps(self):
+        config = SimulatorConfig(
+            gracedb=ServiceConfig(error_rate=0.3), n_revisions=2, seed=1
+        )
+        with SimulatorServer(config) as simulator, tempfile.TemporaryDirectory() as d:
+            simulator.add_superevent("S190425a", BenchmarkCase(nside=NSIDE))
+            simulator.add_superevent(
+                "S190425b", BenchmarkCase(nside=NSIDE, ra=200.0, moc=True)
+            )
+            simulator.add_grb("GRB190425A", BenchmarkCase(nside=NSIDE, ra=100.0))
+
+            with simulated_services(simulator.gracedb_url, simulator.heasarc_url):
+                latest = Skymap(EventConfig(output_dir=Path(d)))
+                self.assertEqual(latest.event_name, "S190425b")
+                self.assertEqual(latest.revision, 2)
+                self.assertTrue(latest.is_moc)
+
+                first = Skymap(EventConfig(event="S190425a", rev=1, output_dir=Path(d)))
+                self.assertEqual(first.revision, 1)
+                self.assertFalse(first.is_moc)
+
+                grb = Skymap(EventConfig(event="GRB190425A", output_dir=Path(d)))
+                self.assertEqual(grb.event_name, "GRB190425A")
+
+            # Failed requests were retried
+            self.assertGreater(simulator.faults["gracedb"].n_errors, 0)
+            self.assertEqual(simulator.requests["heasarc"], 3)
+
+    def test_stand_ins(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            plan_config = PlanConfig(output_dir=Path(tmp_dir))
+            schedule = make_benchmark_schedule(10, ["g", "r"])
+
+            config = SimulatorConfig(kowalski=ServiceConfig(error_rate=1.0))
+            with simulated_services("", "", config), self.assertRaises(APIError):
+                submit_too_ztf(schedule, "S1", plan_config, submit=True)
+
+            LocalQueue.triggers = {}
+            with simulated_services("", "", SimulatorConfig()):
+                result = submit_too_ztf(schedule, "S1", plan_config, submit=True)
+            self.assertTrue(result.submitted)
+            self.assertEqual(list(LocalQueue.triggers), ["ToO_EMGW_S1_0"])
+
+    def test_alerts(self):
+        self.assertEqual(get_gw_name("190425", 0), "S190425a")
+        self.assertEqual(get_gw_name("190425", 27), "S190425ab")
+
+        alerts = make_alerts(30, BenchmarkCase(nside=NSIDE), grb_fraction=0.9, seed=1)
+        names = [x.event for x in alerts]
+        self.assertEqual(len(set(names)), 30)
+        self.assertEqual(len([x for x in alerts if x.kind == "grb"]), 27)
+        self.assertIn("GRB190426A", names)
+        self.assertEqual(len({(x.case.ra, x.case.dec) for x in alerts}), 30)
+
+    def test_stage_latencies(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_dir = Path(tmp_dir)
+            for _ in range(3):
+                with trace_run(output_dir, event="S1"):
+                    with span("plan", telescope="ZTF"):
+                        pass
+
+            stages = get_stage_latencies(output_dir.joinpath("traces.jsonl"))
+
+        self.assertEqual([x["stage"] for x in stages], ["plan[ZTF]", "run"])
+        self.assertEqual(stages[0]["n"], 3)
+        self.assertLessEqual(stages[0]["p50"], stages[0]["max"])
+        self.assertEqual(json.loads(json.dumps(stages))[1]["n"], 3)
@@ -0,0 +1,127 @@
+import pickle
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+import healpy as hp
+import numpy as np
+from astropy.io import fits
+
+from snipergw.model import EventConfig
+from snipergw.skymap import Skymap
+
+NSIDE = 16
+
+
+def write_synthetic_skymap(path: Path, moc: bool = False):
+    """
+    Write a small 3D skymap with a gaussian blob, in flat NESTED or NUNIQ format
+
+    :param path: Output path
+    :param moc: Whether to write a multi-order skymap
+    """
+    npix = hp.nside2npix(NSIDE)
+    vecs = np.array(hp.pix2vec(NSIDE, np.arange(npix), nest=True)).T
+    centre = hp.ang2vec(np.deg2rad(70.0), np.deg2rad(245.0))
+    ang = np.rad2deg(np.arccos(np.clip(vecs @ centre, -1.0, 1.0)))
+    prob = np.exp(-0.5 * (ang / 10.0) ** 2)
+    prob /= np.sum(prob)
+
+    if moc:
+        uniq = 4 * 4 ** hp.nside2order(NSIDE) + np.arange(npix)
+        columns = [
+            fits.Column(name="UNIQ", format="K", array=uniq),
+            fits.Column(
+                name="PROBDENSITY", format="D", array=prob / hp.nside2pixarea(NSIDE)
+            ),
+        ]
+    else:
+        columns = [fits.Column(name="PROB", format="D", array=prob)]
+
+    columns += [
+        fits.Column(name=name, format="D", array=np.full(npix, value))
+        for name, value in [("DISTMU", 100.0), ("DISTSIGMA", 20.0), ("DISTNORM", 1e-4)]
+    ]
+
+    hdu = fits.BinTableHDU.from_columns(columns)
+    hdu.header["ORDERING"] = "NUNIQ" if moc else "NESTED"
+    hdu.header["DATE-OBS"] = "2019-04-25T08:18:05"
+    hdu.header["DISTMEAN"] = 100.0
+    hdu.header["DISTSTD"] = 20.0
+    fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(path)
+
+    return prob
+
+
+class TestSkymap(TestCase):
+    """
+    Test reading skymaps
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = Path(self.tmp_dir.name)
+        self.skymap_dir = self.output_dir.joinpath("skymaps")
+        self.skymap_dir.mkdir()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_skymap(self, name: str) -> Skymap:
+        return Skymap(event_config=EventConfig(event=name, output_dir=self.output_dir))
+
+    def test_flat_skymap(self):
+        prob = write_synthetic_skymap(self.skymap_dir.joinpath("flat.fits"))
+        skymap = self.get_skymap("flat.fits")
+
+        self.assertFalse(skymap.is_moc)
+        self.assertTrue(skymap.has_distance)
+        self.assertEqual(skymap.t_obs.isot, "2019-04-25T08:18:05.000")
+        self.assertNotIn("hdul", skymap.__dict__)
+
+        map_struct = skymap.get_map_struct(nside=NSIDE)
+        np.testing.assert_allclose(map_struct["prob"], hp.reorder(prob, n2r=True))
+        np.testing.assert_allclose(map_struct["distmu"], 100.0)
+
+        restored = pickle.loads(pickle.dumps(skymap))
+        np.testing.assert_allclose(restored.get_column("PROB"), prob)
+        skymap.close()
+
+    def test_moc_skymap(self):
+        prob = write_synthetic_skymap(
+            self.skymap_dir.joinpath("test.multiorder.fits"), moc=True
+        )
+        skymap = self.get_skymap("test.multiorder.fits")
+
+        self.assertTrue(skymap.is_moc)
+
+        map_struct = skymap.get_map_struct(nside=NSIDE)
+        np.testing.assert_allclose(map_struct["prob"], hp.reorder(prob, n2r=True))
+
+        map_struct = skymap.get_map_struct(nside=NSIDE // 2)
+        self.assertEqual(len(map_struct["prob"]), hp.nside2npix(NSIDE // 2))
+        self.assertAlmostEqual(np.sum(map_struct["prob"]), 1.0)
+        skymap.close()
+
+    def test_preprocess_crop(self):
+        write_synthetic_skymap(
+            self.skymap_dir.joinpath("test.multiorder.fits"), moc=True
+        )
+        skymap = self.get_skymap("test.multiorder.fits")
+
+        full = skymap.preprocess(nside=NSIDE)
+        sparse = skymap.preprocess(nside=NSIDE, credible_level=0.9)
+
+        self.assertIs(sparse, skymap.preprocess(nside=NSIDE, credible_level=0.9))
+        self.assertEqual(full.n_pixels, hp.nside2npix(NSIDE))
+        self.assertLess(sparse.n_pixels, full.n_pixels)
+        self.assertGreaterEqual(np.sum(sparse.prob), 0.9)
+        self.assertLess(np.sum(sparse.prob) - np.max(sparse.prob), 0.9)
+
+        map_struct = sparse.to_map_struct()
+        self.assertEqual(len(map_struct["prob"]), hp.nside2npix(NSIDE))
+        self.assertAlmostEqual(np.sum(map_struct["prob"]), np.sum(sparse.prob))
+        self.assertEqual(
+            np.sum(np.isinf(map_struct["distmu"])), full.n_pixels - sparse.n_pixels
+        )
+        skymap.close()
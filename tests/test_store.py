@@ -0,0 +1,139 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+import requests
+from astropy.io import fits
+
+from snipergw.model import EventConfig
+from snipergw.skymap import Skymap
+from snipergw.store import SkymapStore
+
+
+def write_test_fits(path: Path, date_obs: str = "2019-04-25T08:18:05"):
+    """
+    Write a tiny fits file with a probability column
+
+    :param path: Output path
+    :param date_obs: Value of DATE-OBS
+    """
+    hdu = fits.BinTableHDU.from_columns(
+        [fits.Column(name="PROB", format="D", array=np.ones(12) / 12.0)]
+    )
+    hdu.header["DATE-OBS"] = date_obs
+    hdu.header["ORDERING"] = "NESTED"
+    hdu.writeto(path)
+
+
+class TestStore(TestCase):
+    """
+    Test the skymap store
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = Path(self.tmp_dir.name)
+        self.store = SkymapStore(self.output_dir.joinpath("skymaps"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def add_test_map(
+        self,
+        event: str = "S190425z",
+        revision: int | None = 2,
+        source_url: str = "https://example.org/bayestar.fits",
+    ):
+        tmp_path = self.store.new_tmp_path("bayestar.fits")
+        write_test_fits(tmp_path)
+        return self.store.add(
+            tmp_path, event=event, revision=revision, source_url=source_url
+        )
+
+    def test_add_and_resolve(self):
+        record = self.add_test_map()
+
+        self.assertEqual(record.header["DATE-OBS"], "2019-04-25T08:18:05")
+        self.assertTrue(self.store.get_path(record).exists())
+
+        resolved = self.store.resolve(event="S190425z", revision=2)
+        self.assertEqual(resolved.sha256, record.sha256)
+        self.assertIsNone(self.store.resolve(event="S190425z", revision=3))
+
+    def test_corrupt_file_is_dropped(self):
+        record = self.add_test_map()
+        path = self.store.get_path(record)
+
+        with open(path, "r+b") as f:
+            f.truncate(record.size // 2)
+
+        self.assertIsNone(self.store.resolve(event="S190425z", revision=2))
+        self.assertFalse(path.exists())
+
+    def test_corrupt_object_replaced(self):
+        record = self.add_test_map()
+        path = self.store.get_path(record)
+
+        with open(path, "r+b") as f:
+            f.truncate(record.size // 2)
+
+        # Adding the same content again replaces the corrupt object
+        record = self.add_test_map(revision=3)
+        self.assertEqual(path, self.store.get_path(record))
+        self.assertTrue(self.store.verify(record))
+        self.assertIsNotNone(self.store.resolve(event="S190425z", revision=2))
+
+    def test_offline_skymap(self):
+        self.add_test_map(revision=1)
+        self.add_test_map(revision=2)
+
+        skymap = Skymap(
+            event_config=EventConfig(
+                event="S190425z", output_dir=self.output_dir, offline=True
+            )
+        )
+
+        self.assertEqual(skymap.revision, 2)
+        self.assertEqual(skymap.t_obs.isot, "2019-04-25T08:18:05.000")
+
+        with self.assertRaises(FileNotFoundError):
+            Skymap(
+                event_config=EventConfig(
+                    event="S200105ae", output_dir=self.output_dir, offline=True
+                )
+            )
+
+    def test_new_grb_version(self):
+        url = "https://example.org/triggers/glg_healpix_all_bn190425089_v0{}.fit"
+        self.add_test_map(event="GRB190425A", revision=None, source_url=url.format(0))
+
+        def download(skymap, url, event_name, file_name, **kwargs):
+            return self.add_test_map(event=event_name, revision=None, source_url=url)
+
+        def get_grb(offline: bool = False) -> Skymap:
+            return Skymap(
+                event_config=EventConfig(
+                    event="GRB190425A", output_dir=self.output_dir, offline=offline
+                )
+            )
+
+        with (
+            patch.object(Skymap, "download_to_store", download),
+            patch(
+                "snipergw.skymap.get_grb_skymap_urls",
+                return_value={"GRB190425A": url.format(1)},
+            ) as discovery,
+        ):
+            # Online, a newer version is downloaded even if one is stored
+            self.assertEqual(get_grb().record.source_url, url.format(1))
+
+            # Offline, the stored skymap is used without discovery
+            discovery.reset_mock()
+            self.assertEqual(get_grb(offline=True).record.source_url, url.format(1))
+            discovery.assert_not_called()
+
+            # If discovery fails, the stored skymap is used
+            discovery.side_effect = requests.ConnectionError("HEASARC is down")
+            self.assertEqual(get_grb().record.source_url, url.format(1))
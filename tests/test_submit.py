@@ -0,0 +1,179 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+import pandas as pd
+from helpers import make_schedule
+from planobs.api import APIError
+
+from snipergw.incremental import PLAN_STATE_NAME, PlanState
+from snipergw.model import PlanConfig
+from snipergw.schedule import Schedule
+from snipergw.submit import get_submitter, submit_too_ztf
+from snipergw.submit.ledger import SubmissionLedger, get_ledger_path
+from snipergw.submit.ztf import build_ztf_targets, wait_for_trigger
+
+
+class FakeQueue:
+    """
+    Stand-in for the Kowalski queue, where a trigger appears after a few polls
+    """
+
+    def __init__(self, n_polls: int):
+        self.n_polls = n_polls
+        self.n_calls = 0
+
+    def get_too_queues_nameonly(self) -> list[str]:
+        self.n_calls += 1
+        if self.n_calls == 1:
+            raise APIError("Kowalski is unavailable")
+        if self.n_calls >= self.n_polls:
+            return ["ToO_EMGW_S230529ay_0"]
+        return []
+
+
+class FakeKowalski:
+    """
+    Stand-in for the Kowalski queue, keeping the submitted triggers in memory
+    """
+
+    triggers: dict[str, list] = {}
+
+    def __init__(self, user: str):
+        self.queue = []
+
+    def add_trigger_to_queue(self, targets: list, trigger_name: str, **kwargs):
+        self.queue.append((f"{trigger_name}_{len(self.queue)}", targets))
+
+    def submit_queue(self):
+        self.triggers.update(self.queue)
+
+    def delete_queue(self):
+        for name, _ in self.queue:
+            self.delete_trigger(name)
+
+    def delete_trigger(self, name: str):
+        if name not in self.triggers:
+            raise APIError(f"Trigger {name} not in queue")
+        del self.triggers[name]
+
+    def get_too_queues_nameonly(self) -> list[str]:
+        return list(self.triggers)
+
+
+class TestSubmit(TestCase):
+    """
+    Test the submission backends, without contacting any server
+    """
+
+    def test_registry(self):
+        self.assertIs(get_submitter("ZTF"), submit_too_ztf)
+        with self.assertRaises(NotImplementedError):
+            get_submitter("DECam")
+
+    def test_build_ztf_targets(self):
+        schedule = Schedule.from_dataframe(
+            pd.DataFrame(
+                {
+                    "field": [584, 583, 584],
+                    "filter": ["g", "g", "r"],
+                    "texp": [299, 299, 299],
+                }
+            )
+        )
+
+        targets = build_ztf_targets(schedule, subprogram="EMGW")
+        self.assertEqual([x.request_id for x in targets], [0, 1, 2])
+        self.assertEqual([x.filter_id for x in targets], [1, 1, 2])
+        self.assertEqual(targets[0].subprogram_name, "ToO_EMGW")
+        self.assertEqual(targets[0].program_id, 2)
+
+        schedule["filter"] = ["g", "g", "J"]
+        with self.assertRaises(ValueError):
+            build_ztf_targets(schedule, subprogram="EMGW")
+
+    def test_wait_for_trigger(self):
+        queue = FakeQueue(n_polls=3)
+        wait_for_trigger(
+            queue,
+            "ToO_EMGW_S230529ay_0",
+            deadline=5.0,
+            initial_delay=0.01,
+            max_delay=0.01,
+        )
+        self.assertEqual(queue.n_calls, 3)
+
+        with self.assertRaises(RuntimeError):
+            wait_for_trigger(
+                FakeQueue(n_polls=1000),
+                "ToO_EMGW_S230529ay_0",
+                deadline=0.05,
+                initial_delay=0.01,
+                max_delay=0.01,
+            )
+
+    @patch("snipergw.submit.ztf.Queue", FakeKowalski)
+    def test_submit_delta(self):
+        FakeKowalski.triggers = {}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            plan_config = PlanConfig(output_dir=Path(tmp_dir), incremental=True)
+            event = "S230529ay"
+
+            result = submit_too_ztf(
+                make_schedule([1, 2]), event, plan_config, submit=True
+            )
+            self.assertEqual(result.trigger_name, f"ToO_EMGW_{event}_0_0")
+            self.assertEqual(result.n_targets, 2)
+
+            # An unchanged schedule is not resubmitted
+            result = submit_too_ztf(
+                make_schedule([1, 2]), event, plan_config, submit=True
+            )
+            self.assertFalse(result.submitted)
+            self.assertEqual(len(FakeKowalski.triggers), 1)
+
+            # New targets are added as a new trigger
+            result = submit_too_ztf(
+                make_schedule([1, 2, 3]), event, plan_config, submit=True
+            )
+            self.assertEqual(result.kept_triggers, [f"ToO_EMGW_{event}_0_0"])
+            self.assertEqual(result.n_targets, 1)
+            self.assertEqual(len(FakeKowalski.triggers[result.trigger_name]), 1)
+
+            # Triggers with removed targets are replaced
+            result = submit_too_ztf(
+                make_schedule([2, 3]), event, plan_config, submit=True
+            )
+            self.assertEqual(result.removed_triggers, [f"ToO_EMGW_{event}_0_0"])
+            self.assertEqual(result.n_targets, 1)
+            self.assertEqual(len(FakeKowalski.triggers), 2)
+
+            ledger = SubmissionLedger.read(get_ledger_path(plan_config, event))
+            self.assertEqual(sorted(ledger.targets), [(2, "g"), (3, "g")])
+            self.assertEqual(sorted(ledger.names), sorted(FakeKowalski.triggers))
+
+            # Fields observed before a new revision do not count as removed
+            PlanState(
+                window_start_mjd=60000.0, window_end_mjd=60001.0, observed_fields=[2]
+            ).write(plan_config.get_output_dir(event).joinpath(PLAN_STATE_NAME))
+            result = submit_too_ztf(make_schedule([3]), event, plan_config, submit=True)
+            self.assertFalse(result.submitted)
+            self.assertEqual(result.removed_triggers, [])
+            self.assertEqual(len(FakeKowalski.triggers), 2)
+
+            # A trigger already removed from Kowalski is dropped from the ledger
+            removed = ledger.names[0]
+            del FakeKowalski.triggers[removed]
+            result = submit_too_ztf(make_schedule([4]), event, plan_config, submit=True)
+            self.assertIn(removed, result.removed_triggers)
+            ledger = SubmissionLedger.read(get_ledger_path(plan_config, event))
+            self.assertEqual(sorted(ledger.names), sorted(FakeKowalski.triggers))
+
+            # Deleting removes all the triggers of the event
+            result = submit_too_ztf(
+                make_schedule([2, 3]), event, plan_config, delete=True
+            )
+            self.assertTrue(result.deleted)
+            self.assertEqual(FakeKowalski.triggers, {})
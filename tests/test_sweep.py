@@ -0,0 +1,72 @@
+from unittest import TestCase
+
+from astropy.time import Time
+
+from snipergw.schedule import ScheduleSummary
+from snipergw.sweep import SweepResult, get_sweep_points, parse_grid, rank_sweep
+
+
+class TestSweep(TestCase):
+    """
+    Test the parameter sweep, without planning
+    """
+
+    def test_points(self):
+        grid = parse_grid(
+            [
+                ["filters", "g,r", "g,r,g"],
+                ["--airmass", "2.0", "2.5"],
+                ["starttime", "2019-04-25T09:00:00"],
+            ]
+        )
+        self.assertEqual(list(grid), ["filters", "airmass", "starttime"])
+
+        points = get_sweep_points(
+            grid, plan_kwargs={"exposuretime": 30.0}, gwemopt_args=["--doUsePrimary"]
+        )
+        self.assertEqual(len(points), 4)
+        self.assertEqual(len({x.label for x in points}), 4)
+
+        point = points[1]
+        self.assertEqual(point.params["airmass"], "2.5")
+        self.assertEqual(point.gwemopt_args, ["--doUsePrimary", "--airmass", "2.5"])
+        self.assertEqual(point.plan_config.filters, "g,r")
+        self.assertEqual(point.plan_config.exposuretime, 30.0)
+        self.assertFalse(point.plan_config.plots)
+        self.assertEqual(
+            point.plan_config.starttime,
+            Time("2019-04-25T09:00:00", format="isot", scale="utc"),
+        )
+        self.assertEqual(
+            point.plan_config.get_output_dir("S1").parts[-4:],
+            ("S1", "ZTF", "sweep", "001"),
+        )
+
+        with self.assertRaises(ValueError):
+            parse_grid([["airmass"]])
+
+    def test_rank(self):
+        def make_result(label: str, total_prob: float, duration_hours: float):
+            return SweepResult(
+                label=label,
+                params={"airmass": label},
+                summary=ScheduleSummary(
+                    n_pointings=10,
+                    n_fields=5,
+                    total_prob=total_prob,
+                    duration_hours=duration_hours,
+                ),
+            )
+
+        table = rank_sweep(
+            [
+                make_result("a", 0.5, 1.0),
+                SweepResult(label="b", params={"airmass": "b"}, error="Failed"),
+                make_result("c", 0.8, 2.0),
+                make_result("d", 0.8, 1.0),
+            ]
+        )
+        self.assertEqual(table["label"].tolist(), ["d", "c", "a", "b"])
+        self.assertEqual(table["rank"].tolist(), [1, 2, 3, 4])
+        self.assertEqual(table["error"].tolist()[-1], "Failed")
+        self.assertEqual(list(table.columns[:3]), ["rank", "label", "airmass"])
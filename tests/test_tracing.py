@@ -0,0 +1,105 @@
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from snipergw.tracing import (
+    call_traced,
+    current_span,
+    get_budget_summary,
+    span,
+    trace_run,
+    tracer,
+)
+
+
+def traced_square(x: int) -> int:
+    """
+    Square a number in a span, as a stand-in for a stage run in a worker
+
+    :param x: Number
+    :return: Square of number
+    """
+    with span("square", telescope="ZTF") as square_span:
+        square_span.set(pid=os.getpid())
+        return x**2
+
+
+class TestTracing(TestCase):
+    """
+    Test the tracing of pipeline stages
+    """
+
+    def test_spans(self):
+        with tracer.collect() as spans:
+            with span("run", event="S1") as run_span:
+                with span("plan", telescope="ZTF"):
+                    current_span().set(n_pointings=3)
+                with self.assertRaises(ValueError):
+                    with span("submit", telescope="ZTF"):
+                        raise ValueError("Kowalski is unavailable")
+
+        plan_span, submit_span, run_span = spans
+        self.assertEqual(plan_span.parent_id, run_span.span_id)
+        self.assertEqual(plan_span.trace_id, run_span.trace_id)
+        self.assertIsNone(run_span.parent_id)
+        self.assertEqual(plan_span.attributes, {"telescope": "ZTF", "n_pointings": 3})
+        self.assertEqual(submit_span.status, "error")
+        self.assertIn("Kowalski is unavailable", submit_span.error)
+        self.assertGreaterEqual(run_span.duration, plan_span.duration)
+
+        # Spans outside a collection are not kept
+        with span("other"):
+            current_span().set(ignored=True)
+        self.assertIsNone(tracer.finished)
+
+        summary = get_budget_summary(spans, budgets={"plan": 1.0, "submit": 0.0})
+        self.assertEqual([x["stage"] for x in summary], ["plan[ZTF]", "submit[ZTF]"])
+        self.assertEqual([x["over"] for x in summary], [False, True])
+
+    def test_worker_spans(self):
+        with tracer.collect() as spans:
+            with span("run") as run_span:
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    result, worker_spans = executor.submit(
+                        call_traced, tracer.current_context(), traced_square, 3
+                    ).result()
+                tracer.record(worker_spans)
+
+        self.assertEqual(result, 9)
+        self.assertEqual([x.name for x in spans], ["square", "run"])
+        self.assertEqual(spans[0].parent_id, run_span.span_id)
+        self.assertNotEqual(spans[0].attributes["pid"], os.getpid())
+
+    def test_export(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_dir = Path(tmp_dir)
+            metrics_path = output_dir.joinpath("metrics/snipergw.prom")
+
+            with patch.dict(os.environ, {"SNIPERGW_METRICS_FILE": str(metrics_path)}):
+                for _ in range(2):
+                    with trace_run(output_dir, event='S1"a'):
+                        traced_square(2)
+                        traced_square(3)
+
+            with open(output_dir.joinpath("traces.jsonl"), encoding="utf8") as f:
+                lines = [json.loads(x) for x in f]
+            self.assertEqual(
+                [x["name"] for x in lines], ["square", "square", "run"] * 2
+            )
+            self.assertNotEqual(lines[0]["trace_id"], lines[3]["trace_id"])
+
+            with open(metrics_path, encoding="utf8") as f:
+                metrics = f.read().splitlines()
+            durations = [
+                x for x in metrics if x.startswith("snipergw_stage_duration_seconds{")
+            ]
+            self.assertEqual(len(durations), 2)
+            self.assertIn(
+                'snipergw_stage_duration_seconds{stage="run",event="S1\\"a"}',
+                durations[0],
+            )
+            self.assertIn('stage="square",telescope="ZTF"', durations[1])
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import TestCase
+
+from snipergw.model import get_plan_configs
+from snipergw.simulator import SimulatorConfig, SimulatorServer, simulated_services
+from snipergw.watch import (
+    DirectorySource,
+    GraceDBPollSource,
+    Watcher,
+    get_alert_type,
+    parse_alert,
+)
+
+
+class TestWatch(TestCase):
+    """
+    Test the watch mode, with a directory source and a stand-in for planning
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.alert_dir = Path(self.tmp_dir.name)
+        self.calls = []
+        self.telescopes = set()
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_alerts(self, payloads: list[dict]):
+        for i, payload in enumerate(payloads):
+            path = self.alert_dir.joinpath(f"alert_{i:03d}.json")
+            with open(path, "w") as f:
+                json.dump(payload, f)
+
+    def fake_process(self, alert, event_config, plan_configs, gwemopt_args, submit):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.calls.append((event_config.event, event_config.rev))
+            self.telescopes.update(x.telescope for x in plan_configs)
+        time.sleep(0.1)
+        with self.lock:
+            self.active -= 1
+        if event_config.event == "S230000fail":
+            raise ValueError("Planning failed")
+        return event_config.event
+
+    def run_watcher(self, max_concurrent: int = 2) -> Watcher:
+        watcher = Watcher(
+            source=DirectorySource(self.alert_dir, once=True),
+            plan_configs=get_plan_configs(
+                telescope="ZTF,WINTER", output_dir=self.alert_dir
+            ),
+            max_concurrent=max_concurrent,
+            executor=ThreadPoolExecutor(max_workers=4),
+            process=self.fake_process,
+        )
+        asyncio.run(watcher.run())
+        return watcher
+
+    def test_parse_alert(self):
+        alert = parse_alert(
+            {
+                "superevent_id": "S230529ay",
+                "alert_type": "preliminary",
+                "time_created": "2023-05-29T18:15:11Z",
+            }
+        )
+        self.assertEqual(alert.event, "S230529ay")
+        self.assertIsNone(alert.revision)
+        self.assertEqual(alert.alert_type, "PRELIMINARY")
+
+        alert = parse_alert({"event": "S230529ay", "rev": "2"})
+        self.assertEqual(alert.revision, 2)
+        self.assertFalse(alert.is_retraction)
+        self.assertEqual(alert.key, parse_alert({"event": "S230529ay", "rev": 2}).key)
+
+        # Alerts without a revision or creation time are never duplicates
+        alert = parse_alert({"event": "S230529ay"})
+        time.sleep(0.01)
+        self.assertNotEqual(alert.key, parse_alert({"event": "S230529ay"}).key)
+
+    def test_deduplicate_and_supersede(self):
+        self.write_alerts(
+            [
+                {"event": "S230001a", "revision": 1},
+                {"event": "S230001a", "revision": 1},
+                {"event": "S230002b", "revision": 1},
+                {"event": "S230001a", "revision": 2},
+                {"event": "S230001a", "revision": 3},
+                {"event": "S230003c", "revision": 1},
+                {"event": "S230003c", "revision": 2, "alert_type": "RETRACTION"},
+                {"event": "S230000fail", "revision": 1},
+            ]
+        )
+
+        watcher = self.run_watcher(max_concurrent=2)
+
+        self.assertEqual(
+            sorted(self.calls),
+            [("S230000fail", 1), ("S230001a", 1), ("S230001a", 3), ("S230002b", 1)],
+        )
+        self.assertLess(
+            self.calls.index(("S230001a", 1)), self.calls.index(("S230001a", 3))
+        )
+        self.assertLessEqual(self.max_active, 2)
+        self.assertIsInstance(
+            watcher.results[("S230000fail", 1, "UPDATE", None)], ValueError
+        )
+        self.assertEqual(watcher.results[("S230002b", 1, "UPDATE", None)], "S230002b")
+        self.assertEqual(len(list(self.alert_dir.glob("*.json"))), 0)
+
+        # Each alert is planned for every telescope
+        self.assertEqual(self.telescopes, {"ZTF", "WINTER"})
+
+    def test_concurrency_limit(self):
+        self.write_alerts([{"event": f"S23000{i}a", "revision": 1} for i in range(5)])
+        self.run_watcher(max_concurrent=1)
+        self.assertEqual(len(self.calls), 5)
+        self.assertEqual(self.max_active, 1)
+
+    def test_poll_gracedb(self):
+        self.assertEqual(get_alert_type("RE"), "RETRACTION")
+        self.assertEqual(get_alert_type(None), "UPDATE")
+
+        with SimulatorServer(SimulatorConfig(n_revisions=2)) as simulator:
+            simulator.superevents = {
+                "S190426a": "S190426a.fits",
+                "S190425a": "S190425a.fits",
+            }
+            simulator.retract("S190425a")
+
+            source = GraceDBPollSource(index_dir=self.alert_dir.joinpath("skymaps"))
+            with simulated_services(simulator.gracedb_url, simulator.heasarc_url):
+                alerts = source.poll()
+                self.assertEqual(
+                    [(x.event, x.revision, x.alert_type) for x in alerts],
+                    [("S190426a", 2, "PRELIMINARY"), ("S190425a", 3, "RETRACTION")],
+                )
+                self.assertFalse(alerts[0].is_retraction)
+                self.assertTrue(alerts[1].is_retraction)
+
+                # Later polls list one page of superevents, and only fetch
+                # the VOEvents of superevents which are not retracted
+                n_before = simulator.requests["gracedb"]
+                self.assertEqual(
+                    [x.key for x in source.poll()], [x.key for x in alerts]
+                )
+                self.assertEqual(simulator.requests["gracedb"] - n_before, 2)
@@ -0,0 +1,183 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+import gwemopt.run
+import numpy as np
+from astropy.time import Time
+from gwemopt.args import parse_args
+from gwemopt.params import params_struct
+from test_skymap import write_synthetic_skymap
+
+from snipergw.benchmark import (
+    SYNTHETIC_STARTTIME,
+    BenchmarkCase,
+    write_benchmark_skymap,
+)
+from snipergw.model import EventConfig, PlanConfig
+from snipergw.plan import run_gwemopt
+from snipergw.planner import WarmCache, get_params, run_gwemopt_planner, warm_cache
+from snipergw.skymap import Skymap
+from snipergw.worker import PlanningWorker
+
+
+class TestWarmCache(TestCase):
+    """
+    Test the warm planning state
+    """
+
+    def test_lru(self):
+        cache = WarmCache(max_size=2)
+        calls = []
+
+        def factory(x):
+            calls.append(x)
+            return x
+
+        for key in ["a", "b", "a", "c", "a", "b"]:
+            self.assertEqual(cache.get((key,), lambda: factory(key)), key)
+
+        # b is evicted by c, as a was used more recently
+        self.assertEqual(calls, ["a", "b", "c", "b"])
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+        self.assertEqual(len(cache), 2)
+
+    def test_params(self):
+        args = parse_args(
+            [
+                "--telescopes",
+                "ZTF",
+                "--doSingleExposure",
+                "--filters",
+                "g,r",
+                "--exposuretimes",
+                "60,60",
+            ]
+        )
+        expected = params_struct(args)
+
+        for _ in range(2):
+            params = get_params(args)
+            self.assertEqual(sorted(params), sorted(expected))
+
+            config = params["config"]["ZTF"]
+            expected_config = expected["config"]["ZTF"]
+            self.assertEqual(sorted(config), sorted(expected_config))
+            np.testing.assert_array_equal(
+                config["tesselation"], expected_config["tesselation"]
+            )
+            self.assertEqual(config["magnitude"], expected_config["magnitude"])
+            self.assertEqual(
+                config["reference_images"], expected_config["reference_images"]
+            )
+
+            # Each plan gets its own copy of the configuration
+            config["segmentlist"] = []
+            self.assertNotIn(
+                "segmentlist",
+                warm_cache.get(("config", "ZTF", 60.0, False), dict),
+            )
+
+
+class TestPlanner(TestCase):
+    """
+    Test the planner against gwemopt's own run()
+    """
+
+    def test_matches_gwemopt(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_dir = Path(tmp_dir)
+            skymap_path = output_dir.joinpath("skymaps/synthetic.fits")
+            skymap_path.parent.mkdir()
+            write_benchmark_skymap(skymap_path, BenchmarkCase(nside=64))
+
+            def get_args(name: str) -> list[str]:
+                return [
+                    "--telescopes",
+                    "ZTF",
+                    "--doTiles",
+                    "--doSchedule",
+                    "--timeallocationType",
+                    "powerlaw",
+                    "--scheduleType",
+                    "greedy",
+                    "-o",
+                    str(output_dir.joinpath(name)),
+                    "--gpstime",
+                    str(Time(SYNTHETIC_STARTTIME).gps),
+                    "--event",
+                    str(skymap_path),
+                    "--filters",
+                    "g",
+                    "--exposuretimes",
+                    "30",
+                    "--doSingleExposure",
+                    "--doBalanceExposure",
+                    "--nside",
+                    "64",
+                ]
+
+            skymap = Skymap(
+                event_config=EventConfig(event="synthetic.fits", output_dir=output_dir)
+            )
+            try:
+                # Without --doPlots, the (slow) coverage plots are skipped
+                with patch("snipergw.planner.make_coverage_plots") as plot:
+                    run_gwemopt_planner(skymap, get_args("snipergw"))
+                plot.assert_not_called()
+            finally:
+                skymap.close()
+
+            # gwemopt always makes the coverage plots, which do not change the plan
+            with patch("gwemopt.run.make_coverage_plots"):
+                gwemopt.run.run(get_args("gwemopt"))
+
+            expected = output_dir.joinpath("gwemopt/schedule_ZTF.dat").read_text()
+            schedule = output_dir.joinpath("snipergw/schedule_ZTF.dat").read_text()
+
+        self.assertGreater(len(expected.splitlines()), 0)
+        self.assertEqual(schedule, expected)
+
+
+class TestPlanningWorker(TestCase):
+    """
+    Test the long-lived planning worker
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = Path(self.tmp_dir.name)
+        self.output_dir.joinpath("skymaps").mkdir()
+        write_synthetic_skymap(self.output_dir.joinpath("skymaps/flat.fits"))
+        self.skymap = Skymap(
+            event_config=EventConfig(event="flat.fits", output_dir=self.output_dir)
+        )
+        self.plan_config = PlanConfig(
+            output_dir=self.output_dir,
+            starttime=Time("2019-04-25T09:00:00", format="isot", scale="utc"),
+            cache=False,
+        )
+
+    def tearDown(self):
+        self.skymap.close()
+        self.tmp_dir.cleanup()
+
+    def test_args_not_modified(self):
+        gwemopt_args = ["--tilesType", "unknown"]
+        with self.assertRaises(ValueError):
+            run_gwemopt(self.skymap, self.plan_config, gwemopt_args)
+        self.assertEqual(gwemopt_args, ["--tilesType", "unknown"])
+
+    def test_errors(self):
+        with PlanningWorker() as worker:
+            for _ in range(2):
+                with self.assertRaisesRegex(ValueError, "Unrecognised tilesType"):
+                    worker.plan(
+                        self.skymap, self.plan_config, ["--tilesType", "unknown"]
+                    )
+            self.assertTrue(worker.is_alive)
+
+        self.assertFalse(worker.is_alive)
+        with self.assertRaises(RuntimeError):
+            worker.plan(self.skymap, self.plan_config)